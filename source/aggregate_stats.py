@@ -0,0 +1,105 @@
+"""Aggregate statistics of several architectures at once: the combined top packages across all of them, how each of
+those packages' files are split between the architectures, and which packages differ the most from the first
+architecture.
+
+Everything is built from the full package counts of each architecture, from a single pass over each contents index.
+The top counts cached for single architectures can't be used instead, since a package that falls just short of the top
+in every architecture can still make the top of the combined counts."""
+from collections import Counter
+import constants as cons
+import heapq
+from itertools import compress
+from package_counts import get_top
+
+
+def get_aggregate_key(architectures: list[str]) -> str:
+    """Returns the cache key of the aggregate statistics of <architectures>. The order matters, since the differences
+    are measured from the first architecture."""
+    return cons.AGGREGATE_KEY_PREFIX + "+".join(architectures)
+
+
+def get_shared_architecture(arch: str) -> str:
+    """Returns the architecture whose contents index lists the architecture-independent packages of the family <arch>
+    belongs to ("all" for debs, "udeb-all" for udebs), or an empty string if its family has none, as with "source"."""
+    if arch in cons.UNSHARED_ARCHITECTURES:
+        return ""
+
+    for prefix, shared_arch in cons.SHARED_ARCHITECTURES.items():
+        if arch.startswith(prefix):
+            return shared_arch
+
+    return ""
+
+
+def add_shared_architecture(architectures: list[str]) -> list[str]:
+    """Returns <architectures> with the shared architecture of each of their families (see get_shared_architecture())
+    added at the end, unless it's already one of them. Architecture-independent packages are only listed in the shared
+    architecture's contents index, not in those of each architecture."""
+    shared_architectures = [get_shared_architecture(arch) for arch in architectures]
+    # dict.fromkeys() drops the duplicates while keeping the order
+    missing_architectures = [shared_arch for shared_arch in dict.fromkeys(shared_architectures)
+                             if shared_arch and shared_arch not in architectures]
+    return [*architectures, *missing_architectures]
+
+
+def build_aggregate(arch_counts: dict[str, dict[bytes, int]], size: int) -> dict:
+    """Returns the aggregate statistics of the full package counts of each architecture in <arch_counts>:
+        packages    - the top <size> packages of the combined counts, as from main.sort_package_file_counts()
+        breakdown   - the count in each architecture of every one of those packages, leaving out zero counts
+        differences - for every architecture after the first, except the shared ones, the <size> packages whose
+                      counts differ the most from the first architecture's (see get_differences())"""
+    combined_counts = Counter()
+    for counts in arch_counts.values():
+        combined_counts.update(counts)
+
+    top_packages = get_top(combined_counts, size)
+    breakdown = {package.decode(): {arch: counts[package] for arch, counts in arch_counts.items() if package in counts}
+                 for package, _ in top_packages}
+
+    base_arch, *other_architectures = arch_counts
+    differences = {arch: get_differences(arch_counts[base_arch], arch_counts[arch], size)
+                   for arch in other_architectures if arch not in cons.SHARED_ARCHITECTURES.values()}
+
+    return {"packages": {package.decode(): file_count for package, file_count in top_packages},
+            "breakdown": breakdown,
+            "differences": differences}
+
+
+def get_differences(base_counts: dict[bytes, int], other_counts: dict[bytes, int], size: int) -> dict[str, int]:
+    """Returns the <size> packages whose counts differ the most between <base_counts> and <other_counts>, along with
+    how many more files they have in <other_counts> (negative if fewer). A package missing from one side counts as zero
+    there. Sorted by the size of the difference, largest first, with ties broken by package name."""
+    packages = list(dict.fromkeys([*base_counts, *other_counts]))
+    differences = [other_counts.get(package, 0) - base_counts.get(package, 0) for package in packages]
+    sizes = list(map(abs, differences))
+    if size < 1 or not any(sizes):
+        return {}
+
+    # Same as package_counts.get_top(): only the packages at or above the size-th largest difference are sorted
+    threshold = max(1, heapq.nlargest(size, sizes)[-1])
+    candidate_ids = compress(range(len(packages)), map(threshold.__le__, sizes))
+    top_ids = sorted(candidate_ids, key=lambda package_id: (-sizes[package_id], packages[package_id]))[:size]
+    return {packages[package_id].decode(errors="surrogateescape"): differences[package_id] for package_id in top_ids}
+
+
+def is_valid_aggregate_entry(aggregate_stats: dict, server_validators: dict[str, dict]) -> bool:
+    """Returns True if the cached <aggregate_stats> were built from the current contents index of every architecture
+    in <server_validators> (architecture to its validators from main.get_server_validators()), and hold at least
+    <cons.SHOW_COUNT> packages. Validators are compared the same way as main.exists_valid_cache_entry() does."""
+    if not aggregate_stats or len(aggregate_stats["packages"]) < cons.SHOW_COUNT:
+        return False
+    elif list(aggregate_stats["architectures"]) != list(server_validators):
+        return False
+
+    for arch, validators in server_validators.items():
+        cached_validators = aggregate_stats["architectures"][arch]
+        if validators.get("sha256") and cached_validators.get("sha256"):
+            if cached_validators["sha256"] != validators["sha256"]:
+                return False
+        elif validators["etag"] and cached_validators.get("etag"):
+            if cached_validators["etag"] != validators["etag"]:
+                return False
+        elif not validators["last_modified"] or cached_validators["last_modified"] != validators["last_modified"]:
+            return False
+
+    return True
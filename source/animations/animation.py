@@ -1,7 +1,7 @@
 """Class for custom CLI animations."""
 import constants as cons
+import sys
 import threading
-import time
 
 
 # P: Unless there's a clear reason to choose OOP, I always learn towards FP, and originally wrote this without a class.
@@ -9,24 +9,39 @@ import time
 #    happy with that choice.
 
 class Animation:
-    def __init__(self, action: callable, time_delay: float = cons.ANIMATION_DELAY):
+    def __init__(self, action: callable, time_delay: float = cons.ANIMATION_DELAY, enabled: bool | None = None):
+        """<enabled> defaults to whether stdout is a terminal. Otherwise, as when the output is piped or redirected to a
+        file, start() and stop() do nothing."""
         self.action = action
         self.time_delay = time_delay
+        self.enabled = sys.stdout.isatty() if enabled is None else enabled
         self._run_flag = False
+        self._wake_event = threading.Event()
         self._thread = threading.Thread(target=self._animation)
 
     def start(self) -> None:
+        if not self.enabled:
+            return
+
         self._run_flag = True
         self._thread.start()
         return
 
     def stop(self) -> None:
+        """Stops the animation and waits for its thread to finish, which doesn't wait out the rest of the delay."""
+        # P: The thread used to sleep through the rest of its delay before noticing it was stopped, which added up to a
+        #    whole delay to any run that ended right after an animation, such as every cache hit.
+        if not self._run_flag:
+            return
+
         self._run_flag = False
+        self._wake_event.set()
+        self._thread.join()
         return
 
     def _animation(self) -> None:
         while self._run_flag:
             self.action()
-            time.sleep(self.time_delay)
+            self._wake_event.wait(self.time_delay)
 
         return
@@ -1,7 +1,7 @@
 """Functions here are meant to be used as the action for the Animation class."""
-from colorama import Fore
 
 
 def dots() -> None:
-    print(f"{Fore.GREEN}.{Fore.RESET}", end="", flush=True)
+    import constants as cons  # Not at the top, since constants imports this module for its DEFAULT_ANIMATION
+    print(f"{cons.GREEN}.{cons.RESET}", end="", flush=True)
     return
@@ -0,0 +1,181 @@
+"""Benchmarks each phase of the parse/count/sort pipeline on synthetic contents indices, with no mirror needed.
+
+Run from the source directory:
+    python -m benchmarks.bench_pipeline --lines 10000 1000000 --repeat 3
+    python -m benchmarks.bench_pipeline --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Each phase runs in a freshly spawned process, so its peak RSS isn't inflated by earlier phases. Results are saved as
+JSON in <RESULTS_DIRECTORY> (or --output) for comparing runs. Throughput in MB/s is of uncompressed data."""
+import argparse
+from benchmarks.contents_generator import write_contents_index
+import bulk_parser as bulk
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import decompression as decomp
+import gzip
+import json
+import main
+from metrics import get_peak_rss_mb
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+DATA_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "data")
+RESULTS_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "results")
+DEFAULT_LINE_COUNTS = (10_000, 100_000, 1_000_000)
+CHUNK_SIZE = 64 * 1024  # Matches constants.DOWNLOAD_CHUNK_SIZE, so chunks look like a streamed download
+
+
+def time_decompress(chunks: list[bytes]) -> None:
+    for _ in decomp.iter_gzip_blocks(chunks):
+        pass
+    return
+
+
+def time_count_reference(chunks: list[bytes]) -> None:
+    main.sort_package_file_counts(main.tally_package_file_associations(decomp.iter_gzip_lines(chunks)))
+    return
+
+
+def time_count_bulk(chunks: list[bytes]) -> None:
+    main.sort_package_file_counts(bulk.tally_package_files(decomp.iter_gzip_blocks(chunks)))
+    return
+
+
+def time_end_to_end(chunks: list[bytes]) -> None:
+    # Same path as main.count_contents_index(), minus the download and the caches
+    main.sort_package_file_counts(main.tally_gzipped_contents(main.decompress_contents_index(chunks)))
+    return
+
+
+# Phase name to the function it times. Sorting is timed on its own, on a count prepared before the timer starts.
+PHASES = {"decompress": time_decompress,
+          "count_reference": time_count_reference,
+          "count_bulk": time_count_bulk,
+          "sort": None,
+          "end_to_end": time_end_to_end}
+
+
+def run_phase(phase: str, path: str, repeat: int) -> dict:
+    """Runs <phase> on the contents index at <path> <repeat> times, returning the best time and the peak RSS. Meant to
+    be run in a fresh process."""
+    with open(path, "rb") as file:
+        compressed = file.read()
+    chunks = [compressed[i:i + CHUNK_SIZE] for i in range(0, len(compressed), CHUNK_SIZE)]
+
+    phase_function = PHASES[phase]
+    if phase == "sort":
+        counts = bulk.tally_package_files(decomp.iter_gzip_blocks(chunks))
+
+        def phase_function(_: list[bytes]) -> None:
+            main.sort_package_file_counts(counts)
+            return
+
+    baseline_rss_mb = get_peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        phase_function(chunks)
+        timings.append(time.perf_counter() - start)
+
+    return {"seconds": min(timings), "baseline_rss_mb": baseline_rss_mb, "peak_rss_mb": get_peak_rss_mb()}
+
+
+def get_contents_index(lines: int, seed: int) -> tuple[str, int]:
+    """Returns the path of a synthetic contents index with <lines> rows, generating it only if it isn't already there,
+    along with its uncompressed size in bytes."""
+    os.makedirs(DATA_DIRECTORY, exist_ok=True)
+    path = os.path.join(DATA_DIRECTORY, f"Contents-synthetic-{lines}-{seed}.gz")
+    if not os.path.exists(path):
+        print(f"Generating {lines} lines", flush=True)
+        temporary_path = f"{path}.tmp"
+        write_contents_index(temporary_path, lines, seed)
+        os.replace(temporary_path, path)
+
+    uncompressed_bytes = 0
+    with gzip.open(path, "rb") as file:
+        while block := file.read(1024 * 1024):
+            uncompressed_bytes += len(block)
+
+    return path, uncompressed_bytes
+
+
+def run_benchmarks(line_counts: list[int], phases: list[str], repeat: int, seed: int) -> dict:
+    """Runs every phase in <phases> on a synthetic contents index of each size in <line_counts>."""
+    results = []
+    spawn_context = multiprocessing.get_context("spawn")
+    for lines in line_counts:
+        path, uncompressed_bytes = get_contents_index(lines, seed)
+        compressed_bytes = os.path.getsize(path)
+        phase_results = {}
+        for phase in phases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn_context) as executor:
+                phase_result = executor.submit(run_phase, phase, path, repeat).result()
+
+            seconds = phase_result["seconds"]
+            phase_result["lines_per_second"] = round(lines / seconds) if seconds else None
+            phase_result["mb_per_second"] = round(uncompressed_bytes / 1e6 / seconds, 2) if seconds else None
+            phase_results[phase] = phase_result
+            print(f"{lines:>10} lines  {phase:<16} {seconds:8.3f} s  {phase_result['lines_per_second'] or 0:>12,} "
+                  f"lines/s  peak RSS {phase_result['peak_rss_mb']} MB", flush=True)
+
+        results.append({"lines": lines, "seed": seed, "compressed_bytes": compressed_bytes,
+                        "uncompressed_bytes": uncompressed_bytes, "phases": phase_results})
+
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": repeat,
+            "results": results}
+
+
+def compare_results(old_path: str, new_path: str) -> None:
+    """Prints how much faster or slower each phase is in <new_path> than in <old_path>."""
+    with open(old_path) as file:
+        old_results = {result["lines"]: result["phases"] for result in json.load(file)["results"]}
+    with open(new_path) as file:
+        new_results = {result["lines"]: result["phases"] for result in json.load(file)["results"]}
+
+    for lines in sorted(old_results.keys() & new_results.keys()):
+        for phase in old_results[lines].keys() & new_results[lines].keys():
+            old_seconds = old_results[lines][phase]["seconds"]
+            new_seconds = new_results[lines][phase]["seconds"]
+            print(f"{lines:>10} lines  {phase:<16} {old_seconds:8.3f} s -> {new_seconds:8.3f} s  "
+                  f"({old_seconds / new_seconds:.2f}x)")
+
+    return
+
+
+def main_benchmark(arguments: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_pipeline")
+    parser.add_argument("--lines", type=int, nargs="+", default=list(DEFAULT_LINE_COUNTS))
+    parser.add_argument("--phases", nargs="+", choices=list(PHASES), default=list(PHASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Path of the JSON results file. Defaults to a timestamped file in "
+                                         f"{RESULTS_DIRECTORY}")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two results files and exit")
+    options = parser.parse_args(arguments)
+
+    if options.compare:
+        compare_results(*options.compare)
+        return
+
+    results = run_benchmarks(options.lines, options.phases, options.repeat, options.seed)
+    output_path = options.output or os.path.join(RESULTS_DIRECTORY,
+                                                  f"pipeline-{results['created'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"Results saved to {output_path}")
+    return
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1:])
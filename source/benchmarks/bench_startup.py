@@ -0,0 +1,166 @@
+"""Benchmarks how long the program takes to start, and to answer a warm-cache hit, with no mirror needed.
+
+Run from the source directory:
+    python -m benchmarks.bench_startup --repeat 20
+    python -m benchmarks.bench_startup --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Every scenario runs as a fresh Python process, the same way a shell prompt or script would run the program:
+    interpreter - Python itself starting and exiting, the floor under every other scenario
+    import_main - importing main.py, without running anything
+    warm_hit    - analyzing an architecture whose statistics, and the Release file confirming them, are already cached
+
+The warm hit runs in a temporary directory with a prepared cache, against a mirror that refuses connections, so any
+network I/O makes it fail instead of quietly measuring a download. Each scenario is also run once under -X importtime,
+to record its total import time and which of <HEAVY_MODULES> it imported. Results are saved as JSON in
+<RESULTS_DIRECTORY> (or --output) for comparing runs."""
+import argparse
+import cache_store
+import constants as cons
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIRECTORY = os.path.dirname(BENCHMARKS_DIRECTORY)
+RESULTS_DIRECTORY = os.path.join(BENCHMARKS_DIRECTORY, "results")
+SCENARIOS = ("interpreter", "import_main", "warm_hit")
+BENCHMARK_ARCHITECTURE = "amd64"
+UNREACHABLE_HOST = "127.0.0.1:9"  # The discard port, which nothing listens on
+
+# Modules that a warm-cache hit shouldn't need
+HEAVY_MODULES = ("requests", "urllib3", "ftplib", "gzip", "colorama", "http.server", "multiprocessing",
+                 "concurrent.futures.process")
+
+
+def prepare_warm_cache(directory: str) -> None:
+    """Writes a cache database into <directory> holding statistics for <BENCHMARK_ARCHITECTURE>, and a Release file
+    entry that was confirmed just now and lists the same SHA256, so that a run in <directory> is a cache hit."""
+    checksum = {"sha256": "0" * 64, "size": 1000}
+    packages = {f"section/package{i}": 1000 - i for i in range(cons.CACHE_SIZE)}
+    cons.CACHE_DATABASE_PATH = os.path.join(directory, os.path.basename(cons.CACHE_DATABASE_PATH))
+    cons.CACHE_PATH = os.path.join(directory, os.path.basename(cons.CACHE_PATH))
+    cache_store.put_entries({BENCHMARK_ARCHITECTURE: {"etag": "\"0\"", "last_modified": "", **checksum,
+                                                      "packages": packages},
+                             cons.RELEASE_CACHE_KEY: {"etag": "\"0\"", "last_modified": "",
+                                                      "checksums": {BENCHMARK_ARCHITECTURE: checksum},
+                                                      "checked_at": time.time()}})
+    return
+
+
+def get_command(scenario: str) -> list[str]:
+    """Returns the command line that runs <scenario>. Only a warm hit prints anything."""
+    if scenario == "interpreter":
+        return [sys.executable, "-c", "pass"]
+    elif scenario == "import_main":
+        return [sys.executable, "-c", "import main"]
+
+    return [sys.executable, os.path.join(SOURCE_DIRECTORY, "main.py"), "--mirrors", UNREACHABLE_HOST,
+            BENCHMARK_ARCHITECTURE]
+
+
+def run_command(command: list[str], directory: str) -> str:
+    """Runs <command> in <directory> with main.py's modules importable, and returns its output. Raises RuntimeError if
+    it fails, or if it's a run of main.py that wasn't answered from the cache."""
+    environment = {**os.environ, "PYTHONPATH": SOURCE_DIRECTORY}
+    result = subprocess.run(command, cwd=directory, env=environment, capture_output=True, text=True)
+    if result.returncode != 0 or (result.stdout and " Found" not in result.stdout):
+        raise RuntimeError(f"{' '.join(command)} failed:\n{result.stdout}{result.stderr}")
+
+    return result.stdout + result.stderr
+
+
+def get_import_profile(command: list[str], directory: str) -> dict:
+    """Runs <command> once under -X importtime, and returns its total import time in milliseconds and which of
+    <HEAVY_MODULES> it imported."""
+    output = run_command([command[0], "-X", "importtime", *command[1:]], directory)
+    total_microseconds = 0
+    imported_modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or line.endswith("| imported package"):
+            continue
+
+        _, cumulative, module = line.split("|")
+        if not module.startswith("  "):  # Only top-level imports, since their times include everything nested in them
+            total_microseconds += int(cumulative)
+        imported_modules.add(module.strip())
+
+    return {"import_ms": round(total_microseconds / 1000, 1),
+            "heavy_modules": [module for module in HEAVY_MODULES if module in imported_modules]}
+
+
+def run_benchmarks(scenarios: list[str], repeat: int) -> dict:
+    """Runs each of <scenarios> <repeat> times, timing the whole process from start to exit."""
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_warm_cache(directory)
+        for scenario in scenarios:
+            command = get_command(scenario)
+            run_command(command, directory)  # Once untimed, so every timed run finds the bytecode already compiled
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run_command(command, directory)
+                timings.append(time.perf_counter() - start)
+
+            results[scenario] = {"seconds": min(timings), "median_seconds": statistics.median(timings),
+                                 **get_import_profile(command, directory)}
+            print(f"{scenario:<12} {min(timings) * 1000:8.1f} ms best  {statistics.median(timings) * 1000:8.1f} ms "
+                  f"median  {results[scenario]['import_ms']:8.1f} ms importing  "
+                  f"heavy modules: {', '.join(results[scenario]['heavy_modules']) or 'none'}", flush=True)
+
+    return {"created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "results": results}
+
+
+def compare_results(old_path: str, new_path: str) -> None:
+    """Prints how much faster or slower each scenario is in <new_path> than in <old_path>."""
+    with open(old_path) as file:
+        old_results = json.load(file)["results"]
+    with open(new_path) as file:
+        new_results = json.load(file)["results"]
+
+    for scenario in [scenario for scenario in SCENARIOS if scenario in old_results and scenario in new_results]:
+        old_seconds = old_results[scenario]["seconds"]
+        new_seconds = new_results[scenario]["seconds"]
+        print(f"{scenario:<12} {old_seconds * 1000:8.1f} ms -> {new_seconds * 1000:8.1f} ms  "
+              f"({old_seconds / new_seconds:.2f}x)")
+
+    return
+
+
+def main_benchmark(arguments: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_startup")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="Path of the JSON results file. Defaults to a timestamped file in "
+                                         f"{RESULTS_DIRECTORY}")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two results files and exit")
+    options = parser.parse_args(arguments)
+
+    if options.compare:
+        compare_results(*options.compare)
+        return
+
+    results = run_benchmarks(options.scenarios, options.repeat)
+    output_path = options.output or os.path.join(RESULTS_DIRECTORY,
+                                                  f"startup-{results['created'].replace(':', '')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"Results saved to {output_path}")
+    return
+
+
+if __name__ == "__main__":
+    main_benchmark(sys.argv[1:])
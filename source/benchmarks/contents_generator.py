@@ -0,0 +1,66 @@
+"""Generates synthetic contents index files at realistic scales, so the pipeline can be benchmarked without a mirror."""
+import gzip
+import random
+
+
+# The old-style free form text and header row that contents indices can begin with. The real text says "Debian
+# GNU/Linux", but the "/" would make that line count as a table row for the package "to".
+HEADER_TEXT = (b"This file maps each file available in the Debian system to\n"
+               b"the package from which it originates.  It includes packages from the\n"
+               b"stable distribution for the synthetic architecture.\n"
+               b"\n"
+               b"You can use this list to determine which package contains a specific\n"
+               b"file, or whether or not a specific file is available.\n"
+               b"\n"
+               b"FILE" + b" " * 56 + b"LOCATION\n")
+
+SECTIONS = ("admin", "devel", "doc", "fonts", "games", "libs", "net", "python", "science", "utils", "x11")
+DIRECTORIES = ("usr/bin", "usr/lib/x86_64-linux-gnu", "usr/share/doc", "usr/share/man/man1", "usr/share/locale",
+               "usr/include", "usr/lib/python3/dist-packages", "etc")
+EXTENSIONS = ("", ".so.1", ".gz", ".h", ".py", ".mo", ".conf", ".png")
+
+# Shape of the generated data, chosen to roughly match the real indices
+LINES_PER_PACKAGE = 30  # source and amd64 both average around this many files per package
+PACKAGE_SIZE_SKEW = 1.1  # Files per package follow a Zipf distribution with this exponent
+SHARED_FILE_RATE = 0.02  # Share of files that are listed under 2-4 packages
+WHITESPACE_PATH_RATE = 0.01  # Share of file names that contain a space
+BATCH_LINES = 100_000  # Lines are generated and compressed this many at a time, to bound memory
+
+
+def write_contents_index(path: str, lines: int, seed: int = 0) -> dict[bytes, int]:
+    """Writes a gzipped contents index with header text and <lines> table rows to <path>, and returns the exact package
+    file counts it contains. The same <lines> and <seed> always produce the same file."""
+    generator = random.Random(seed)
+    package_count = max(10, lines // LINES_PER_PACKAGE)
+    packages = [f"{generator.choice(SECTIONS)}/package{i}".encode() for i in range(package_count)]
+    cumulative_weights = []
+    total_weight = 0.0
+    for rank in range(1, package_count + 1):
+        total_weight += 1 / rank ** PACKAGE_SIZE_SKEW
+        cumulative_weights.append(total_weight)
+
+    file_counts = [0] * package_count
+    with gzip.open(path, "wb", compresslevel=6) as file:
+        file.write(HEADER_TEXT)
+        for batch_start in range(0, lines, BATCH_LINES):
+            batch_size = min(BATCH_LINES, lines - batch_start)
+            owners = generator.choices(range(package_count), cum_weights=cumulative_weights, k=batch_size)
+            rows = []
+            for line_number, owner in enumerate(owners, start=batch_start):
+                owner_ids = [owner]
+                if generator.random() < SHARED_FILE_RATE:
+                    owner_ids += generator.sample(range(package_count), generator.randint(1, 3))
+                    owner_ids = list(dict.fromkeys(owner_ids))  # A package is never listed twice on one line
+
+                for owner_id in owner_ids:
+                    file_counts[owner_id] += 1
+
+                directory = generator.choice(DIRECTORIES)
+                name = f"file {line_number}" if generator.random() < WHITESPACE_PATH_RATE else f"file{line_number}"
+                path_name = f"{directory}/package{owner}/{name}{generator.choice(EXTENSIONS)}".encode()
+                field = b",".join(packages[owner_id] for owner_id in owner_ids)
+                rows.append(path_name.ljust(59) + b" " + field + b"\n")
+
+            file.write(b"".join(rows))
+
+    return {packages[i]: count for i, count in enumerate(file_counts) if count}
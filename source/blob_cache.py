@@ -0,0 +1,167 @@
+"""Local cache of downloaded contents index files, so they can be analyzed again without going back to the mirror.
+
+Each blob is the gzipped contents index exactly as downloaded, keyed by architecture and the version of the file (see
+get_version()): its SHA256 from the Release file, or else the mirror's ETag, or its Last-Modified timestamp if it has
+neither. The least recently used blobs, along with anything stored alongside them, are evicted once the cache grows
+past <cons.BLOB_CACHE_MAX_MB>."""
+import constants as cons
+import glob
+import hashlib
+import logging
+import mmap
+import os
+from typing import Iterable, Iterator
+
+
+def get_version(validators: dict) -> str:
+    """Returns the version of a contents index described by <validators> (the "sha256" from the Release file, "etag",
+    and "last_modified" of a cache entry), or an empty string if it can't be identified."""
+    # The SHA256 identifies the file's contents, so it's the same whichever mirror the file came from
+    return validators.get("sha256") or validators.get("etag") or validators.get("last_modified") or ""
+
+
+def get_blob_path(arch: str, version: str) -> str:
+    """Returns the path of the cached blob for <version> of the contents index for <arch>."""
+    # Versions are hashed since ETags and timestamps contain characters that aren't safe in file names
+    version_digest = hashlib.sha256(version.encode()).hexdigest()[:16]
+    return os.path.join(cons.BLOB_CACHE_DIRECTORY, f"Contents-{arch}.{version_digest}.gz")
+
+
+def has_blob(arch: str, version: str) -> bool:
+    """Returns True if <version> of the contents index for <arch> is cached."""
+    return bool(version) and cons.BLOB_CACHE_MAX_MB > 0 and os.path.isfile(get_blob_path(arch, version))
+
+
+def read_blob(arch: str, version: str) -> Iterator[memoryview] | None:
+    """Returns an iterator over the cached blob for <version> of the contents index for <arch> in chunks of
+    <cons.DOWNLOAD_CHUNK_SIZE>, or None if it isn't cached.
+
+    The blob is memory-mapped, and each chunk is a view into the mapping, so nothing is copied into Python bytes
+    objects. zlib decompresses straight from the views."""
+    if not has_blob(arch, version):
+        return None
+
+    blob_path = get_blob_path(arch, version)
+    try:
+        os.utime(blob_path)  # The modification time doubles as the last access time for eviction
+        with open(blob_path, "rb") as file:
+            mapped_blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping outlives the file handle
+    except (OSError, ValueError) as e:  # mmap raises ValueError for an empty file
+        logging.warning(f"Failed reading cached contents index {blob_path}; error: {e!r}")
+        return None
+
+    return _iter_mapped_chunks(mapped_blob)
+
+
+def _iter_mapped_chunks(mapped_blob: mmap.mmap) -> Iterator[memoryview]:
+    """Yields views of <mapped_blob> in chunks of <cons.DOWNLOAD_CHUNK_SIZE>."""
+    # P: The mapping isn't closed explicitly, since the caller may still hold a view of the last chunk when this
+    #    finishes, and closing a mapping with views into it raises a BufferError. It's unmapped once the last view is
+    #    garbage collected.
+    blob_view = memoryview(mapped_blob)
+    for start in range(0, len(blob_view), cons.DOWNLOAD_CHUNK_SIZE):
+        yield blob_view[start:start + cons.DOWNLOAD_CHUNK_SIZE]
+
+    return
+
+
+def store_blob(arch: str, version: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each of <chunks> unchanged, while also writing them to the cache as <version> of the contents index for
+    <arch>. The blob is only added to the cache once every chunk has been written, so an interrupted download never
+    leaves a partial file behind. Any other cached versions for <arch> are removed, and then the least recently used
+    blobs are evicted if the cache is over budget."""
+    if not version or cons.BLOB_CACHE_MAX_MB <= 0:
+        yield from chunks
+        return
+
+    os.makedirs(cons.BLOB_CACHE_DIRECTORY, exist_ok=True)
+    blob_path = get_blob_path(arch, version)
+    temporary_path = f"{blob_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+
+        remove_other_versions(arch, version)
+
+        os.replace(temporary_path, blob_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    evict_blobs(cons.BLOB_CACHE_MAX_MB * 1024 * 1024)
+    return
+
+
+def remove_other_versions(arch: str, version: str) -> None:
+    """Removes every cached file for <arch> (blobs and anything stored alongside them) that isn't for <version>."""
+    current_prefix = get_blob_path(arch, version)[:-len(".gz")]
+    for old_path in glob.glob(os.path.join(cons.BLOB_CACHE_DIRECTORY, f"Contents-{arch}.*")):
+        if not old_path.startswith(current_prefix) and not old_path.endswith(".tmp"):
+            _remove_blob(old_path)
+
+    return
+
+
+def evict_blobs(max_bytes: int) -> None:
+    """Removes the least recently used blobs until the cache takes up no more than <max_bytes>. Each blob is evicted
+    together with the files stored alongside it (such as the segmented copy from parallel_gzip), as a group that was
+    last used when any of its files was. Files whose blob is already gone are always removed, since nothing reads them
+    without it."""
+    groups = {}  # Blob path to [last used, total size, paths of the blob and every file stored alongside it]
+    for path in glob.glob(os.path.join(cons.BLOB_CACHE_DIRECTORY, "Contents-*")):
+        if path.endswith(".tmp"):  # Still being written
+            continue
+
+        try:
+            path_stats = os.stat(path)
+        except OSError:  # Already removed by another process
+            continue
+        group = groups.setdefault(get_group_blob_path(path), [0, 0, []])
+        group[0] = max(group[0], path_stats.st_mtime)
+        group[1] += path_stats.st_size
+        group[2].append(path)
+
+    total_bytes = sum(size for _, size, _ in groups.values())
+    # Groups without a blob come first, and the rest from the least recently used
+    for blob_path, (_, size, paths) in sorted(groups.items(), key=lambda item: (item[0] in item[1][2], item[1][0])):
+        if total_bytes <= max_bytes and blob_path in paths:
+            break
+        elif _remove_group(blob_path, paths):
+            total_bytes -= size
+
+    return
+
+
+def get_group_blob_path(path: str) -> str:
+    """Returns the path of the blob that the cached file at <path> belongs to, which is <path> itself for a blob."""
+    # Files stored alongside a blob start with its "Contents-<arch>.<version digest>", and no architecture has a "."
+    group_name = ".".join(os.path.basename(path).split(".")[:2])
+    return os.path.join(os.path.dirname(path), f"{group_name}.gz")
+
+
+def _remove_group(blob_path: str, paths: list[str]) -> bool:
+    """Removes the blob at <blob_path> and then every other file of its group in <paths>, returning False if the blob
+    can't be removed, in which case the rest of its group is kept too."""
+    if blob_path in paths and not _remove_blob(blob_path):
+        return False
+
+    for path in paths:
+        if path != blob_path:
+            _remove_blob(path)
+
+    return True
+
+
+def _remove_blob(blob_path: str) -> bool:
+    """Removes <blob_path>, returning False if it can't be (on Windows, a blob that's still mapped can't be removed)."""
+    try:
+        os.remove(blob_path)
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        logging.info(f"Failed removing cached contents index {blob_path}; error: {e!r}")
+        return False
+
+    return True
@@ -0,0 +1,70 @@
+"""Bulk-buffer parsing engine for contents indices.
+
+Works on large blocks of decompressed lines instead of one line at a time. Produces the same counts as
+main.tally_package_file_associations(), which is kept as the reference implementation."""
+from collections import Counter
+import re
+from typing import Iterable
+
+
+# Matches a valid table row, capturing its last whitespace-separated field (the comma-separated package list). bytes
+# .split() treats exactly these six characters as whitespace, so the character classes mirror it. The "/" has to come
+# before the whitespace in front of the last field, which is the same rule the reference engine applies to
+# tokens[0:-1]. This also skips the free form text and the "FILE LOCATION" header row. Anchoring on the first "/" and
+# letting the middle run greedily to the end of the line keeps backtracking to a minimum.
+_WHITESPACE = rb" \t\n\r\x0b\x0c"
+_INLINE_WHITESPACE = rb" \t\r\x0b\x0c"
+_ROW = rb"[^\n/]*/[^\n]*[" + _INLINE_WHITESPACE + rb"]([^" + _WHITESPACE + rb"]+)[" + _INLINE_WHITESPACE + rb"]*"
+CONTENTS_ROW_PATTERN = re.compile(rb"^" + _ROW + rb"$", re.MULTILINE)
+
+# Same as above, but also matches (without capturing anything) every line that isn't a valid table row, so that there's
+# exactly one result per line
+CONTENTS_LINE_PATTERN = re.compile(rb"^(?:" + _ROW + rb"|[^\n]*)$", re.MULTILINE)
+
+# Same as CONTENTS_ROW_PATTERN, but also captures everything before the package field (the file name, plus the padding
+# between the columns)
+CONTENTS_ENTRY_PATTERN = re.compile(rb"^([^\n/]*/[^\n]*)[" + _INLINE_WHITESPACE + rb"]([^" + _WHITESPACE + rb"]+)["
+                                    + _INLINE_WHITESPACE + rb"]*$", re.MULTILINE)
+
+
+def tally_package_files(blocks: Iterable[bytes]) -> dict[bytes, int]:
+    """Returns an unsorted dictionary of package name to associated file count for the contents index lines in
+    <blocks>. Each block must end on a line boundary, as decompression.iter_gzip_blocks() guarantees."""
+    # P: The reference engine allocates a token list, a joined path, and a split package list for every line. Here
+    #    the regex pulls the package field out of a whole block in C, and Counter tallies the fields in C too. Only
+    #    the unique fields, of which there are far fewer than lines, are split on commas in Python.
+    field_counts = Counter()
+    for block in blocks:
+        field_counts.update(CONTENTS_ROW_PATTERN.findall(block))
+
+    return expand_package_fields(field_counts)
+
+
+def get_line_package_fields(block: bytes) -> list[bytes]:
+    """Returns the package field of every line in <block>, in order, with an empty bytes object for each line that
+    isn't a valid table row. <block> must end on a line boundary."""
+    fields = CONTENTS_LINE_PATTERN.findall(block)
+    if block.endswith(b"\n"):
+        fields.pop()  # The pattern also matches the empty string after the final newline
+
+    return fields
+
+
+def get_entries(block: bytes) -> list[tuple[bytes, bytes]]:
+    """Returns the (file name, package field) of every valid table row in <block>, in order. <block> must end on a line
+    boundary."""
+    return [(path.strip(), field) for path, field in CONTENTS_ENTRY_PATTERN.findall(block)]  # Strips _WHITESPACE
+
+
+def expand_package_fields(field_counts: dict[bytes, int]) -> dict[bytes, int]:
+    """Turns a count of comma-separated package fields into a count of individual packages."""
+    package_counts = {}
+    for field, count in field_counts.items():
+        if b"," not in field:
+            package_counts[field] = package_counts.get(field, 0) + count
+            continue
+
+        for package in field.split(b","):  # Same as the reference engine, including empty names from stray commas
+            package_counts[package] = package_counts.get(package, 0) + count
+
+    return package_counts
@@ -0,0 +1,89 @@
+"""Storage for the cache of architecture statistics.
+
+Each architecture's statistics are a separate row in a SQLite database in WAL mode. Writes are atomic, readers never
+block writers, and writers to different architectures only hold the database lock for the length of their own short
+transaction, so concurrent runs (a cron job and a user, or parallel refreshes) can't lose each other's entries or leave
+a truncated file behind."""
+import constants as cons
+import json
+import logging
+import metrics
+import os
+import sqlite3
+
+
+# P: The cache used to be a single JSON file that was read in full and rewritten in full after every miss. Two runs at
+#    the same time would each write back their own copy, and the last one to finish silently dropped the other's
+#    entry. SQLite is in the standard library and handles the locking and atomic commits on every platform, which a
+#    hand-rolled lock file wouldn't (fcntl doesn't exist on Windows).
+def connect() -> sqlite3.Connection:
+    """Opens the cache database, creating it on first use, and importing the old JSON cache if there is one."""
+    connection = sqlite3.connect(cons.CACHE_DATABASE_PATH, timeout=cons.CACHE_LOCK_TIMEOUT)
+    connection.execute("PRAGMA journal_mode=WAL")
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS architecture_stats "
+                           "(arch TEXT PRIMARY KEY, record TEXT NOT NULL)")
+        if connection.execute("SELECT COUNT(*) FROM architecture_stats").fetchone()[0] == 0:
+            _import_json_cache(connection)
+
+    return connection
+
+
+def get_cache() -> dict:
+    """Retrieves and returns the cache of architecture-specific packages and their file counts, for every
+    architecture."""
+    with metrics.phase("cache_read"):
+        connection = connect()
+        try:
+            rows = connection.execute("SELECT arch, record FROM architecture_stats").fetchall()
+        finally:
+            connection.close()
+
+        return {arch: json.loads(record) for arch, record in rows}
+
+
+def get_entry(arch: str) -> dict:
+    """Returns the cached statistics for <arch>, or an empty dictionary if there aren't any."""
+    with metrics.phase("cache_read"):
+        connection = connect()
+        try:
+            row = connection.execute("SELECT record FROM architecture_stats WHERE arch = ?", (arch,)).fetchone()
+        finally:
+            connection.close()
+
+        return json.loads(row[0]) if row else {}
+
+
+def put_entries(entries: dict[str, dict]) -> None:
+    """Stores the statistics in <entries> (architecture to statistics), replacing any previous entries for the same
+    architectures, in a single transaction. Entries for other architectures are left untouched."""
+    with metrics.phase("cache_write"):
+        connection = connect()
+        try:
+            with connection:  # Commits on success and rolls back on an exception
+                connection.executemany("INSERT OR REPLACE INTO architecture_stats (arch, record) VALUES (?, ?)",
+                                       [(arch, json.dumps(record)) for arch, record in entries.items()])
+        finally:
+            connection.close()
+
+    return
+
+
+def _import_json_cache(connection: sqlite3.Connection) -> None:
+    """Copies the entries of the old JSON cache at <cons.CACHE_PATH>, if it exists and can be read, into <connection>'s
+    empty table."""
+    try:
+        if os.stat(cons.CACHE_PATH).st_size == 0:
+            return
+
+        with open(cons.CACHE_PATH, "r") as file:
+            cache = json.load(file)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed importing the old JSON cache {cons.CACHE_PATH}; error: {e!r}")
+        return
+
+    connection.executemany("INSERT OR REPLACE INTO architecture_stats (arch, record) VALUES (?, ?)",
+                           [(arch, json.dumps(record)) for arch, record in cache.items()])
+    return
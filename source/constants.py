@@ -1,14 +1,15 @@
 from animations.animation_functions import dots
-from colorama import Fore
+import os
 
 
-# Colors for console output
-CYAN = Fore.CYAN
-GREEN = Fore.GREEN
-GREY = Fore.LIGHTBLACK_EX
-RED = Fore.RED
-RESET = Fore.RESET
-YELLOW = Fore.YELLOW
+# Colors for console output. These are the same ANSI escape codes as colorama's Fore colors, without importing colorama
+# on every run.
+CYAN = "\033[36m"
+GREEN = "\033[32m"
+GREY = "\033[90m"
+RED = "\033[31m"
+RESET = "\033[39m"
+YELLOW = "\033[33m"
 
 # Animation constants
 ANIMATION_DELAY = 0.8
@@ -21,21 +22,163 @@ VALID_ARCHITECTURES = {"all", "amd64", "arm64", "armel", "armhf", "i386", "mips6
                        "source", "udeb-all", "udeb-amd64", "udeb-arm64", "udeb-armel", "udeb-armhf", "udeb-i386",
                        "udeb-mips64el", "udeb-mipsel", "udeb-ppc64el", "udeb-s390x"}
 
-# This many package/file-count items will be shown to the user
-# NOTE: The show count should not exceed the cache size. An error won't be thrown, but if this happens the cache size
-#       will determine how many items the user sees.
+# This many package/file-count items will be shown to the user. Can be overridden at run time with --show-count.
+# NOTE: The show count should not exceed the cache size. If it does when set at run time, the cache size is raised to
+#       match it.
 SHOW_COUNT = 10
 
-# This many package/file-count items will be cached, so the display can increase if desired
+# This many package/file-count items will be cached, so the display can increase if desired. Can be overridden at run
+# time with --cache-size.
 # NOTE: Tests will work with a CACHE_SIZE up to 100
 CACHE_SIZE = 30
 
+# Passing this in place of architectures analyzes every architecture in VALID_ARCHITECTURES
+ALL_ARCHITECTURES_FLAG = "--all"
+
+# Batch runs download and count at most this many contents indices at the same time, each in its own process
+MAX_CONCURRENT_DOWNLOADS = 4
+
+# Which engine parses contents indices. "reference" splits the file line by line (main.tally_package_file_associations),
+# "bulk" extracts package fields from large decompressed blocks at once (bulk_parser). Both give the same results.
+PARSER_ENGINES = {"reference", "bulk"}
+PARSER_ENGINE = "bulk"
+
+# With incremental updates, the full package counts of each architecture are stored in this directory, and kept up to
+# date by applying the mirror's pdiffs to them instead of downloading the whole contents index again. Turned on at run
+# time with --incremental.
+INCREMENTAL_UPDATES = False
+DELTA_STATE_DIRECTORY = "delta_state"
+
+# Downloaded contents indices are kept in this directory, so they can be analyzed again without going back to the
+# mirror. The least recently used ones are removed once they take up more than BLOB_CACHE_MAX_MB megabytes. Can be
+# overridden at run time with --blob-cache-mb, where 0 turns the blob cache off.
+BLOB_CACHE_DIRECTORY = "contents_cache"
+BLOB_CACHE_MAX_MB = 1024
+
+# Re-analysis of a cached contents index is spread over this many worker processes, using a segmented copy of the file
+# that's written alongside the blob the first time it's analyzed (see parallel_gzip). Each segment holds about
+# SEGMENT_SIZE_MB of decompressed lines, compressed at SEGMENT_COMPRESSION_LEVEL. Can be overridden at run time with
+# --workers, where 1 turns parallel decompression off.
+DECOMPRESSION_WORKERS = os.cpu_count() or 1
+SEGMENT_SIZE_MB = 8
+SEGMENT_COMPRESSION_LEVEL = 1
+
+# With --build-index, a reverse index of each analyzed contents index (the files of every package, and the packages of
+# every file) is stored in this directory, to be looked up later with the QUERY_COMMANDS
+BUILD_REVERSE_INDEX = False
+REVERSE_INDEX_DIRECTORY = "reverse_index"
+QUERY_COMMANDS = {"files", "packages"}
+
+# Every time a new version of a contents index is counted, the full counts are appended to a history in the cache
+# database, stored as changes since the previous version (see snapshot_store). The HISTORY_COMMANDS read it: the growth
+# of a package, or the packages that changed the most, over the last HISTORY_RELEASES versions unless a number is given.
+RECORD_SNAPSHOTS = True
+HISTORY_COMMANDS = {"growth", "movers"}
+HISTORY_RELEASES = 10
+
+# Counting views are extra top lists counted in the same pass over a contents index as the package counts, each with its
+# own rules: which path prefixes to include or exclude, and whether to count by package, section, or path prefix (see
+# count_views). These are the built-in ones, and more can be defined in a JSON file of view names to rules given at run
+# time with --view-rules. The views to count and show are chosen with --views <name>[,<name> ...], and are cached under
+# a key made of VIEWS_CACHE_KEY_PREFIX and the architecture.
+COUNT_VIEWS = {"no-docs": {"exclude": ["usr/share/doc/", "usr/share/man/", "usr/share/info/", "usr/share/locale/"]},
+               "sections": {"group_by": "section"},
+               "directories": {"group_by": "path", "path_depth": 2},
+               "unqualified": {"strip_sections": True}}
+SELECTED_VIEWS = []
+VIEWS_CACHE_KEY_PREFIX = "views:"
+
+# With --aggregate, the requested architectures are analyzed together: their combined top packages, how those are split
+# between the architectures, and how each architecture differs from the first one. The shared architecture of each
+# requested architecture's family, whose contents index holds that family's architecture-independent packages, is
+# always included: the first of SHARED_ARCHITECTURES whose prefix the architecture starts with. Source packages aren't
+# split by architecture, so the UNSHARED_ARCHITECTURES have none. The results are cached under a key made of
+# AGGREGATE_KEY_PREFIX and the architectures.
+AGGREGATE_MODE = False
+SHARED_ARCHITECTURES = {"udeb-": "udeb-all", "": "all"}
+UNSHARED_ARCHITECTURES = {"source"}
+AGGREGATE_KEY_PREFIX = "aggregate:"
+
+# The SERVE_COMMAND runs a local HTTP API on SERVER_HOST:SERVER_PORT that answers from statistics held in memory (see
+# stats_server), and checks them against the mirror every SERVER_REFRESH_INTERVAL seconds. The port can be overridden
+# at run time with --port.
+SERVE_COMMAND = "serve"
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_REFRESH_INTERVAL = 600
+
+# Timing and memory metrics for each phase of a run are written as JSON to the file at METRICS_DESTINATION, or to the
+# log if it's "log". The whole run can also be profiled with cProfile into the file at PROFILE_PATH (readable with
+# pstats), and its Python allocations traced with tracemalloc. All off by default, and turned on at run time with
+# --metrics <file|log>, --profile <file>, and --trace-memory.
+METRICS_DESTINATION = ""
+PROFILE_PATH = ""
+TRACE_MEMORY = False
+
+# Statistics are printed as a colored table by default. The other formats are for scripts (see stats_output), and are
+# written to stdout on their own, with everything else printed to stderr, or to the file at OUTPUT_PATH instead. Chosen
+# at run time with --format and --output.
+OUTPUT_FORMATS = {"table", "json", "csv", "tsv"}
+OUTPUT_FORMAT = "table"
+OUTPUT_PATH = ""
+
+# The constants above that can be overridden at run time, and have to be passed on to worker processes
+RUN_TIME_SETTINGS = ("CACHE_SIZE", "SHOW_COUNT", "PARSER_ENGINE", "INCREMENTAL_UPDATES", "BLOB_CACHE_MAX_MB",
+                     "DECOMPRESSION_WORKERS", "BUILD_REVERSE_INDEX", "HOST", "MIRRORS", "RELEASE_MAX_AGE",
+                     "COUNT_VIEWS", "SELECTED_VIEWS")
+
 # Run time outputs
-PASSING_ARGUMENT_INSTRUCTIONS = f"\n{CYAN}Usage:{RESET} python ./main.py <architecture>\n"
+PASSING_ARGUMENT_INSTRUCTIONS = (f"\n{CYAN}Usage:{RESET} python ./main.py [options] <architecture> "
+                                 f"[<architecture> ...]\n"
+                                 f"       python ./main.py [options] {ALL_ARCHITECTURES_FLAG}\n"
+                                 f"       python ./main.py files <architecture> <package>\n"
+                                 f"       python ./main.py packages <architecture> <file>\n"
+                                 f"       python ./main.py growth <architecture> <package> [<releases>]\n"
+                                 f"       python ./main.py movers <architecture> [<releases>]\n"
+                                 f"       python ./main.py [options] {SERVE_COMMAND} [--port <n>]\n"
+                                 f"\n{CYAN}Options:{RESET} --cache-size <n>, --show-count <n>, "
+                                 f"--engine <{'|'.join(sorted(PARSER_ENGINES))}>, --incremental, "
+                                 f"--blob-cache-mb <n>, --workers <n>, --build-index, --aggregate, "
+                                 f"--views <{'|'.join(sorted(COUNT_VIEWS))}>[,...], --view-rules <file>, "
+                                 f"--mirrors <host>[,<host> ...], --max-age <seconds>, --metrics <file|log>, "
+                                 f"--profile <file>, --trace-memory, --format <{'|'.join(sorted(OUTPUT_FORMATS))}>, "
+                                 f"--output <file>\n")
 ARCHITECTURES_LIST = f"\n{CYAN}Valid architectures:{RESET} {', '.join(sorted(list(VALID_ARCHITECTURES)))}\n"
 OUTPUT_SEPARATOR = RED + '~' * 80 + RESET
 
 # URLs and file paths
 HOST = "ftp.uk.debian.org"
 CONTENT_INDICES_SLUG = "debian/dists/stable/main"
-CACHE_PATH = "architecture_cache.json"
+
+# Other mirrors to use along with HOST, given at run time with --mirrors (which replaces HOST with the first one). With
+# more than one, they're probed at the start of a run by downloading the first MIRROR_PROBE_BYTES of the
+# MIRROR_PROBE_ARCHITECTURE's contents index, and the fastest becomes HOST. Contents indices of at least
+# RANGED_DOWNLOAD_MIN_MB are downloaded from all of them at once, in ranges of RANGE_SIZE_MB, with no more than
+# MAX_PENDING_RANGES downloaded ahead of parsing (see mirrors).
+MIRRORS = []
+MIRROR_PROBE_ARCHITECTURE = "all"
+MIRROR_PROBE_BYTES = 256 * 1024
+RANGED_DOWNLOAD_MIN_MB = 16
+RANGE_SIZE_MB = 4
+MAX_PENDING_RANGES = 8
+CACHE_DATABASE_PATH = "architecture_cache.sqlite3"
+CACHE_PATH = "architecture_cache.json"  # The old JSON cache, imported into the database the first time it's created
+RELEASE_CACHE_KEY = "release"  # The suite's Release file is cached in the database under this key (see release_file)
+# The cached Release file is trusted without asking the mirror for this many seconds after it was last confirmed. Can be
+# overridden at run time with --max-age, where 0 always asks.
+RELEASE_MAX_AGE = 300
+
+# Seconds to wait for another process to finish writing to the cache database before giving up
+CACHE_LOCK_TIMEOUT = 30
+
+# Connection handling for requests to the mirror. Timeouts are (connect, read) in seconds, where the read timeout is the
+# longest wait between bytes, not for the whole download. Failed connections and server errors are retried with a
+# backoff of HTTP_BACKOFF_FACTOR * 2^(retry - 1) seconds between attempts.
+HTTP_TIMEOUT = (10, 60)
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_POOL_SIZE = MAX_CONCURRENT_DOWNLOADS
+
+# Contents indices are downloaded and decompressed this many bytes at a time when streamed, which bounds how much of
+# the file is held in memory at once
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
@@ -0,0 +1,180 @@
+"""Counting views: extra top lists that are counted in the same pass over a contents index as the package counts, each
+with its own rules for which files it counts and what it counts them under.
+
+A view's rules are a dictionary with any of:
+
+    include        - only files whose paths start with one of these prefixes are counted. Defaults to every file.
+    exclude        - files whose paths start with one of these prefixes aren't counted
+    group_by       - what the files are counted under: "package" (the default), "section" (the qualifier in front of
+                     the package name, such as "libs" in "libs/bash"), or "path" (the directory a file is in, down to
+                     <path_depth> levels, such as "usr/share")
+    path_depth     - how many directories a "path" view keeps. Defaults to <DEFAULT_PATH_DEPTH>.
+    strip_sections - with "package", counts "libs/bash" and "shells/bash" as "bash"
+
+Every association between a file and a package counts once, as it does for the package counts, so a file that belongs to
+two packages counts twice. With no rules at all, a view is the same as the package counts.
+
+The top counts of each view are cached per architecture, along with the version of the contents index and the rules
+they were counted with, under <cons.VIEWS_CACHE_KEY_PREFIX> and the architecture."""
+# P: "The top packages without their documentation" used to mean another full download and scan of the contents index
+#    for every such question. Every view only needs the path and package field of each line, which bulk_parser already
+#    pulls out of whole blocks in C. Filtering those pairs is a few comparisons per line, and grouping is deferred to
+#    the unique package fields (or path prefixes), of which there are far fewer than lines, as in bulk_parser.
+import bulk_parser as bulk
+import cache_store
+from collections import Counter
+import constants as cons
+import json
+from package_counts import get_top
+from typing import Iterable, Iterator
+
+
+VIEW_RULES = {"include", "exclude", "group_by", "path_depth", "strip_sections"}
+VIEW_GROUPS = {"package", "section", "path"}
+DEFAULT_PATH_DEPTH = 2
+NO_SECTION = b"-"  # What "section" views count packages with no qualifier under
+
+
+def check_rules(name: str, rules: dict) -> None:
+    """Raises ValueError if <rules>, the rules of the view called <name>, aren't valid."""
+    if not isinstance(rules, dict):
+        raise ValueError(f"the rules of view {name!r} must be a JSON object")
+    unknown_rules = set(rules) - VIEW_RULES
+    if unknown_rules:
+        raise ValueError(f"view {name!r} has unknown rules: {', '.join(sorted(unknown_rules))}")
+    for rule in ("include", "exclude"):
+        prefixes = rules.get(rule, [])
+        if not isinstance(prefixes, list) or not all(isinstance(prefix, str) for prefix in prefixes):
+            raise ValueError(f"{rule} of view {name!r} must be a list of path prefixes")
+    if rules.get("group_by", "package") not in VIEW_GROUPS:
+        raise ValueError(f"group_by of view {name!r} must be one of: {', '.join(sorted(VIEW_GROUPS))}")
+    path_depth = rules.get("path_depth", DEFAULT_PATH_DEPTH)
+    if not isinstance(path_depth, int) or isinstance(path_depth, bool) or path_depth < 1:
+        raise ValueError(f"path_depth of view {name!r} must be an integer greater than zero")
+
+    return
+
+
+def load_views(path: str) -> dict[str, dict]:
+    """Returns the views defined in the JSON file at <path>, an object of view names to rules. Raises OSError if it
+    can't be read, and ValueError if it isn't valid JSON or any of its views aren't valid."""
+    with open(path, encoding="utf-8") as file:
+        views = json.load(file)
+    if not isinstance(views, dict):
+        raise ValueError("views must be a JSON object of view names to rules")
+    for name, rules in views.items():
+        check_rules(name, rules)
+
+    return views
+
+
+def get_prefixes(prefixes: list[str]) -> tuple[bytes, ...]:
+    """Returns path <prefixes> in the form of the paths in a contents index, which have no leading "/"."""
+    return tuple(prefix.lstrip("/").encode() for prefix in prefixes)
+
+
+def get_row_name(rules: dict) -> str:
+    """Returns the heading of the column of names in the table of a view with <rules>."""
+    return {"section": "SECTION", "path": "PATH"}.get(rules.get("group_by", "package"), "PACKAGE")
+
+
+class ViewCounter:
+    """Counts every view in <views> (view name to rules) over the blocks that pass through count_blocks()."""
+
+    def __init__(self, views: dict[str, dict]):
+        self.views = views
+        # An empty prefix matches every path, and an empty tuple matches none, so every view is filtered the same way
+        self._filters = {name: (get_prefixes(rules.get("include", [])) or (b"",),
+                                get_prefixes(rules.get("exclude", [])))
+                         for name, rules in views.items()}
+        # Package fields, or (path prefix, package field) pairs for "path" views, to the number of files they're on
+        self._field_counts = {name: Counter() for name in views}
+
+    def count_blocks(self, blocks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yields each of <blocks> (decompressed, line-aligned blocks from decompression.iter_gzip_blocks()) unchanged,
+        while also counting every view over them."""
+        for block in blocks:
+            entries = bulk.get_entries(block)
+            for name, rules in self.views.items():
+                include, exclude = self._filters[name]
+                if rules.get("group_by") == "path":
+                    path_depth = rules.get("path_depth", DEFAULT_PATH_DEPTH)
+                    self._field_counts[name].update([(get_path_prefix(path, path_depth), field)
+                                                     for path, field in entries
+                                                     if path.startswith(include) and not path.startswith(exclude)])
+                else:
+                    self._field_counts[name].update([field for path, field in entries
+                                                     if path.startswith(include) and not path.startswith(exclude)])
+            yield block
+
+        return
+
+    def get_counts(self) -> dict[str, dict[bytes, int]]:
+        """Returns the full, unsorted counts of every view, by view name, from the blocks counted so far."""
+        return {name: group_counts(self._field_counts[name], rules) for name, rules in self.views.items()}
+
+
+def get_path_prefix(path: bytes, path_depth: int) -> bytes:
+    """Returns the first <path_depth> directories of <path>, or the directory it's in if it isn't that deep."""
+    directories = path.split(b"/", path_depth)[:-1]  # The last part is the file name, or the rest of a deeper path
+    return b"/".join(directories)
+
+
+def group_counts(field_counts: Counter, rules: dict) -> dict[bytes, int]:
+    """Turns <field_counts> from ViewCounter into the counts of whatever a view with <rules> is grouped by."""
+    if rules.get("group_by") == "path":
+        path_counts = Counter()
+        for (path_prefix, field), count in field_counts.items():
+            path_counts[path_prefix] += count * (field.count(b",") + 1)  # Every package on a file counts once
+        return path_counts
+
+    package_counts = bulk.expand_package_fields(field_counts)
+    if rules.get("group_by") == "section":
+        section_counts = Counter()
+        for package, count in package_counts.items():
+            section_counts[package.rpartition(b"/")[0] or NO_SECTION] += count
+        return section_counts
+    elif rules.get("strip_sections"):
+        stripped_counts = Counter()
+        for package, count in package_counts.items():
+            stripped_counts[package.rpartition(b"/")[2]] += count
+        return stripped_counts
+
+    return package_counts
+
+
+def get_view_key(arch: str) -> str:
+    """Returns the cache key of the views of <arch>."""
+    return cons.VIEWS_CACHE_KEY_PREFIX + arch
+
+
+def get_stored_views(arch: str, version: str) -> dict[str, dict]:
+    """Returns the cached views of <arch> (view name to its "rules" and top "packages") that were counted from <version>
+    of its contents index, or an empty dictionary if none were."""
+    views_entry = cache_store.get_entry(get_view_key(arch))
+    if not version or views_entry.get("version") != version:
+        return {}
+
+    return views_entry.get("views", {})
+
+
+def has_views(arch: str, version: str, views: dict[str, dict]) -> bool:
+    """Returns True if every view in <views> (view name to rules) is cached for <version> of the contents index for
+    <arch>, counted with the same rules."""
+    stored_views = get_stored_views(arch, version)
+    return all(name in stored_views and stored_views[name]["rules"] == rules for name, rules in views.items())
+
+
+def store_views(arch: str, version: str, views: dict[str, dict], view_counts: dict[str, dict[bytes, int]]) -> None:
+    """Caches the top <cons.CACHE_SIZE> of each of <view_counts>, the counts of <views> (view name to rules) over
+    <version> of the contents index for <arch>. Other views already cached for the same version are kept."""
+    if not version:  # There'd be nothing to check the views against
+        return
+
+    stored_views = {**get_stored_views(arch, version),
+                    **{name: {"rules": views[name],
+                              "packages": {key.decode(errors="replace"): count
+                                           for key, count in get_top(counts, cons.CACHE_SIZE)}}
+                       for name, counts in view_counts.items()}}
+    cache_store.put_entries({get_view_key(arch): {"version": version, "views": stored_views}})
+    return
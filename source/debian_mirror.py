@@ -1,22 +1,77 @@
-"""Functions to be used for direct communication with or information retrieval from ftp.uk.debian.org"""
+"""Functions to be used for direct communication with or information retrieval from the Debian mirror (<cons.HOST>)"""
 
 #  P: This is its own module for the sake of boundaries. These functions communicate directly with the external server,
 #     so they're kept separate from the rest of the project.
 from animations.animation import Animation
 import constants as cons
+from datetime import datetime, timezone
+from email.utils import format_datetime
 import ftplib
 import logging
+import metrics
+import os
 import requests
+from requests.adapters import HTTPAdapter
+import threading
+from typing import Iterator
+from urllib3.util.retry import Retry
+
+
+# P: Every request used to open its own connection, paying for a new TCP handshake each time. One session per process
+#    keeps connections alive between requests (the cache check and the download, or every architecture in a batch).
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the HTTP session shared by every request to the mirror in this process, creating it on first use.
+
+    The session keeps up to <cons.HTTP_POOL_SIZE> connections alive, and retries failed connections and server errors
+    up to <cons.HTTP_RETRIES> times with exponential backoff."""
+    global _session
+    with _session_lock:  # Batch runs check validators from several threads at once
+        if _session is None:
+            retries = Retry(total=cons.HTTP_RETRIES, backoff_factor=cons.HTTP_BACKOFF_FACTOR,
+                            status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset({"GET", "HEAD"}))
+            # One pool of connections for each mirror
+            adapter = HTTPAdapter(pool_connections=max(1, len(cons.MIRRORS)), pool_maxsize=cons.HTTP_POOL_SIZE,
+                                  max_retries=retries)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+
+    return _session
+
+
+def _discard_session() -> None:
+    """Drops the shared session without closing it, so that a forked worker process opens its own connections instead
+    of sharing its parent's sockets."""
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
+    return
+
+
+if hasattr(os, "register_at_fork"):  # Not available on Windows, where worker processes start fresh anyway
+    os.register_at_fork(after_in_child=_discard_session)
+
+
+def get_contents_index_url(arch: str, host: str = "") -> str:
+    """Returns the URL of the gzipped contents index file for <arch> on <host> (default <cons.HOST>)"""
+    return f"http://{host or cons.HOST}/{cons.CONTENT_INDICES_SLUG}/Contents-{arch}.gz"
 
 
 def read_contents_index_file(arch: str) -> bytes:
     """Returns the bytes of the gzipped contents index file for <arch>"""
-    architecture_contents_index_url = f"http://{cons.HOST}/{cons.CONTENT_INDICES_SLUG}/Contents-{arch}.gz"
+    architecture_contents_index_url = get_contents_index_url(arch)
     print(f"{cons.GREEN}Downloading {cons.RESET}{arch}{cons.GREEN} contents index{cons.RESET}", end="")
 
     animation = Animation(cons.DEFAULT_ANIMATION)
     animation.start()
-    response = requests.get(architecture_contents_index_url)
+    with metrics.phase("download") as counts:
+        response = get_session().get(architecture_contents_index_url, timeout=cons.HTTP_TIMEOUT)
+        counts["bytes"] += len(response.content)
     animation.stop()
 
     if response.status_code != 200:
@@ -29,6 +84,24 @@ def read_contents_index_file(arch: str) -> bytes:
     return response.content
 
 
+def stream_contents_index_file(arch: str) -> Iterator[bytes]:
+    """Starts downloading the gzipped contents index file for <arch>, and returns an iterator over its bytes in chunks
+    of <cons.DOWNLOAD_CHUNK_SIZE> as they arrive.
+
+    Nothing is printed here, since the caller decides what the download overlaps with (parsing, other downloads, etc.)
+    and how to report it."""
+    architecture_contents_index_url = get_contents_index_url(arch)
+    response = get_session().get(architecture_contents_index_url, stream=True, timeout=cons.HTTP_TIMEOUT)
+
+    if response.status_code != 200:
+        response.close()
+        message = f"Download failure: {architecture_contents_index_url}; {response.status_code} - {response.reason}"
+        logging.critical(message)
+        raise requests.exceptions.RequestException()
+
+    return response.iter_content(chunk_size=cons.DOWNLOAD_CHUNK_SIZE)
+
+
 def get_last_modified_timestamp(arch: str) -> str:
     """Returns the timestamp of the last modification time for the Contents index file of the given architecture"""
     # P: This function failing only means that, if a cache exists for this architecture choice already, it can't
@@ -36,12 +109,157 @@ def get_last_modified_timestamp(arch: str) -> str:
     #    stop the program.
     timestamp = ""
     try:
-        ftp = ftplib.FTP(cons.HOST)
-        ftp.login()
-        ftp.cwd(cons.CONTENT_INDICES_SLUG)
-        timestamp = ftp.sendcmd(f"MDTM Contents-{arch}.gz")
-        ftp.quit()
+        with metrics.phase("ftp_timestamp"):
+            ftp = ftplib.FTP(cons.HOST, timeout=cons.HTTP_TIMEOUT[0])
+            ftp.login()
+            ftp.cwd(cons.CONTENT_INDICES_SLUG)
+            timestamp = ftp.sendcmd(f"MDTM Contents-{arch}.gz")
+            ftp.quit()
     except ftplib.Error as e:
         logging.info(f"Failed reading last modify time of contents index for {cons.RESET}{arch}; ftplib error: {e}")
     finally:
         return timestamp
+
+
+def revalidate_contents_index(arch: str, cached_validators: dict) -> tuple[dict[str, str], requests.Response | None]:
+    """Asks the mirror over HTTP whether the contents index for <arch> has changed since <cached_validators> (the "etag"
+    and "last_modified" of a cache entry) were recorded.
+
+    Returns the current validators, along with a streaming response for the new file if it has changed, or None if it
+    hasn't. Passing empty validators always gets a response. If the HTTP request fails, the FTP MDTM timestamp is used
+    instead, and no response is returned."""
+    # P: This is a conditional GET rather than a HEAD followed by a GET. A 304 short-circuits the cache check in one
+    #    round trip, and when the file has changed, the same request carries on as the download.
+    headers = {}
+    if cached_validators.get("etag"):
+        headers["If-None-Match"] = cached_validators["etag"]
+    if cached_validators.get("last_modified"):
+        headers["If-Modified-Since"] = cached_validators["last_modified"]
+
+    architecture_contents_index_url = get_contents_index_url(arch)
+    try:
+        with metrics.phase("revalidate"):  # Only the headers are read here, the body is read as the download
+            response = get_session().get(architecture_contents_index_url, headers=headers, stream=True,
+                                         timeout=cons.HTTP_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logging.info(f"Failed revalidating contents index for {arch} over HTTP, falling back to FTP; error: {e}")
+        return {"etag": "", "last_modified": mdtm_to_http_date(get_last_modified_timestamp(arch))}, None
+
+    if response.status_code == 304:
+        response.close()
+        server_validators = {"etag": response.headers.get("ETag", cached_validators.get("etag", "")),
+                             "last_modified": response.headers.get("Last-Modified",
+                                                                   cached_validators.get("last_modified", ""))}
+        return server_validators, None
+    elif response.status_code != 200:
+        response.close()
+        message = f"Download failure: {architecture_contents_index_url}; {response.status_code} - {response.reason}"
+        logging.critical(message)
+        raise requests.exceptions.RequestException()
+
+    return get_response_validators(response), response
+
+
+def get_contents_index_validators(arch: str) -> dict[str, str]:
+    """Returns the current "etag" and "last_modified" validators of the contents index for <arch> with a HEAD request,
+    falling back to the FTP MDTM timestamp if that fails. Either value is an empty string if it can't be retrieved."""
+    try:
+        with metrics.phase("revalidate"):
+            response = get_session().head(get_contents_index_url(arch), timeout=cons.HTTP_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logging.info(f"Failed reading validators of contents index for {arch} over HTTP, falling back to FTP; "
+                      f"error: {e}")
+        response = None
+
+    if response is None or response.status_code != 200:
+        return {"etag": "", "last_modified": mdtm_to_http_date(get_last_modified_timestamp(arch))}
+
+    return get_response_validators(response)
+
+
+def get_response_validators(response: requests.Response) -> dict[str, str]:
+    """Returns the "etag" and "last_modified" cache validators from the headers of <response>."""
+    return {"etag": response.headers.get("ETag", ""), "last_modified": response.headers.get("Last-Modified", "")}
+
+
+def mdtm_to_http_date(mdtm_response: str) -> str:
+    """Converts an FTP MDTM response (e.g. "213 20240210093027") to the HTTP date format of a Last-Modified header (e.g.
+    "Sat, 10 Feb 2024 09:30:27 GMT"), so that timestamps from either protocol can be compared. Returns an empty string
+    if <mdtm_response> can't be parsed."""
+    try:
+        modified_time = datetime.strptime(mdtm_response.split()[-1][:14], "%Y%m%d%H%M%S")
+    except (IndexError, ValueError):
+        return ""
+
+    return format_datetime(modified_time.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def get_release_url() -> str:
+    """Returns the URL of the Release file of the suite the contents indices belong to"""
+    return f"http://{cons.HOST}/{cons.CONTENT_INDICES_SLUG.rpartition('/')[0]}/Release"
+
+
+def read_release_file(cached_validators: dict) -> tuple[dict[str, str], str | None]:
+    """Returns the current "etag" and "last_modified" validators of the suite's Release file, along with its text, or
+    None if it hasn't changed since <cached_validators> were recorded. Raises requests.exceptions.RequestException if it
+    can't be read."""
+    headers = {}
+    if cached_validators.get("etag"):
+        headers["If-None-Match"] = cached_validators["etag"]
+    if cached_validators.get("last_modified"):
+        headers["If-Modified-Since"] = cached_validators["last_modified"]
+
+    release_url = get_release_url()
+    with metrics.phase("release_download") as counts:
+        response = get_session().get(release_url, headers=headers, timeout=cons.HTTP_TIMEOUT)
+        counts["bytes"] += len(response.content)
+
+    if response.status_code == 304:
+        return {"etag": response.headers.get("ETag", cached_validators.get("etag", "")),
+                "last_modified": response.headers.get("Last-Modified",
+                                                      cached_validators.get("last_modified", ""))}, None
+    elif response.status_code != 200:
+        raise requests.exceptions.RequestException(f"Download failure: {release_url}; {response.status_code} - "
+                                                   f"{response.reason}")
+
+    return get_response_validators(response), response.text
+
+
+def get_pdiff_url(arch: str, file_name: str) -> str:
+    """Returns the URL of <file_name> in the pdiff directory for the contents index of <arch>"""
+    return f"http://{cons.HOST}/{cons.CONTENT_INDICES_SLUG}/Contents-{arch}.diff/{file_name}"
+
+
+def read_pdiff_index(arch: str) -> str:
+    """Returns the text of the pdiff Index for the contents index of <arch>, or an empty string if the mirror doesn't
+    offer one."""
+    # P: Not every mirror or suite publishes pdiffs, and a missing Index just means a full download, so failures are
+    #    logged quietly rather than stopping the program.
+    try:
+        with metrics.phase("pdiff_download") as counts:
+            response = get_session().get(get_pdiff_url(arch, "Index"), timeout=cons.HTTP_TIMEOUT)
+            counts["bytes"] += len(response.content)
+    except requests.exceptions.RequestException as e:
+        logging.info(f"Failed reading pdiff Index for {arch}; error: {e}")
+        return ""
+
+    if response.status_code != 200:
+        logging.info(f"No pdiff Index for {arch}; {response.status_code} - {response.reason}")
+        return ""
+
+    return response.text
+
+
+def read_pdiff_patch(arch: str, patch_name: str) -> bytes:
+    """Returns the bytes of the gzipped pdiff patch <patch_name> for the contents index of <arch>"""
+    patch_url = get_pdiff_url(arch, f"{patch_name}.gz")
+    with metrics.phase("pdiff_download") as counts:
+        response = get_session().get(patch_url, timeout=cons.HTTP_TIMEOUT)
+        counts["bytes"] += len(response.content)
+
+    if response.status_code != 200:
+        message = f"Download failure: {patch_url}; {response.status_code} - {response.reason}"
+        logging.warning(message)
+        raise requests.exceptions.RequestException(message)
+
+    return response.content
@@ -0,0 +1,58 @@
+"""Functions for decompressing gzipped contents indices incrementally, as their bytes arrive."""
+from typing import Iterable, Iterator
+import zlib
+
+
+# Tells zlib to expect (and verify) a gzip header and trailer around the deflate stream
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def iter_gzip_blocks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompresses the gzipped bytes in <chunks> as they arrive, yielding blocks of decompressed bytes that always end
+    on a line boundary.
+
+    Only one chunk's worth of decompressed data (plus a partial line) is held at any time, so memory stays bounded no
+    matter how large the file is. Raises EOFError if <chunks> ends before the end of the gzip stream, the same way
+    gzip.GzipFile does for a truncated file."""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    partial_line = b""
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        # A gzip file can consist of several members back to back. Each one needs a fresh decompressor.
+        while decompressor.eof and decompressor.unused_data:
+            next_member = decompressor.unused_data
+            decompressor = zlib.decompressobj(GZIP_WBITS)
+            data += decompressor.decompress(next_member)
+
+        last_newline = data.rfind(b"\n")
+        if last_newline == -1:
+            partial_line += data
+            continue
+
+        yield partial_line + data[:last_newline + 1]
+        partial_line = data[last_newline + 1:]
+
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+    if partial_line:
+        yield partial_line
+
+    return
+
+
+def iter_gzip_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Decompresses the gzipped bytes in <chunks> as they arrive, yielding one line at a time without its newline."""
+    return iter_block_lines(iter_gzip_blocks(chunks))
+
+
+def iter_block_lines(blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields the lines of each of <blocks>, as yielded by iter_gzip_blocks(), one at a time without their newlines."""
+    for block in blocks:
+        lines = block.split(b"\n")
+        if block.endswith(b"\n"):
+            lines.pop()  # split() leaves an empty string after the final newline
+
+        yield from lines
+
+    return
@@ -0,0 +1,313 @@
+"""Incremental updates of package file counts, using the pdiffs that Debian publishes for each contents index.
+
+For every architecture, the full package count table is kept locally, along with the package field of every line of
+the contents index it was counted from and that file's SHA256. When the mirror's file changes, the ed-style patches
+between the two versions are applied to the stored lines and the counts are adjusted, instead of downloading and
+parsing the whole file again."""
+from array import array
+import bulk_parser as bulk
+from collections import Counter
+import constants as cons
+import debian_mirror as deb
+import decompression as decomp
+import gzip
+import hashlib
+import json
+import logging
+import metrics
+import os
+import re
+import requests
+import sys
+from typing import Callable, Iterable
+
+
+# An ed command as written by diff --ed: a line number or range, then append, change, or delete
+ED_COMMAND_PATTERN = re.compile(rb"(\d+)(?:,(\d+))?([acd])")
+
+# Stored line arrays hold one unsigned 32-bit field ID (or size in bytes) per line of the contents index
+LINE_ARRAY_TYPECODE = "I"
+
+# Stored states in any other format are discarded, and rebuilt from a full download
+STATE_FORMAT = 2
+
+
+# P: A state is a plain dictionary, the same as the entries in the JSON cache:
+#      "sha256"       - SHA256 of the uncompressed contents index the state describes, as listed in the pdiff Index
+#      "field_ids"    - Each distinct package field mapped to an ID, in order of first appearance. ID 0 is the empty
+#                       field, which stands for every line that isn't a valid table row.
+#      "lines"        - array of the field ID of every line in the file, in order
+#      "line_sizes"   - array of the size in bytes of every line in the file, newline included, in order
+#      "field_counts" - Counter of how many lines have each field ID
+#    Only the package field of each line is kept, since that's all a deleted line needs to adjust the counts. That's 4
+#    bytes per line instead of the whole line. Without the text, a patched file can't be hashed, so its size (the sum of
+#    <line_sizes>) is checked against the size the pdiff Index lists for its SHA256 instead.
+def update_package_counts(arch: str, open_chunks: Callable[[], Iterable[bytes]]) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts for the current contents index of <arch>.
+
+    If a stored state for <arch> can be brought up to date with the mirror's pdiffs, only the patches are downloaded.
+    Otherwise <open_chunks> is called for the whole gzipped file, which is counted in full. Either way the new state
+    is stored for next time."""
+    state = load_state(arch)
+    if state is None or not patch_state(arch, state):
+        state = build_state(open_chunks())
+
+    save_state(arch, state)
+    return get_package_counts(state)
+
+
+def build_state(chunks: Iterable[bytes]) -> dict:
+    """Builds a state from the full gzipped contents index in <chunks>, hashing the decompressed bytes in the same
+    pass as parsing them."""
+    digest = hashlib.sha256()
+    field_ids = {b"": 0}
+    lines = array(LINE_ARRAY_TYPECODE)
+    line_sizes = array(LINE_ARRAY_TYPECODE)
+    with metrics.phase("parse"):
+        for block in metrics.measure_iter("decompress", decomp.iter_gzip_blocks(chunks), count_lines=True):
+            digest.update(block)
+            # setdefault() only adds a field the first time it's seen, and len() is evaluated before it's added
+            lines.extend([field_ids.setdefault(field, len(field_ids))
+                          for field in bulk.get_line_package_fields(block)])
+            line_sizes.extend(get_line_sizes(block))
+
+    return {"sha256": digest.hexdigest(), "field_ids": field_ids, "lines": lines, "line_sizes": line_sizes,
+            "field_counts": Counter(lines)}
+
+
+def get_line_sizes(block: bytes) -> list[int]:
+    """Returns the size in bytes of every line in <block>, newline included, with one size for each of the fields from
+    bulk_parser.get_line_package_fields()."""
+    line_sizes = [len(line) + 1 for line in block.split(b"\n")]
+    if block.endswith(b"\n"):
+        line_sizes.pop()  # The empty string after the final newline isn't a line
+    else:
+        line_sizes[-1] -= 1  # The last line of the file has no newline
+
+    return line_sizes
+
+
+def get_package_counts(state: dict) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts described by <state>."""
+    fields = list(state["field_ids"])
+    field_counts = {fields[field_id]: count for field_id, count in state["field_counts"].items()
+                    if field_id != 0 and count > 0}
+    return bulk.expand_package_fields(field_counts)
+
+
+def patch_state(arch: str, state: dict) -> bool:
+    """Brings <state> up to date with the mirror's current contents index for <arch> by applying pdiffs to it.
+
+    Returns True if <state> is now current, or False if it can't be patched (no pdiffs, a state too old for the pdiff
+    history, or a failed patch). A patch fails if it doesn't match its SHA256 in the index, or if the patched file
+    isn't the size the index lists for the current version, such as after a patch meant for another version. <state>
+    may be partially patched when False is returned, so it should be discarded."""
+    index = parse_pdiff_index(deb.read_pdiff_index(arch))
+    if not index["current"]:
+        return False
+    elif state["sha256"] == index["current"]:
+        return True
+
+    patch_names = get_patch_sequence(index, state["sha256"])
+    if not patch_names:
+        logging.info(f"Stored state for {arch} is not in the pdiff history, a full download is needed")
+        return False
+
+    try:
+        check_size(state, index, state["sha256"])  # Patching a state that's already wrong can only give wrong counts
+        for patch_name in patch_names:
+            compressed_patch = deb.read_pdiff_patch(arch, patch_name)
+            expected_hash = index["downloads"].get(f"{patch_name}.gz")
+            if expected_hash and hashlib.sha256(compressed_patch).hexdigest() != expected_hash:
+                raise ValueError(f"SHA256 mismatch for pdiff {patch_name}")
+
+            patch = gzip.decompress(compressed_patch)
+            expected_hash = index["patches"].get(patch_name)
+            if expected_hash and hashlib.sha256(patch).hexdigest() != expected_hash:
+                raise ValueError(f"SHA256 mismatch for uncompressed pdiff {patch_name}")
+
+            with metrics.phase("pdiff_apply"):
+                apply_ed_script(state, patch)
+
+        check_size(state, index, index["current"])
+    except (requests.exceptions.RequestException, ValueError, OSError, EOFError) as e:
+        logging.warning(f"Failed applying pdiffs for {arch}, a full download is needed; error: {e!r}")
+        return False
+
+    state["sha256"] = index["current"]
+    return True
+
+
+def check_size(state: dict, index: dict, sha256: str) -> None:
+    """Raises ValueError unless the file described by <state> is the size that <index> (from parse_pdiff_index())
+    lists for the version with <sha256>, or if it lists no size for it."""
+    expected_size = index["sizes"].get(sha256)
+    if expected_size is None:
+        raise ValueError(f"No size listed for the version with SHA256 {sha256}")
+    elif sum(state["line_sizes"]) != expected_size:
+        raise ValueError(f"Size mismatch for the version with SHA256 {sha256}: {sum(state['line_sizes'])} bytes, "
+                         f"expected {expected_size}")
+
+    return
+
+
+def parse_pdiff_index(index_text: str) -> dict:
+    """Returns the parts of a pdiff Index file that are needed to patch a contents index: the "current" SHA256, the
+    "history" of (SHA256, patch name) pairs oldest first, the uncompressed size of every version by SHA256 in "sizes",
+    the SHA256 of each compressed patch in "downloads" and of each uncompressed one in "patches", and whether the
+    patches are "merged" (each one goes straight to the current version)."""
+    index = {"current": "", "history": [], "sizes": {}, "downloads": {}, "patches": {}, "merged": False}
+    field = ""
+    for line in index_text.splitlines():
+        if not line.strip():
+            continue
+        elif line[0].isspace():  # A continuation line of a multi-line field, formatted as "<sha256> <size> <name>"
+            values = line.split()
+            if len(values) != 3:
+                continue
+            elif field == "SHA256-History":
+                index["history"].append((values[0], values[2]))
+                index["sizes"][values[0]] = int(values[1])
+            elif field == "SHA256-Download":
+                index["downloads"][values[2]] = values[0]
+            elif field == "SHA256-Patches":
+                index["patches"][values[2]] = values[0]
+            continue
+
+        field, _, value = line.partition(":")
+        if field == "SHA256-Current" and value.split():
+            index["current"] = value.split()[0]
+            if len(value.split()) > 1:
+                index["sizes"][index["current"]] = int(value.split()[1])
+        elif field == "X-Patch-Precedence":
+            index["merged"] = value.strip() == "merged"
+
+    return index
+
+
+def get_patch_sequence(index: dict, sha256: str) -> list[str]:
+    """Returns the names of the patches, in order, that turn the file with <sha256> into the current one described by
+    <index>. Returns an empty list if <sha256> isn't in the history."""
+    for position, (history_hash, patch_name) in enumerate(index["history"]):
+        if history_hash == sha256:
+            return [patch_name] if index["merged"] else [name for _, name in index["history"][position:]]
+
+    return []
+
+
+def apply_ed_script(state: dict, script: bytes) -> None:
+    """Applies the ed script <script>, as written by diff --ed, to the lines of <state> and adjusts its counts.
+
+    Only the commands diff --ed writes are supported (append, change, and delete). Raises ValueError for anything
+    else, or for line numbers outside the file."""
+    lines = state["lines"]
+    line_sizes = state["line_sizes"]
+    field_counts = state["field_counts"]
+    field_ids = state["field_ids"]
+    script_lines = script.split(b"\n")
+    position = 0
+    while position < len(script_lines):
+        command = script_lines[position]
+        position += 1
+        if not command:
+            continue
+
+        match = ED_COMMAND_PATTERN.fullmatch(command)
+        if match is None:
+            raise ValueError(f"Unsupported ed command: {command!r}")
+
+        first = int(match[1])
+        last = int(match[2] or match[1])
+        action = match[3]
+        if first > last or last > len(lines) or (action != b"a" and first < 1):
+            raise ValueError(f"Ed command out of range for a file of {len(lines)} lines: {command!r}")
+
+        new_lines = array(LINE_ARRAY_TYPECODE)
+        new_line_sizes = array(LINE_ARRAY_TYPECODE)
+        if action in (b"a", b"c"):
+            try:
+                text_end = script_lines.index(b".", position)  # Appended or changed text is ended by a lone "."
+            except ValueError:
+                raise ValueError(f"Unterminated text for ed command: {command!r}")
+
+            if text_end > position:
+                text = b"\n".join(script_lines[position:text_end]) + b"\n"
+                new_lines.extend([field_ids.setdefault(field, len(field_ids))
+                                  for field in bulk.get_line_package_fields(text)])
+                new_line_sizes.extend(get_line_sizes(text))
+            position = text_end + 1
+
+        if action == b"a":
+            lines[first:first] = new_lines
+            line_sizes[first:first] = new_line_sizes
+        else:
+            field_counts.subtract(lines[first - 1:last])
+            lines[first - 1:last] = new_lines
+            line_sizes[first - 1:last] = new_line_sizes
+
+        field_counts.update(new_lines)
+
+    return
+
+
+def get_state_path(arch: str) -> str:
+    """Returns the path of the stored state file for <arch>."""
+    return os.path.join(cons.DELTA_STATE_DIRECTORY, f"{arch}.state")
+
+
+def save_state(arch: str, state: dict) -> None:
+    """Stores <state> for <arch>, replacing any previous one atomically.
+
+    The file is one line of JSON (the format, the SHA256, the fields in ID order, and the full package counts table for
+    anything else that wants it) followed by the raw bytes of the line array, and then of the line size array."""
+    # P: Everything is in one file so that a single os.replace() swaps it in. With the JSON and the line array in
+    #    separate files, a crash between the two writes could pair an old hash with new lines and silently corrupt
+    #    every later patch.
+    os.makedirs(cons.DELTA_STATE_DIRECTORY, exist_ok=True)
+    header = {"format": STATE_FORMAT,
+              "sha256": state["sha256"],
+              "byteorder": sys.byteorder,
+              "fields": [field.decode(errors="surrogateescape") for field in state["field_ids"]],
+              "packages": {package.decode(errors="surrogateescape"): count
+                           for package, count in get_package_counts(state).items()}}
+
+    state_path = get_state_path(arch)
+    temporary_path = f"{state_path}.{os.getpid()}.tmp"
+    with metrics.phase("delta_state_write"):
+        try:
+            with open(temporary_path, "wb") as file:
+                file.write(json.dumps(header).encode() + b"\n")
+                state["lines"].tofile(file)
+                state["line_sizes"].tofile(file)
+
+            os.replace(temporary_path, state_path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    return
+
+
+def load_state(arch: str) -> dict | None:
+    """Returns the stored state for <arch>, or None if there isn't a usable one."""
+    try:
+        with metrics.phase("delta_state_read"), open(get_state_path(arch), "rb") as file:
+            header = json.loads(file.readline())
+            line_arrays = array(LINE_ARRAY_TYPECODE)
+            line_arrays.frombytes(file.read())
+        if header.get("format") != STATE_FORMAT or len(line_arrays) % 2:
+            raise ValueError(f"Stored state isn't in format {STATE_FORMAT}")
+    except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError, as is a truncated line array
+        if not isinstance(e, FileNotFoundError):
+            logging.warning(f"Discarding unreadable stored state for {arch}; error: {e!r}")
+        return None
+
+    if header["byteorder"] != sys.byteorder:
+        line_arrays.byteswap()
+
+    # Both arrays have one item per line, so each is half of what was read
+    lines = line_arrays[:len(line_arrays) // 2]
+    line_sizes = line_arrays[len(line_arrays) // 2:]
+    field_ids = {field.encode(errors="surrogateescape"): field_id for field_id, field in enumerate(header["fields"])}
+    return {"sha256": header["sha256"], "field_ids": field_ids, "lines": lines, "line_sizes": line_sizes,
+            "field_counts": Counter(lines)}
@@ -0,0 +1,28 @@
+"""Lazy imports, for modules that only some runs of the program need.
+
+A lazily imported module is registered straight away, but none of its code runs until one of its attributes is first
+used. Names are looked up the same way as with a plain import statement."""
+# P: A run answered from the cache never downloads or parses anything, but importing requests alone used to take longer
+#    than the rest of such a run put together. Importing inside every function that needs a module would do the same
+#    job, but would scatter the imports of main.py across dozens of functions.
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Returns the module <name>, which is only actually imported the first time one of its attributes is used. If it
+    has already been imported, it's returned as it is."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
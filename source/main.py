@@ -1,16 +1,40 @@
-import os
+from __future__ import annotations  # Keeps annotations such as requests.Response from importing their modules
 import traceback
 
+import aggregate_stats as agg
 from animations.animation import Animation
-from collections import defaultdict
+import argparse
+import blob_cache as blob
+import cache_store
+from collections import Counter, defaultdict
+import concurrent.futures
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import constants as cons
-import debian_mirror as deb
-import gzip
-import io
-import json
+import contextlib
+from functools import partial
+from itertools import islice, repeat
+from lazy_modules import lazy_import
 import logging
-import requests.exceptions
+import metrics
+from package_counts import get_top
 import sys
+from typing import Iterable, Mapping
+
+# Only imported once something is actually downloaded, parsed or served, so that a run answered from the cache doesn't
+# pay for them (see lazy_modules)
+bulk = lazy_import("bulk_parser")
+deb = lazy_import("debian_mirror")
+decomp = lazy_import("decompression")
+delta = lazy_import("delta_updates")
+mirrors = lazy_import("mirrors")
+pgz = lazy_import("parallel_gzip")
+release = lazy_import("release_file")
+views = lazy_import("count_views")
+requests = lazy_import("requests")
+rindex = lazy_import("reverse_index")
+snapshots = lazy_import("snapshot_store")
+stats_output = lazy_import("stats_output")
+stats_server = lazy_import("stats_server")
 
 
 def main() -> None:  # P: Conventionally, main returns nothing. Python doesn't require this, so still worth a type hint.
@@ -22,8 +46,146 @@ def main() -> None:  # P: Conventionally, main returns nothing. Python doesn't r
     logging.basicConfig(filename="./logs.log", level=logging.WARNING, encoding="utf-8",
                         format="%(asctime)s -- %(levelname)s -- %(message)s")
 
-    if is_user_input_valid(sys.argv):
-        analyze_architecture_contents(sys.argv[1])
+    options, arguments = parse_options(sys.argv)
+    apply_options(options)
+
+    if len(arguments) > 1 and arguments[1] in cons.QUERY_COMMANDS:
+        query_reverse_index(arguments)
+    elif len(arguments) > 1 and arguments[1] in cons.HISTORY_COMMANDS:
+        query_history(arguments)
+    elif len(arguments) > 1 and arguments[1] == cons.SERVE_COMMAND:
+        select_fastest_mirror()
+        serve_statistics(arguments)
+    elif is_user_input_valid(arguments):
+        architectures = get_requested_architectures(arguments)
+        with metrics.profiling(cons.PROFILE_PATH, cons.TRACE_MEMORY):
+            select_fastest_mirror()
+            if cons.AGGREGATE_MODE:
+                analyze_aggregate(architectures)
+            elif len(architectures) == 1:
+                analyze_architecture_contents(architectures[0])
+            else:
+                analyze_architectures(architectures)
+
+        if cons.METRICS_DESTINATION:
+            metrics.write_report(cons.METRICS_DESTINATION)
+
+    return
+
+
+def parse_options(arguments: list[str]) -> tuple[argparse.Namespace, list[str]]:
+    """Separates the optional run time settings from <arguments>.
+
+    Returns the settings, with defaults from constants for any not given, and the remaining arguments (the program
+    name followed by the architectures) for is_user_input_valid() to check."""
+    # P: argparse is only used for the optional settings. Architecture validation stays in is_user_input_valid(), which
+    #    gives friendlier output for the most common mistake (a misspelled architecture) than argparse would.
+    parser = argparse.ArgumentParser(prog="main.py", add_help=False, allow_abbrev=False)
+    parser.add_argument("--cache-size", type=positive_integer, default=cons.CACHE_SIZE)
+    parser.add_argument("--show-count", type=positive_integer, default=cons.SHOW_COUNT)
+    parser.add_argument("--engine", choices=sorted(cons.PARSER_ENGINES), default=cons.PARSER_ENGINE)
+    parser.add_argument("--incremental", action="store_true", default=cons.INCREMENTAL_UPDATES)
+    parser.add_argument("--blob-cache-mb", type=non_negative_integer, default=cons.BLOB_CACHE_MAX_MB)
+    parser.add_argument("--workers", type=positive_integer, default=cons.DECOMPRESSION_WORKERS)
+    parser.add_argument("--build-index", action="store_true", default=cons.BUILD_REVERSE_INDEX)
+    parser.add_argument("--aggregate", action="store_true", default=cons.AGGREGATE_MODE)
+    parser.add_argument("--views", type=name_list, default=cons.SELECTED_VIEWS)
+    parser.add_argument("--view-rules", default="")
+    parser.add_argument("--port", type=positive_integer, default=cons.SERVER_PORT)
+    parser.add_argument("--mirrors", type=host_list, default=cons.MIRRORS)
+    parser.add_argument("--max-age", type=non_negative_integer, default=cons.RELEASE_MAX_AGE)
+    parser.add_argument("--metrics", default=cons.METRICS_DESTINATION)
+    parser.add_argument("--profile", default=cons.PROFILE_PATH)
+    parser.add_argument("--trace-memory", action="store_true", default=cons.TRACE_MEMORY)
+    parser.add_argument("--format", choices=sorted(cons.OUTPUT_FORMATS), default=cons.OUTPUT_FORMAT)
+    parser.add_argument("--output", default=cons.OUTPUT_PATH)
+    options, remaining_arguments = parser.parse_known_args(arguments[1:])
+    if options.output and options.format == "table":
+        parser.error("--output needs a --format other than table")
+    try:
+        # Views in the file replace built-in views of the same name
+        options.count_views = {**cons.COUNT_VIEWS, **(views.load_views(options.view_rules) if options.view_rules
+                                                      else {})}
+    except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError too
+        parser.error(f"--view-rules {options.view_rules}: {e}")
+    unknown_views = [name for name in options.views if name not in options.count_views]
+    if unknown_views:
+        parser.error(f"unknown views: {', '.join(unknown_views)} "
+                     f"(choose from {', '.join(sorted(options.count_views))})")
+
+    return options, arguments[:1] + remaining_arguments
+
+
+def positive_integer(argument: str) -> int:
+    """Argument type for parse_options() that only accepts integers greater than zero."""
+    value = int(argument)  # argparse turns the ValueError into a usage message
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be greater than zero: {argument}")
+
+    return value
+
+
+def non_negative_integer(argument: str) -> int:
+    """Argument type for parse_options() that only accepts integers of zero or more."""
+    value = int(argument)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {argument}")
+
+    return value
+
+
+def host_list(argument: str) -> list[str]:
+    """Argument type for parse_options() that splits a comma-separated list of mirror hosts."""
+    hosts = [host.strip() for host in argument.split(",") if host.strip()]
+    if not hosts:
+        raise argparse.ArgumentTypeError(f"must name at least one host: {argument}")
+
+    return hosts
+
+
+def name_list(argument: str) -> list[str]:
+    """Argument type for parse_options() that splits a comma-separated list of names, such as the views to count."""
+    names = [name.strip() for name in argument.split(",") if name.strip()]
+    if not names:
+        raise argparse.ArgumentTypeError(f"must give at least one name: {argument}")
+
+    return names
+
+
+def apply_options(options: argparse.Namespace) -> None:
+    """Overrides the defaults in constants with the settings chosen at run time in <options>."""
+    apply_settings({"SHOW_COUNT": options.show_count,
+                    "CACHE_SIZE": max(options.cache_size, options.show_count),  # Else every cache entry is too short
+                    "PARSER_ENGINE": options.engine,
+                    "INCREMENTAL_UPDATES": options.incremental,
+                    "BLOB_CACHE_MAX_MB": options.blob_cache_mb,
+                    "DECOMPRESSION_WORKERS": options.workers,
+                    "BUILD_REVERSE_INDEX": options.build_index,
+                    "AGGREGATE_MODE": options.aggregate,
+                    "COUNT_VIEWS": options.count_views,
+                    "SELECTED_VIEWS": options.views,
+                    "SERVER_PORT": options.port,
+                    "HOST": options.mirrors[0] if options.mirrors else cons.HOST,
+                    "MIRRORS": options.mirrors,
+                    "RELEASE_MAX_AGE": options.max_age,
+                    "METRICS_DESTINATION": options.metrics,
+                    "PROFILE_PATH": options.profile,
+                    "TRACE_MEMORY": options.trace_memory,
+                    "OUTPUT_FORMAT": options.format,
+                    "OUTPUT_PATH": options.output})
+    return
+
+
+def get_settings() -> dict:
+    """Returns the current values of every setting in <cons.RUN_TIME_SETTINGS>."""
+    return {name: getattr(cons, name) for name in cons.RUN_TIME_SETTINGS}
+
+
+def apply_settings(settings: dict) -> None:
+    """Overrides constants with <settings>, a dictionary of constant names and values. Also used as the initializer
+    for worker processes, so that they run with the same settings as the main process."""
+    for name, value in settings.items():
+        setattr(cons, name, value)
 
     return
 
@@ -31,69 +193,573 @@ def main() -> None:  # P: Conventionally, main returns nothing. Python doesn't r
 # P: Put user input handling into its own function for easier testing.
 def is_user_input_valid(arguments: list[str]) -> bool:
     """Returns true if user input is valid, else returns false and lets the user know why their input is invalid."""
-    if len(arguments) != 2:
+    if len(arguments) < 2:
         logging.info(f"Invalid program usage. Input received: {arguments}")
         print(cons.PASSING_ARGUMENT_INSTRUCTIONS)
         return False
-    elif arguments[1] not in cons.VALID_ARCHITECTURES:
-        logging.info(f"Invalid architecture passed to program: {arguments[1]}")
-        print(f"\n{cons.RED}Invalid architecture:{cons.RESET} {arguments[1]}")
+    elif cons.ALL_ARCHITECTURES_FLAG in arguments[1:]:
+        if len(arguments) != 2:
+            logging.info(f"Invalid program usage. Input received: {arguments}")
+            print(cons.PASSING_ARGUMENT_INSTRUCTIONS)
+            return False
+
+        return True
+
+    invalid_architectures = [arch for arch in arguments[1:] if arch not in cons.VALID_ARCHITECTURES]
+    if invalid_architectures:
+        logging.info(f"Invalid architecture passed to program: {', '.join(invalid_architectures)}")
+        print(f"\n{cons.RED}Invalid architecture:{cons.RESET} {', '.join(invalid_architectures)}")
         print(cons.ARCHITECTURES_LIST)
         return False
 
     return True
 
 
+def get_requested_architectures(arguments: list[str]) -> list[str]:
+    """Returns the architectures named in <arguments> in the order given, without duplicates. Assumes the arguments have
+    already been validated by is_user_input_valid()."""
+    if arguments[1] == cons.ALL_ARCHITECTURES_FLAG:
+        return sorted(cons.VALID_ARCHITECTURES)
+
+    return list(dict.fromkeys(arguments[1:]))  # dict keys keep insertion order, unlike a set
+
+
+def select_fastest_mirror() -> None:
+    """Probes every mirror, if more than one was given, and makes the fastest <cons.HOST> for the rest of the run, with
+    the others that responded ranked after it in <cons.MIRRORS>."""
+    hosts = mirrors.get_mirror_hosts()
+    if len(hosts) < 2:
+        return
+
+    print(f"{cons.GREEN}Probing {cons.RESET}{len(hosts)}{cons.GREEN} mirrors{cons.RESET}", end="")
+    animation = Animation(cons.DEFAULT_ANIMATION)
+    animation.start()
+    ranked_hosts = mirrors.rank_mirrors(hosts)
+    animation.stop()
+
+    apply_settings({"HOST": ranked_hosts[0], "MIRRORS": ranked_hosts})
+    print(f"{cons.GREEN} Using {cons.RESET}{cons.HOST}")
+    return
+
+
+def query_reverse_index(arguments: list[str]) -> None:
+    """Looks up the files of a package, or the packages of a file, in the stored reverse index of an architecture, and
+    prints one result per line. <arguments> are the program name, the query command, the architecture, and the package
+    or file to look up."""
+    if len(arguments) != 4 or arguments[2] not in cons.VALID_ARCHITECTURES:
+        logging.info(f"Invalid query usage. Input received: {arguments}")
+        print(cons.PASSING_ARGUMENT_INSTRUCTIONS)
+        return
+
+    command, arch, name = arguments[1:]
+    index = rindex.open_index(arch)
+    if index is None:
+        print(f"{cons.YELLOW}No reverse index for {cons.RESET}{arch}{cons.YELLOW}. Build one by analyzing it with "
+              f"--build-index{cons.RESET}")
+        return
+
+    if command == "files":
+        results = rindex.find_package_files(index, name)
+    else:
+        results = rindex.find_path_packages(index, name)
+
+    if not results:
+        print(f"{cons.YELLOW}No {command} found for {cons.RESET}{name}")
+    for result in results:
+        print(result)
+
+    return
+
+
+def query_history(arguments: list[str]) -> None:
+    """Prints the file count of a package at each of the last few versions of an architecture's contents index, or the
+    packages whose counts changed the most over them, from the stored history (see snapshot_store). <arguments> are
+    the program name, the history command, the architecture, the package (for growth only), and optionally how many
+    versions to look back over, <cons.HISTORY_RELEASES> if not given."""
+    command = arguments[1] if len(arguments) > 1 else ""
+    required_count = 4 if command == "growth" else 3
+    if (len(arguments) not in (required_count, required_count + 1) or arguments[2] not in cons.VALID_ARCHITECTURES
+            or not all(argument.isdigit() and int(argument) > 0 for argument in arguments[required_count:])):
+        logging.info(f"Invalid history usage. Input received: {arguments}")
+        print(cons.PASSING_ARGUMENT_INSTRUCTIONS)
+        return
+
+    arch = arguments[2]
+    releases = int(arguments[required_count]) if len(arguments) > required_count else cons.HISTORY_RELEASES
+    history = snapshots.get_history(arch)
+    if not history:
+        print(f"{cons.YELLOW}No history for {cons.RESET}{arch}{cons.YELLOW} yet. A snapshot is recorded each time a "
+              f"new version of its contents index is analyzed{cons.RESET}")
+        return
+
+    if command == "growth":
+        package = arguments[3]
+        growth = snapshots.get_package_growth(history, package, releases)
+        print(f"{cons.CYAN}{package}{cons.GREEN} in {cons.RESET}{arch}{cons.GREEN} over the last {cons.RESET}"
+              f"{len(growth)}{cons.GREEN} versions{cons.RESET}", end="")
+        print_architecture_statistics({last_modified: f"{file_count} ({change:+})"
+                                       for last_modified, file_count, change in growth},
+                                      "FILES (CHANGE)", "LAST MODIFIED", len(growth))
+        return
+
+    movers = snapshots.get_movers(history, releases, cons.SHOW_COUNT)
+    print(f"{cons.CYAN}Biggest movers{cons.GREEN} in {cons.RESET}{arch}{cons.GREEN} over the last {cons.RESET}"
+          f"{min(releases, len(history) - 1)}{cons.GREEN} versions{cons.RESET}", end="")
+    if movers:
+        print_architecture_statistics({package: f"{change:+}" for package, change in movers.items()}, "CHANGE")
+    else:
+        print(f"{cons.GREEN} No changes{cons.RESET}\n")
+
+    return
+
+
+def serve_statistics(arguments: list[str]) -> None:
+    """Runs the local HTTP API (see stats_server) on the cached statistics of every architecture until interrupted.
+    <arguments> are the program name and the serve command."""
+    if len(arguments) != 2:
+        logging.info(f"Invalid serve usage. Input received: {arguments}")
+        print(cons.PASSING_ARGUMENT_INSTRUCTIONS)
+        return
+
+    # Aggregate entries share the cache, but aren't served
+    stats = {arch: arch_stats for arch, arch_stats in cache_store.get_cache().items()
+             if arch in cons.VALID_ARCHITECTURES}
+    worker_settings = {**get_settings(),
+                       "DECOMPRESSION_WORKERS": max(1, cons.DECOMPRESSION_WORKERS // cons.MAX_CONCURRENT_DOWNLOADS)}
+    # Counting runs in worker processes, so that it doesn't hold the GIL while requests are being answered
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cons.MAX_CONCURRENT_DOWNLOADS,
+                                                initializer=apply_settings, initargs=(worker_settings,)) as executor:
+        stats_server.serve(partial(refresh_architecture_stats, executor=executor), stats, cons.SERVER_HOST,
+                           cons.SERVER_PORT)
+
+    return
+
+
+def refresh_architecture_stats(arch: str, arch_stats: dict, executor: concurrent.futures.ProcessPoolExecutor) -> dict:
+    """Returns <arch_stats> if they're still up to date with the mirror. Otherwise, returns the cached statistics for
+    <arch> if another run has refreshed them, or counts the current contents index in a process of <executor>, caches
+    the new statistics, and returns them. Prints nothing, for use by the server."""
+    server_validators = get_server_validators([arch], {arch: arch_stats})[arch]
+    for known_stats in (arch_stats, cache_store.get_entry(arch)):
+        if (exists_valid_cache_entry(known_stats, server_validators["last_modified"], server_validators["etag"],
+                                     server_validators.get("sha256", ""))
+                and not needs_reverse_index(arch, server_validators)):
+            return known_stats
+
+    packages = executor.submit(count_contents_index, arch, None, server_validators).result()
+    arch_stats = {**server_validators, "packages": packages}
+    cache_store.put_entries({arch: arch_stats})
+    return arch_stats
+
+
+def needs_reverse_index(arch: str, validators: dict) -> bool:
+    """Returns True if a reverse index was asked for with --build-index, and the one for <arch> isn't for the version
+    of the contents index described by <validators>."""
+    return cons.BUILD_REVERSE_INDEX and not rindex.is_current(arch, blob.get_version(validators))
+
+
+def needs_views(arch: str, validators: dict) -> bool:
+    """Returns True if views were asked for with --views, and any of them isn't cached for <arch> as counted from the
+    version of the contents index described by <validators>."""
+    return bool(cons.SELECTED_VIEWS) and not views.has_views(arch, blob.get_version(validators), get_selected_views())
+
+
+def get_selected_views() -> dict[str, dict]:
+    """Returns the rules of each view chosen with --views, by view name."""
+    return {name: cons.COUNT_VIEWS[name] for name in cons.SELECTED_VIEWS}
+
+
 def analyze_architecture_contents(arch: str) -> None:  # P: Function name makes more sense now, so no change
     """The top level function for downloading, parsing, and displaying statistics from the Contents file for
     <arch>."""
-    cache = get_cache()
-    arch_stats = cache.get(arch, {})
+    arch_stats = cache_store.get_entry(arch)
+
+    # Only ask the mirror for a 304 if there's actually a usable entry to fall back on
+    usable_entry = exists_valid_cache_entry(arch_stats, arch_stats.get("last_modified", ""), arch_stats.get("etag", ""))
+    if usable_entry or blob.has_blob(arch, blob.get_version(arch_stats)):
+        cached_validators = arch_stats
+    else:
+        cached_validators = {}
 
     print(f"{cons.GREEN}Checking cache for up-to-date {cons.RESET}{arch}{cons.GREEN} statistics{cons.RESET}", end="")
     animation = Animation(cons.DEFAULT_ANIMATION)
     animation.start()
-    server_timestamp = deb.get_last_modified_timestamp(arch)
-    valid_entry = exists_valid_cache_entry(arch_stats, server_timestamp)
+    try:
+        checksum = release.get_checksums().get(arch, {})
+        if exists_valid_cache_entry(arch_stats, "", "", checksum.get("sha256", "")):
+            # The Release file still lists the file the statistics were counted from, so there's no need to ask
+            server_validators, response = get_entry_validators(arch_stats), None
+        else:
+            server_validators, response = deb.revalidate_contents_index(arch, cached_validators)
+            server_validators = {**server_validators, **checksum}
+    except Exception:
+        animation.stop()
+        print(f"{cons.RED} Failed{cons.RESET}")
+        raise
+
+    valid_entry = (exists_valid_cache_entry(arch_stats, server_validators["last_modified"], server_validators["etag"],
+                                            server_validators.get("sha256", ""))
+                   and not needs_reverse_index(arch, server_validators)
+                   and not needs_views(arch, server_validators))
     animation.stop()
 
     if valid_entry:
+        if response is not None:  # The mirror ignored the conditional request, but the validators still match
+            response.close()
         print(f"{cons.GREEN} Found{cons.RESET}")
     else:
         print(f"{cons.YELLOW} Not found{cons.RESET}")
-        content = deb.read_contents_index_file(arch)
-        cache[arch] = {"last_modified": server_timestamp, "packages": get_top_package_file_counts(content)}
+        packages = stream_top_package_file_counts(arch, response, server_validators)
+        arch_stats = {**server_validators, "packages": packages}
+        cache_store.put_entries({arch: arch_stats})
+
+    show_statistics(arch, arch_stats["packages"], show_name=False)
+    show_views(arch, server_validators)
+    return
+
+
+def analyze_architectures(architectures: list[str]) -> None:
+    """Batch version of analyze_architecture_contents() for several architectures at once.
+
+    Timestamps are checked concurrently, and every stale architecture is downloaded and counted in its own worker
+    process, at most <cons.MAX_CONCURRENT_DOWNLOADS> at a time. The cache is written once, after all of them finish."""
+    # P: Each worker streams its own download straight into the counter (see stream_top_package_file_counts()), so the
+    #    process pool doubles as the bounded download pool. Handing whole downloaded files from a thread pool to a
+    #    process pool would mean holding, and then pickling, every compressed file in memory.
+    cache = {arch: cache_store.get_entry(arch) for arch in architectures}
+    max_workers = min(cons.MAX_CONCURRENT_DOWNLOADS, len(architectures))
+
+    print(f"{cons.GREEN}Checking cache for up-to-date statistics{cons.RESET}", end="")
+    animation = Animation(cons.DEFAULT_ANIMATION)
+    animation.start()
+    server_validators = get_server_validators(architectures, cache)
+    animation.stop()
 
-        with open(cons.CACHE_PATH, "w") as json_file:
-            json.dump(cache, json_file)
+    stale_architectures = [arch for arch in architectures
+                           if not exists_valid_cache_entry(cache[arch], server_validators[arch]["last_modified"],
+                                                           server_validators[arch]["etag"],
+                                                           server_validators[arch].get("sha256", ""))
+                           or needs_reverse_index(arch, server_validators[arch])
+                           or needs_views(arch, server_validators[arch])]
+    print(f"{cons.GREEN} Found {cons.RESET}{len(architectures) - len(stale_architectures)}{cons.GREEN} of "
+          f"{cons.RESET}{len(architectures)}")
+
+    failed_architectures = set()
+    refreshed_entries = {}
+    if stale_architectures:
+        print(f"{cons.GREEN}Downloading and analyzing {cons.RESET}{len(stale_architectures)}{cons.GREEN} contents "
+              f"indices{cons.RESET}")
+        # The cores are shared between the architectures, rather than each one trying to use all of them
+        worker_count = min(max_workers, len(stale_architectures))
+        worker_settings = {**get_settings(),
+                           "DECOMPRESSION_WORKERS": max(1, cons.DECOMPRESSION_WORKERS // worker_count)}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=worker_count, initializer=apply_settings,
+                                                    initargs=(worker_settings,)) as executor:
+            # Each worker sends back its own phase metrics along with the counts
+            futures = {executor.submit(metrics.collect, count_contents_index, arch, None, server_validators[arch]): arch
+                       for arch in stale_architectures}
+            for future in as_completed(futures):
+                arch = futures[future]
+                try:
+                    packages, worker_phases = future.result()
+                except Exception as error:  # One failed architecture shouldn't throw away the rest of the batch
+                    logging.critical(f"Batch analysis failed for {arch}: {error!r}")
+                    print(f"\t{arch}{cons.RED} Failed{cons.RESET}")
+                    failed_architectures.add(arch)
+                    continue
+
+                metrics.merge_phases(worker_phases)
+                refreshed_entries[arch] = {**server_validators[arch], "packages": packages}
+                print(f"\t{arch}{cons.GREEN} Complete{cons.RESET}")
+
+        cache_store.put_entries(refreshed_entries)
+        cache.update(refreshed_entries)
+
+    for arch in architectures:
+        if arch not in failed_architectures:
+            show_statistics(arch, cache[arch]["packages"])
+            show_views(arch, server_validators[arch])
 
-    print_architecture_statistics(cache[arch]["packages"])
     return
 
 
-def exists_valid_cache_entry(arch_stats: dict, server_timestamp: str) -> bool:
+def analyze_aggregate(architectures: list[str]) -> None:
+    """Aggregate version of analyze_architectures(). <architectures> are analyzed together with the shared
+    architectures of their families (see aggregate_stats.add_shared_architecture()), and their combined statistics
+    are printed, followed by how each top package's files are split between them and how each architecture differs
+    from the first one (see aggregate_stats).
+
+    Each contents index is counted once, in its own worker process, and the full counts are merged. The aggregate is
+    cached under a key of its own, and each architecture's own cache entry is refreshed from the same counts."""
+    # P: Every architecture has to be counted in full, even if its own cache entry is current, since the cache only
+    #    keeps its top packages. With the blob cache, recounting a current architecture needs no download.
+    architectures = agg.add_shared_architecture(architectures)
+    aggregate_key = agg.get_aggregate_key(architectures)
+    aggregate_stats = cache_store.get_entry(aggregate_key)
+    max_workers = min(cons.MAX_CONCURRENT_DOWNLOADS, len(architectures))
+
+    print(f"{cons.GREEN}Checking cache for up-to-date aggregate statistics{cons.RESET}", end="")
+    animation = Animation(cons.DEFAULT_ANIMATION)
+    animation.start()
+    # Each architecture's own entry is written along with the aggregate, so it has the same validators
+    server_validators = get_server_validators(architectures,
+                                              {arch: cache_store.get_entry(arch) for arch in architectures})
+    animation.stop()
+
+    if (agg.is_valid_aggregate_entry(aggregate_stats, server_validators)
+            and not any(needs_reverse_index(arch, server_validators[arch]) for arch in architectures)):
+        print(f"{cons.GREEN} Found{cons.RESET}")
+        show_aggregate_statistics(aggregate_stats)
+        return
+
+    print(f"{cons.YELLOW} Not found{cons.RESET}")
+    print(f"{cons.GREEN}Downloading and analyzing {cons.RESET}{len(architectures)}{cons.GREEN} contents "
+          f"indices{cons.RESET}")
+    arch_counts = {}
+    worker_settings = {**get_settings(), "DECOMPRESSION_WORKERS": max(1, cons.DECOMPRESSION_WORKERS // max_workers)}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=apply_settings,
+                                                initargs=(worker_settings,)) as executor:
+        futures = {executor.submit(metrics.collect, tally_contents_index, arch, None, server_validators[arch]): arch
+                   for arch in architectures}
+        for future in as_completed(futures):
+            arch = futures[future]
+            try:
+                arch_counts[arch], worker_phases = future.result()
+            except Exception as error:
+                logging.critical(f"Aggregate analysis failed for {arch}: {error!r}")
+                print(f"\t{arch}{cons.RED} Failed{cons.RESET}")
+                continue
+
+            metrics.merge_phases(worker_phases)
+            print(f"\t{arch}{cons.GREEN} Complete{cons.RESET}")
+
+    # The architectures that were counted are cached on their own even if the aggregate can't be built without the rest
+    refreshed_entries = {arch: {**server_validators[arch], "packages": sort_package_file_counts(package_counts)}
+                         for arch, package_counts in arch_counts.items()}
+    if len(arch_counts) == len(architectures):
+        aggregate_stats = {"architectures": server_validators,
+                           **agg.build_aggregate({arch: arch_counts[arch] for arch in architectures}, cons.CACHE_SIZE)}
+        refreshed_entries[aggregate_key] = aggregate_stats
+    cache_store.put_entries(refreshed_entries)
+
+    if len(arch_counts) < len(architectures):
+        print(f"\n{cons.RED}Aggregate statistics need every architecture to be analyzed{cons.RESET}")
+        return
+
+    show_aggregate_statistics(aggregate_stats)
+    return
+
+
+def get_server_validators(architectures: list[str], cache: dict[str, dict]) -> dict[str, dict]:
+    """Returns the current validators of the contents index of each of <architectures>: its "etag" and "last_modified"
+    on the mirror, and its "sha256" and "size" from the Release file, if it's listed there.
+
+    The Release file is read first, with a single request for every architecture. The cached statistics in <cache> of
+    any architecture whose SHA256 it still lists are current, so their validators are used as they are. Only the other
+    architectures are asked for their own validators, concurrently."""
+    checksums = release.get_checksums()
+    server_validators = {arch: get_entry_validators(cache[arch]) for arch in architectures
+                         if exists_valid_cache_entry(cache.get(arch, {}), "", "",
+                                                     checksums.get(arch, {}).get("sha256", ""))}
+
+    unconfirmed_architectures = [arch for arch in architectures if arch not in server_validators]
+    if unconfirmed_architectures:
+        max_workers = min(cons.MAX_CONCURRENT_DOWNLOADS, len(unconfirmed_architectures))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for arch, validators in zip(unconfirmed_architectures,
+                                        executor.map(deb.get_contents_index_validators, unconfirmed_architectures)):
+                server_validators[arch] = {**validators, **checksums.get(arch, {})}
+
+    return {arch: server_validators[arch] for arch in architectures}
+
+
+def get_entry_validators(arch_stats: dict) -> dict:
+    """Returns the validators of the contents index that the cached <arch_stats> were counted from."""
+    return {key: arch_stats[key] for key in ("etag", "last_modified", "sha256", "size") if key in arch_stats}
+
+
+def exists_valid_cache_entry(arch_stats: dict, server_timestamp: str, server_etag: str = "",
+                             server_sha256: str = "") -> bool:
     """Checks if the architecture statistics passed are valid.
 
-    To be considered valid, statistics must be non-emtpy, contain at least <cons.SHOW_COUNT> entries, and have a
-    last_modified timestamp equal to that of the last modified timestamp from the debian mirror."""
+    To be considered valid, statistics must be non-emtpy, contain at least <cons.SHOW_COUNT> entries, and match the
+    debian mirror's current version of the file: by the SHA256 from the Release file when both sides have one, else by
+    ETag when both sides have one, otherwise by a last_modified timestamp equal to that of the last modified timestamp
+    from the debian mirror."""
     # P: Made this validation a separate function for easier testing
     if not arch_stats:
         return False
-    elif arch_stats["last_modified"] != server_timestamp:
+    elif server_sha256 and arch_stats.get("sha256"):
+        if arch_stats["sha256"] != server_sha256:
+            return False
+    elif server_etag and arch_stats.get("etag"):
+        if arch_stats["etag"] != server_etag:
+            return False
+    elif not server_timestamp or arch_stats["last_modified"] != server_timestamp:
         return False
-    elif len(arch_stats["packages"]) < cons.SHOW_COUNT:
+
+    if len(arch_stats["packages"]) < cons.SHOW_COUNT:
         return False
     else:
         return True
 
 
-def get_top_package_file_counts(zipped_arch_contents: bytes) -> dict[str, int]:
+def stream_top_package_file_counts(arch: str, response: requests.Response | None = None,
+                                   validators: dict | None = None) -> dict[str, int]:
     """Returns a sorted dictionary where each key is a package name, and each value is an integer count of how many
-    files are associated with that package in <zipped_arch_contents>.
+    files are associated with that package in the contents index for <arch>, showing an animation while it's counted.
 
     The returned dictionary contains the amount of items specified by <cons.CACHE_SIZE>, and is sorted in descending
-    order of file association counts. Any malformed entries as defined by the debian wiki below will be discarded
-    as it suggests.
+    order of file association counts (see count_contents_index()). The contents index is decompressed and counted
+    while it's still downloading, instead of after the whole file has been read into memory. If the download was
+    already started by a revalidation request, its streaming <response> is read instead of starting a new one. If the
+    version of the file described by <validators> is in the blob cache, it's read from there instead of the mirror."""
+    # P: The whole compressed file used to sit in memory before counting even started. Streaming it means the download
+    #    and the parsing overlap, and only a chunk of the file is ever held in memory at once.
+    if blob.has_blob(arch, blob.get_version(validators or {})):
+        print(f"{cons.GREEN}Analyzing cached {cons.RESET}{arch}{cons.GREEN} contents index{cons.RESET}", end="")
+    else:
+        print(f"{cons.GREEN}Downloading and analyzing {cons.RESET}{arch}{cons.GREEN} contents index{cons.RESET}",
+              end="")
+    animation = Animation(cons.DEFAULT_ANIMATION)
+    animation.start()
+
+    try:
+        file_counts = count_contents_index(arch, response, validators)
+    except Exception:
+        animation.stop()
+        print(f"{cons.RED} Failed{cons.RESET}")
+        raise
+
+    animation.stop()
+    print(f"{cons.GREEN} Complete{cons.RESET}")
+    return file_counts
+
+
+def count_contents_index(arch: str, response: requests.Response | None = None,
+                         validators: dict | None = None) -> dict[str, int]:
+    """Returns the top package file counts of the contents index for <arch>, without printing anything. Kept at the
+    module level so that it can be sent to worker processes in batch runs. See tally_contents_index() for how it's
+    counted."""
+    return sort_package_file_counts(tally_contents_index(arch, response, validators))
+
+
+def tally_contents_index(arch: str, response: requests.Response | None = None,
+                         validators: dict | None = None) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts of the contents index for <arch>. Kept at the module level so that
+    it can be sent to worker processes. See open_contents_index() for where the file is read from.
+
+    With <cons.INCREMENTAL_UPDATES>, the stored counts from the last run are patched with pdiffs instead whenever the
+    mirror offers them. Otherwise, if the file is cached and has already been analyzed once, it's counted in parallel
+    over <cons.DECOMPRESSION_WORKERS> processes (see parallel_gzip). Both are skipped when a reverse index or any of
+    the views chosen with --views have to be built, which are counted in the same pass as the packages and cached (see
+    count_views). With <cons.RECORD_SNAPSHOTS>, the counts are also added to the history of <arch> (see
+    snapshot_store)."""
+    version = blob.get_version(validators or {})
+    build_index = needs_reverse_index(arch, validators or {})
+    view_counter = views.ViewCounter(get_selected_views()) if needs_views(arch, validators or {}) else None
+    full_pass = build_index or view_counter is not None  # Only a full pass over the file can build either
+    try:
+        if cons.INCREMENTAL_UPDATES and not full_pass:
+            package_counts = delta.update_package_counts(arch, lambda: open_contents_index(arch, response, validators))
+        else:
+            segments = pgz.load_index(arch, version) if cons.DECOMPRESSION_WORKERS > 1 and not full_pass else None
+            if segments is not None:
+                package_counts = tally_segments(pgz.get_segments_path(arch, version), segments)
+            else:
+                blocks = decompress_contents_index(open_contents_index(arch, response, validators), arch, version,
+                                                   build_index, view_counter)
+                package_counts = tally_gzipped_contents(blocks)
+    finally:
+        if response is not None:
+            response.close()  # Nothing else will read it, whether or not it was used
+
+    if view_counter is not None:
+        with metrics.phase("view_write"):
+            views.store_views(arch, version, view_counter.views, view_counter.get_counts())
+    if cons.RECORD_SNAPSHOTS:
+        snapshots.record_snapshot(arch, (validators or {}).get("last_modified", ""), package_counts)
+
+    return package_counts
+
+
+def open_contents_index(arch: str, response: requests.Response | None = None,
+                        validators: dict | None = None) -> Iterable[bytes]:
+    """Returns the gzipped contents index for <arch> in chunks.
+
+    If the version described by <validators> is in the blob cache, the chunks are read from there with no network I/O.
+    Otherwise they're streamed from the mirror (from <response>, if the download was already started) and stored in
+    the blob cache on the way through. Large files are downloaded from several mirrors at once, if more than one was
+    given (see mirrors). Downloads are checked against the "sha256" and "size" in <validators> as they stream, and
+    raise requests.exceptions.RequestException at the end if they don't match."""
+    version = blob.get_version(validators or {})
+    cached_chunks = blob.read_blob(arch, version)
+    if cached_chunks is not None:
+        return metrics.measure_iter("blob_read", cached_chunks)
+
+    downloaded_chunks = metrics.measure_iter("download", mirrors.stream_contents_index(arch, response))
+    if (validators or {}).get("sha256"):
+        downloaded_chunks = metrics.measure_iter("verify", release.verify_chunks(downloaded_chunks, validators, arch))
+
+    # The download is nested inside the blob write, so "blob_write" is only the time spent writing to disk
+    return metrics.measure_iter("blob_write", blob.store_blob(arch, version, downloaded_chunks))
+
+
+def decompress_contents_index(chunks: Iterable[bytes], arch: str = "", version: str = "", build_index: bool = False,
+                              view_counter: views.ViewCounter | None = None) -> Iterable[bytes]:
+    """Returns the decompressed, line-aligned blocks of the gzipped contents index in <chunks>. If <chunks> are
+    <version> of the contents index for <arch>, a segmented copy is stored as they're read, so that the next pass over
+    a cached copy can run in parallel. With <build_index>, the reverse index for <arch> is built in the same pass.
+    Every view in <view_counter> is also counted over the blocks as they're read."""
+    blocks = metrics.measure_iter("decompress", decomp.iter_gzip_blocks(chunks), count_lines=True)
+    if version and cons.DECOMPRESSION_WORKERS > 1:
+        blocks = metrics.measure_iter("segment_write", pgz.store_segments(arch, version, blocks))
+    if build_index:
+        blocks = metrics.measure_iter("reverse_index", rindex.store_index(arch, version, blocks))
+    if view_counter is not None:
+        blocks = metrics.measure_iter("views", view_counter.count_blocks(blocks))
+
+    return blocks
+
+
+def tally_gzipped_contents(blocks: Iterable[bytes]) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts of the decompressed, line-aligned <blocks> of a contents index,
+    using the parsing engine selected by <cons.PARSER_ENGINE>."""
+    with metrics.phase("parse"):  # Reading <blocks> is a phase of its own, nested inside this one
+        if cons.PARSER_ENGINE == "bulk":
+            return bulk.tally_package_files(blocks)
+
+        return tally_package_file_associations(decomp.iter_block_lines(blocks))
+
+
+def tally_segments(path: str, segments: list[list[int]]) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts of the segmented contents index at <path>, whose <segments> are
+    counted in parallel over <cons.DECOMPRESSION_WORKERS> processes and merged."""
+    # A few ranges per worker, so that one slow range doesn't leave the other workers idle at the end
+    ranges = pgz.group_segments(segments, cons.DECOMPRESSION_WORKERS * 4)
+    offsets, sizes = zip(*ranges)
+    package_counts = Counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(cons.DECOMPRESSION_WORKERS, len(ranges)),
+                                                initializer=apply_settings, initargs=(get_settings(),)) as executor:
+        for range_counts, worker_phases in executor.map(metrics.collect, repeat(count_segment_range), repeat(path),
+                                                        offsets, sizes):
+            package_counts.update(range_counts)
+            metrics.merge_phases(worker_phases)
+
+    return package_counts
+
+
+def count_segment_range(path: str, offset: int, size: int) -> dict[bytes, int]:
+    """Returns the full, unsorted package file counts of the <size> bytes of segments at <offset> in <path>. Kept at the
+    module level so that it can be sent to worker processes."""
+    blocks = decomp.iter_gzip_blocks(metrics.measure_iter("segment_read", pgz.read_segments(path, offset, size)))
+    return tally_gzipped_contents(metrics.measure_iter("decompress", blocks, count_lines=True))
+
+
+def tally_package_file_associations(lines: Iterable[bytes]) -> dict[bytes, int]:
+    """The reference parsing engine. Returns the full, unsorted package file counts of <lines>, which can be any
+    iterable of decompressed contents index lines, such as a GzipFile or decompression.iter_gzip_lines(). Any malformed
+    entries as defined by the debian wiki below will be discarded as it suggests.
 
     "
     Contents indices begin with zero or more lines of free form text followed by a table mapping filenames to one or
@@ -111,23 +777,8 @@ def get_top_package_file_counts(zipped_arch_contents: bytes) -> dict[str, int]:
     characters).
     "
     """
-    print(f"{cons.GREEN}Analyzing file{cons.RESET}", end="")
-    animation = Animation(cons.DEFAULT_ANIMATION)
-    animation.start()
-
-    with io.BytesIO(zipped_arch_contents) as compressed_bytes:
-        with gzip.GzipFile(fileobj=compressed_bytes, mode="rb") as zipped_file:
-            file_counts = count_package_file_associations(zipped_file)
-
-    animation.stop()
-    print(f"{cons.GREEN} Complete{cons.RESET}")
-    return file_counts
-
-
-def count_package_file_associations(zipped_file: gzip.GzipFile) -> dict[str, int]:
-    """Helper function to get_top_package_file_counts()"""
     file_counter = defaultdict(int)
-    for line in zipped_file:
+    for line in lines:
         tokens = line.split()
         # Each table entry should have at least two columns, else it's malformed.
         # Since each file is relative to the root directory, the path should contain at least one "/". If the
@@ -139,19 +790,92 @@ def count_package_file_associations(zipped_file: gzip.GzipFile) -> dict[str, int
         for package in tokens[-1].split(b","):  # Wiki says that packages are comma-separated with no spaces
             file_counter[package] += 1
 
-    return sort_package_file_counts(file_counter)
+    return file_counter
 
 
-def sort_package_file_counts(counts: dict[bytes, int]) -> dict[str, int]:
-    """Sorts <counts> in descending order according to its integer values and returns the top <cons.CACHE_SIZE>."""
-    tuples = [(package, file_count) for package, file_count in counts.items()]
-    tuples.sort(key=lambda package_count: package_count[1], reverse=True)
-    sorted_pairs = {package.decode(): file_count for package, file_count in tuples[:cons.CACHE_SIZE]}
+def sort_package_file_counts(counts: Mapping[bytes, int], size: int | None = None) -> dict[str, int]:
+    """Returns the top <size> (default <cons.CACHE_SIZE>) items of <counts>, sorted in descending order according to
+    their integer values. Ties are broken by package name, so the result is the same on every run."""
+    # P: Only the top few items are ever kept, so fully sorting every package is wasted work. package_counts.get_top()
+    #    finds the cut-off count from the bare counts, and only sorts the packages that make the cut.
+    size = cons.CACHE_SIZE if size is None else size
+    with metrics.phase("sort"):
+        top_pairs = get_top(counts, size)
+    sorted_pairs = {package.decode(): file_count for package, file_count in top_pairs}
     return sorted_pairs
 
 
-def print_architecture_statistics(package_file_counts: dict[str, int]) -> None:
-    """Prints formatted statistics to stdout."""
+def show_statistics(name: str, package_file_counts: dict[str, int], show_name: bool = True,
+                    row_name: str = "PACKAGE") -> None:
+    """Prints <package_file_counts>, the statistics for <name>, as a table with <row_name> over its names, headed by
+    <name> if <show_name>. With a machine-readable <cons.OUTPUT_FORMAT>, they're added to the results written at the
+    end of the run instead (see stats_output)."""
+    if cons.OUTPUT_FORMAT != "table":
+        stats_output.add_statistics(name, package_file_counts)
+        return
+
+    if show_name:
+        print(f"\n{cons.CYAN}{name}{cons.RESET}", end="")
+    print_architecture_statistics(package_file_counts, row_name=row_name)
+    return
+
+
+def show_views(arch: str, validators: dict) -> None:
+    """Shows each view chosen with --views, as cached for <arch> from the version of its contents index described by
+    <validators>, under the name of <arch> and the view joined by ":"."""
+    stored_views = views.get_stored_views(arch, blob.get_version(validators)) if cons.SELECTED_VIEWS else {}
+    for name in cons.SELECTED_VIEWS:
+        if name not in stored_views:  # Views can't be cached for a contents index that has no version to check them by
+            continue
+
+        if stored_views[name]["packages"] or cons.OUTPUT_FORMAT != "table":
+            show_statistics(f"{arch}:{name}", stored_views[name]["packages"],
+                            row_name=views.get_row_name(stored_views[name]["rules"]))
+        else:  # No file matched its rules
+            print(f"\n{cons.CYAN}{arch}:{name}{cons.GREEN} No files{cons.RESET}\n")
+
+    return
+
+
+def show_aggregate_statistics(aggregate_stats: dict) -> None:
+    """Same as show_statistics(), for the aggregate statistics from analyze_aggregate(). Only the combined statistics
+    are machine-readable, under the name of every architecture joined by "+"."""
+    if cons.OUTPUT_FORMAT != "table":
+        stats_output.add_statistics("+".join(aggregate_stats["architectures"]), aggregate_stats["packages"])
+        return
+
+    print_aggregate_statistics(aggregate_stats)
+    return
+
+
+def print_aggregate_statistics(aggregate_stats: dict) -> None:
+    """Prints the combined statistics in <aggregate_stats> (see analyze_aggregate()), then how the files of each of the
+    top packages are split between the architectures, then the packages of each architecture that differ the most from
+    the first one."""
+    architectures = list(aggregate_stats["architectures"])
+    print(f"\n{cons.CYAN}{' + '.join(architectures)}{cons.RESET}", end="")
+    print_architecture_statistics(aggregate_stats["packages"])
+
+    breakdown = {package: ", ".join(f"{arch} {file_count}" for arch, file_count in arch_counts.items())
+                 for package, arch_counts in aggregate_stats["breakdown"].items()}
+    print(f"{cons.CYAN}Files by architecture{cons.RESET}", end="")
+    print_architecture_statistics(breakdown, "FILES BY ARCHITECTURE")
+
+    for arch, differences in aggregate_stats["differences"].items():
+        print(f"{cons.CYAN}{arch}{cons.GREEN} compared to {cons.CYAN}{architectures[0]}{cons.RESET}", end="")
+        if differences:
+            print_architecture_statistics({package: f"{difference:+}" for package, difference in differences.items()},
+                                          "DIFFERENCE")
+        else:
+            print(f"{cons.GREEN} No differences{cons.RESET}\n")
+
+    return
+
+
+def print_architecture_statistics(package_file_counts: dict[str, int | str], column_name: str = "ASSOCIATED FILES",
+                                  row_name: str = "PACKAGE", show_count: int | None = None) -> None:
+    """Prints formatted statistics to stdout, with the keys of <package_file_counts> under <row_name> and their values
+    under <column_name>. Only the first <show_count> (default <cons.SHOW_COUNT>) are shown."""
     # P: Whenever I use integers in my code, I always try to avoid "magic numbers". If there is a reason to use an
     #    integer and the reason for choosing it isn't obvious (the counter for i and the mod 2 for color alternation
     #    are obvious in the way they are used in this context), I either store the number in a constant if I think it
@@ -159,49 +883,47 @@ def print_architecture_statistics(package_file_counts: dict[str, int]) -> None:
     #    4 and 5 here. These are numbers to handle spacing in very particular, one-off contexts. Without the comment,
     #    another dev may waste time trying to figure out why they were chosen, or hesitate to change them for fear of
     #    side effects.
-    len_longest = max([len(name) for name in list(package_file_counts.keys())[:cons.SHOW_COUNT]])
+    show_count = cons.SHOW_COUNT if show_count is None else show_count
+    shown_items = list(islice(package_file_counts.items(), show_count))
+    # Never shorter than <row_name> plus the 4 spaces below and one more, so that <column_name> never touches it
+    len_longest = max([len(name) for name, _ in shown_items] + [len(row_name) + 5])
     # The '4' for the spaces below is just a style choice to align "ASSOCIATED FILES" with the numbers in the column
-    header = f"\n\t{cons.RED}      PACKAGE{' ' * (len_longest - len('Package') - 4)}ASSOCIATED FILES{cons.RESET}"
-    print(header)
+    header = f"\n\t{cons.RED}      {row_name}{' ' * (len_longest - len(row_name) - 4)}{column_name}{cons.RESET}"
+    lines = [header]
 
-    i = 1
     alternating_colors = (cons.GREY, cons.RESET)
-    for package, file_count in list(package_file_counts.items())[:cons.SHOW_COUNT]:
+    for i, (package, file_count) in enumerate(shown_items, start=1):
         color = alternating_colors[i % 2]
         number_of_spaces = len_longest - len(package) - len(str(i)) + 5  # 5 is also just a style choice
-        statistic_row = f"\n\t{cons.RED}{i}. {color}{package}{' ' * number_of_spaces}{file_count}"
-        print(statistic_row)
-        i += 1
+        lines.append(f"\n\t{cons.RED}{i}. {color}{package}{' ' * number_of_spaces}{file_count}")
 
-    print(cons.RESET)
+    lines.append(cons.RESET)
+    print("\n".join(lines))  # All at once, rather than a write for every row
     return
 
 
-def get_cache() -> dict:
-    """Retrieves and returns the cache of architecture-specific packages and their file counts."""
-    if os.stat(cons.CACHE_PATH).st_size == 0:
-        return {}
-
-    with open(cons.CACHE_PATH, "r") as file:
-        cache = json.load(file)
-
-    return cache
-
-
 if __name__ == '__main__':
-    try:
-        print(f"\n{cons.OUTPUT_SEPARATOR}")
-        main()
-    except requests.exceptions.RequestException:  # Manually-raised program-ending errors go here
-        print("\nExiting program")
-    except Exception as error:
-        formatted_error = traceback.format_exception(error)
-        error_location = formatted_error[-2]
-        error_message = formatted_error[-1]
-        print(f"{cons.RED}Unexpected error occurred. Check logs for details.{cons.RESET}")
-        logging.critical(f"Unexpected error. Location: {error_location} -- Message: {error_message}")
-    finally:
-        print(f"{cons.OUTPUT_SEPARATOR}\n")
+    # A machine-readable format written to stdout is the only thing there, so that it can be piped into another program.
+    # Everything else, from the separators to the error messages, is printed to stderr instead.
+    results_stream = sys.stdout
+    run_options, _ = parse_options(sys.argv)
+    machine_output = run_options.format != "table" and not run_options.output
+    with contextlib.redirect_stdout(sys.stderr) if machine_output else contextlib.nullcontext():
+        try:
+            print(f"\n{cons.OUTPUT_SEPARATOR}")
+            main()
+            if cons.OUTPUT_FORMAT != "table":
+                stats_output.write_results(cons.OUTPUT_FORMAT, cons.OUTPUT_PATH, results_stream)
+        except requests.exceptions.RequestException:  # Manually-raised program-ending errors go here
+            print("\nExiting program")
+        except Exception as error:
+            formatted_error = traceback.format_exception(error)
+            error_location = formatted_error[-2]
+            error_message = formatted_error[-1]
+            print(f"{cons.RED}Unexpected error occurred. Check logs for details.{cons.RESET}")
+            logging.critical(f"Unexpected error. Location: {error_location} -- Message: {error_message}")
+        finally:
+            print(f"{cons.OUTPUT_SEPARATOR}\n")
 
     # P: I always have top-level error handling to catch things I haven't explicitly accounted for in the body of the
     #    program.
@@ -0,0 +1,217 @@
+"""Timing and resource metrics for each phase of a run (downloads, decompression, parsing, sorting, and cache I/O).
+
+A phase's time is its own time, excluding any phases nested inside it. Streamed phases nest: each chunk pulled through
+decompression is itself pulled from the download, so a slow mirror shows up as "download" time and a slow parser as
+"parse" time, even though the two overlap in a single pass. Times from phases running in several threads at once are
+added together."""
+import contextlib
+import cProfile
+import datetime
+import json
+import logging
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Iterable, Iterator
+
+try:
+    import resource  # Unix only. Peak RSS isn't reported without it.
+except ImportError:
+    resource = None
+
+
+# Passing this as the metrics destination writes the report to the log instead of a file
+LOG_DESTINATION = "log"
+
+# Number of allocation sites listed in the report when memory is traced
+TRACED_MEMORY_TOP_COUNT = 10
+
+# P: The log only keeps warnings and up, but a metrics report isn't a warning. Reports go through a logger of their own,
+#    whose level lets them through at INFO. Records still reach the handlers of the root logger, such as the log file,
+#    since only the level of the logger they're logged on is checked, not the levels of its parents.
+metrics_logger = logging.getLogger("metrics")
+metrics_logger.setLevel(logging.INFO)
+
+# P: Phase totals are a plain dictionary of phase name to a dictionary of "calls", "seconds", "bytes", "lines", and
+#    "peak_rss_mb", so that they can be sent back from worker processes and merged as they are.
+_phases = {}
+_phases_lock = threading.Lock()
+_open_phases = threading.local()  # Each thread's stack of [start time, time spent in nested phases] for open phases
+_run_start = time.perf_counter()
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[dict]:
+    """Records the time spent in the with block as phase <name>. Yields a dictionary that the block can add "bytes"
+    and "lines" counts to."""
+    counts = {"bytes": 0, "lines": 0}
+    open_phases = _get_open_phases()
+    open_phase = [time.perf_counter(), 0.0]
+    open_phases.append(open_phase)
+    try:
+        yield counts
+    finally:
+        open_phases.pop()
+        elapsed = time.perf_counter() - open_phase[0]
+        if open_phases:
+            open_phases[-1][1] += elapsed  # Excluded from the enclosing phase's own time
+
+        _record(name, elapsed - open_phase[1], counts["bytes"], counts["lines"])
+
+
+def measure_iter(name: str, items: Iterable[bytes], count_lines: bool = False) -> Iterator[bytes]:
+    """Yields each of <items> unchanged, recording the time spent producing them, and their total size, as phase
+    <name>. With <count_lines>, the newlines in the items are counted as well."""
+    iterator = iter(items)
+    while True:
+        with phase(name) as counts:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+
+            counts["bytes"] += len(item)
+            if count_lines:
+                counts["lines"] += item.count(b"\n")
+
+        yield item
+
+
+def _get_open_phases() -> list[list[float]]:
+    """Returns the stack of open phases for the current thread."""
+    if not hasattr(_open_phases, "stack"):
+        _open_phases.stack = []
+
+    return _open_phases.stack
+
+
+def _record(name: str, seconds: float, byte_count: int, line_count: int) -> None:
+    """Adds one call of phase <name> to the totals."""
+    with _phases_lock:
+        totals = _phases.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0, "lines": 0, "peak_rss_mb": None})
+        totals["calls"] += 1
+        totals["seconds"] += seconds
+        totals["bytes"] += byte_count
+        totals["lines"] += line_count
+        if totals["calls"] == 1 or byte_count:  # getrusage() is cheap, but not free for every streamed chunk
+            totals["peak_rss_mb"] = get_peak_rss_mb()
+
+    return
+
+
+def get_phases() -> dict[str, dict]:
+    """Returns a copy of the totals of every phase recorded so far in this process."""
+    with _phases_lock:
+        return {name: dict(totals) for name, totals in _phases.items()}
+
+
+def merge_phases(phases: dict[str, dict]) -> None:
+    """Adds the phase totals in <phases>, from get_phases() in another process, to this process's totals."""
+    with _phases_lock:
+        for name, other_totals in phases.items():
+            totals = _phases.setdefault(name, {"calls": 0, "seconds": 0.0, "bytes": 0, "lines": 0,
+                                               "peak_rss_mb": None})
+            for key in ("calls", "seconds", "bytes", "lines"):
+                totals[key] += other_totals[key]
+            peak_rss_values = [value for value in (totals["peak_rss_mb"], other_totals["peak_rss_mb"]) if value]
+            totals["peak_rss_mb"] = max(peak_rss_values, default=None)
+
+    return
+
+
+def reset() -> None:
+    """Clears every phase recorded so far in this process, and restarts the run's clock."""
+    global _run_start
+    with _phases_lock:
+        _phases.clear()
+    _get_open_phases().clear()
+    _run_start = time.perf_counter()
+    return
+
+
+def collect(function: Callable, *arguments) -> tuple:
+    """Returns the result of calling <function> with <arguments>, along with the phase totals recorded while it ran.
+    Meant to be run in a worker process, whose totals would otherwise be lost when it exits."""
+    reset()
+    result = function(*arguments)
+    return result, get_phases()
+
+
+def get_peak_rss_mb() -> float | None:
+    """Returns the peak resident set size of this process so far in megabytes, or None if it can't be measured."""
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # macOS reports bytes, not KiB
+
+
+def get_report() -> dict:
+    """Returns every phase recorded in this run, with throughput for the phases that moved data, along with the run's
+    wall time and peak memory."""
+    phases = get_phases()
+    for totals in phases.values():
+        totals["seconds"] = round(totals["seconds"], 6)
+        if totals["bytes"] and totals["seconds"]:
+            totals["mb_per_second"] = round(totals["bytes"] / 1e6 / totals["seconds"], 2)
+        if totals["lines"] and totals["seconds"]:
+            totals["lines_per_second"] = round(totals["lines"] / totals["seconds"])
+
+    report = {"finished": datetime.datetime.now().isoformat(timespec="seconds"),
+              "arguments": sys.argv[1:],
+              "wall_seconds": round(time.perf_counter() - _run_start, 6),
+              "peak_rss_mb": get_peak_rss_mb(),
+              "phases": phases}
+    if tracemalloc.is_tracing():
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        top_statistics = tracemalloc.take_snapshot().statistics("lineno")[:TRACED_MEMORY_TOP_COUNT]
+        report["traced_memory"] = {"current_mb": round(current_bytes / (1024 * 1024), 1),
+                                   "peak_mb": round(peak_bytes / (1024 * 1024), 1),
+                                   "top_allocations": [str(statistic) for statistic in top_statistics]}
+
+    return report
+
+
+def write_report(destination: str) -> None:
+    """Writes the metrics report for this run as JSON to the file at <destination>, or to the log as a single line if
+    <destination> is <LOG_DESTINATION>."""
+    report = get_report()
+    if destination == LOG_DESTINATION:
+        metrics_logger.info(f"Run metrics: {json.dumps(report)}")
+        return
+
+    try:
+        with open(destination, "w") as file:
+            json.dump(report, file, indent=2)
+    except OSError as e:
+        logging.warning(f"Failed writing metrics to {destination}; error: {e!r}")
+
+    return
+
+
+@contextlib.contextmanager
+def profiling(profile_path: str = "", trace_memory: bool = False) -> Iterator[None]:
+    """Runs the with block under cProfile, saving the stats to <profile_path> (readable with pstats), if a path is
+    given. With <trace_memory>, Python allocations are traced with tracemalloc, and the peak and the largest
+    allocation sites are added to the metrics report."""
+    # P: Both are opt-in. cProfile roughly doubles the time of the parsing loop, and tracemalloc slows down every
+    #    allocation, so neither is on for normal runs.
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            try:
+                profiler.dump_stats(profile_path)
+            except OSError as e:
+                logging.warning(f"Failed writing profile to {profile_path}; error: {e!r}")
+
+    return
+
@@ -0,0 +1,284 @@
+"""Selection between several Debian mirrors, and downloads of large contents indices split across them.
+
+With more than one mirror in <cons.MIRRORS>, each one is probed at the start of a run with a small ranged download, and
+the fastest becomes <cons.HOST>, which every other request goes to. Contents indices of at least
+<cons.RANGED_DOWNLOAD_MIN_MB> are instead downloaded in byte ranges of <cons.RANGE_SIZE_MB> from every mirror that has
+the same version of the file, one connection per mirror. Faster mirrors take more of the ranges, and a range that
+fails on one mirror is retried on another. The ranges are reassembled in order as they arrive, so the result streams
+into parsing the same way a single download does."""
+# P: Ranges are only worth it for large files. For a small one, the extra HEAD requests to every mirror take about as
+#    long as the download. Only mirrors that agree on the file's size and Last-Modified take part, each range has to
+#    come back as exactly the bytes asked for, and the gzip trailer's CRC-32 of the reassembled file is verified by
+#    decompression, so a bad range can't go unnoticed.
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import constants as cons
+from lazy_modules import lazy_import
+import logging
+import metrics
+import threading
+import time
+from typing import Iterator
+
+# Not needed by runs with a single mirror until something is downloaded
+deb = lazy_import("debian_mirror")
+requests = lazy_import("requests")
+
+
+def get_mirror_hosts() -> list[str]:
+    """Returns <cons.HOST> followed by every other mirror in <cons.MIRRORS>."""
+    return list(dict.fromkeys([cons.HOST, *cons.MIRRORS]))
+
+
+def rank_mirrors(hosts: list[str]) -> list[str]:
+    """Probes each of <hosts> concurrently (see probe_mirror()), and returns the ones that responded, fastest first.
+    Returns <hosts> unchanged if none of them responded."""
+    with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        probes = list(executor.map(probe_mirror, hosts))
+
+    estimated_seconds = {}
+    range_bytes = cons.RANGE_SIZE_MB * 1024 * 1024
+    for host, probe in zip(hosts, probes):
+        if probe is None:
+            continue
+
+        latency, bytes_per_second = probe
+        # Ranked by how long each would take for one range, so that a mirror close by but slow doesn't win
+        estimated_seconds[host] = latency + range_bytes / bytes_per_second
+        logging.info(f"Mirror {host}: {latency * 1000:.0f} ms latency, {bytes_per_second / 1e6:.2f} MB/s")
+
+    if not estimated_seconds:
+        logging.warning(f"No mirror responded to probing, using them in the order given: {', '.join(hosts)}")
+        return list(hosts)
+
+    return sorted(estimated_seconds, key=estimated_seconds.__getitem__)
+
+
+def probe_mirror(host: str) -> tuple[float, float] | None:
+    """Returns the latency in seconds (time to the response headers) and throughput in bytes per second of a download
+    of the first <cons.MIRROR_PROBE_BYTES> of the contents index for <cons.MIRROR_PROBE_ARCHITECTURE> from <host>, or
+    None if it fails."""
+    url = deb.get_contents_index_url(cons.MIRROR_PROBE_ARCHITECTURE, host)
+    try:
+        with metrics.phase("mirror_probe") as counts:
+            start = time.perf_counter()
+            response = deb.get_session().get(url, headers={"Range": f"bytes=0-{cons.MIRROR_PROBE_BYTES - 1}"},
+                                             stream=True, timeout=cons.HTTP_TIMEOUT)
+            with response:
+                first_byte = time.perf_counter()
+                if response.status_code not in (200, 206):
+                    logging.info(f"Mirror {host} failed probing; {response.status_code} - {response.reason}")
+                    return None
+
+                # A mirror that ignores the range sends the whole file, so only the probe's worth is read
+                for chunk in response.iter_content(chunk_size=cons.DOWNLOAD_CHUNK_SIZE):
+                    counts["bytes"] += len(chunk)
+                    if counts["bytes"] >= cons.MIRROR_PROBE_BYTES:
+                        break
+
+            finish = time.perf_counter()
+    except requests.exceptions.RequestException as e:
+        logging.info(f"Mirror {host} failed probing; error: {e!r}")
+        return None
+
+    return first_byte - start, counts["bytes"] / max(finish - first_byte, 1e-6)
+
+
+def get_range_mirrors(arch: str) -> tuple[int, list[str]]:
+    """Returns the size of the contents index for <arch> on <cons.HOST>, and the mirrors that have the same version of
+    it (the same size and Last-Modified) and serve byte ranges of it, starting with <cons.HOST>. The size is 0, and the
+    list empty, if <cons.HOST> doesn't give its size or support ranges."""
+    hosts = get_mirror_hosts()
+    with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+        responses = list(executor.map(_head_contents_index, [arch] * len(hosts), hosts))
+
+    if responses[0] is None:
+        return 0, []
+
+    size, last_modified = responses[0]
+    range_hosts = [host for host, response in zip(hosts, responses) if response == (size, last_modified)]
+    return size, range_hosts
+
+
+def _head_contents_index(arch: str, host: str) -> tuple[int, str] | None:
+    """Returns the size and Last-Modified of the contents index for <arch> on <host>, or None if it can't be read or
+    <host> doesn't advertise byte ranges for it."""
+    try:
+        response = deb.get_session().head(deb.get_contents_index_url(arch, host), timeout=cons.HTTP_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        logging.info(f"Mirror {host} failed a HEAD request for {arch}; error: {e!r}")
+        return None
+
+    if (response.status_code != 200 or response.headers.get("Accept-Ranges") != "bytes"
+            or not response.headers.get("Content-Length", "").isdigit()):
+        return None
+
+    return int(response.headers["Content-Length"]), response.headers.get("Last-Modified", "")
+
+
+def stream_contents_index(arch: str, response: requests.Response | None = None) -> Iterator[bytes]:
+    """Returns an iterator over the bytes of the gzipped contents index for <arch> in chunks of
+    <cons.DOWNLOAD_CHUNK_SIZE>, downloaded in ranges from several mirrors if there's more than one and the file is
+    large enough (see the module description), and otherwise from <cons.HOST> alone. If the download was already
+    started by a revalidation request, <response> is read instead, unless the file is large enough for ranges."""
+    if len(get_mirror_hosts()) > 1 and (response is None or _is_large_download(response)):
+        size, range_hosts = get_range_mirrors(arch)
+        if len(range_hosts) > 1 and size >= cons.RANGED_DOWNLOAD_MIN_MB * 1024 * 1024:
+            if response is not None:
+                response.close()
+            return stream_ranges(arch, size, range_hosts)
+
+    if response is not None:
+        return response.iter_content(chunk_size=cons.DOWNLOAD_CHUNK_SIZE)
+
+    return deb.stream_contents_index_file(arch)
+
+
+def _is_large_download(response: requests.Response) -> bool:
+    """Returns True if <response> is a download of at least <cons.RANGED_DOWNLOAD_MIN_MB>."""
+    content_length = response.headers.get("Content-Length", "")
+    return content_length.isdigit() and int(content_length) >= cons.RANGED_DOWNLOAD_MIN_MB * 1024 * 1024
+
+
+def stream_ranges(arch: str, size: int, hosts: list[str]) -> Iterator[bytes]:
+    """Downloads the <size> bytes of the contents index for <arch> in ranges from <hosts> in parallel, yielding them in
+    order in chunks of <cons.DOWNLOAD_CHUNK_SIZE>. At most <cons.MAX_PENDING_RANGES> ranges are held in memory at a
+    time. Raises requests.exceptions.RequestException if a range fails on every mirror."""
+    range_bytes = int(cons.RANGE_SIZE_MB * 1024 * 1024)
+    ranges = RangeQueue([(start, min(start + range_bytes, size)) for start in range(0, size, range_bytes)], len(hosts))
+    for host in hosts:
+        threading.Thread(target=_download_ranges, args=(arch, host, ranges), daemon=True).start()
+
+    try:
+        for part in ranges.iter_parts():
+            for offset in range(0, len(part), cons.DOWNLOAD_CHUNK_SIZE):
+                yield part[offset:offset + cons.DOWNLOAD_CHUNK_SIZE]
+    finally:
+        ranges.close()  # Stops the download threads early if the caller stopped reading
+
+    return
+
+
+def _download_ranges(arch: str, host: str, ranges: "RangeQueue") -> None:
+    """Downloads ranges of the contents index for <arch> from <host> until there are none left, or a download from
+    <host> fails, in which case the range is left for the other mirrors."""
+    try:
+        while (taken_range := ranges.take_range()) is not None:
+            range_number, start, end = taken_range
+            try:
+                part = _read_range(arch, host, start, end)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Mirror {host} failed bytes {start}-{end - 1} of {arch}, leaving it to the other "
+                                f"mirrors; error: {e!r}")
+                ranges.return_range(range_number)
+                return
+
+            ranges.put_part(range_number, part)
+    finally:
+        ranges.finish_thread()
+
+    return
+
+
+def _read_range(arch: str, host: str, start: int, end: int) -> bytes:
+    """Returns bytes <start> up to <end> of the contents index for <arch> on <host>. Raises
+    requests.exceptions.RequestException if <host> doesn't send exactly that range."""
+    url = deb.get_contents_index_url(arch, host)
+    with metrics.phase("range_download") as counts:
+        response = deb.get_session().get(url, headers={"Range": f"bytes={start}-{end - 1}"}, timeout=cons.HTTP_TIMEOUT)
+        counts["bytes"] += len(response.content)
+
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code != 206 or not content_range.startswith(f"bytes {start}-{end - 1}/"):
+        raise requests.exceptions.RequestException(f"Expected bytes {start}-{end - 1} of {url}, got "
+                                                   f"{response.status_code} {content_range!r}")
+    elif len(response.content) != end - start:
+        raise requests.exceptions.RequestException(f"Expected {end - start} bytes from {url}, got "
+                                                   f"{len(response.content)}")
+
+    return response.content
+
+
+class RangeQueue:
+    """The byte ranges of a ranged download, handed out to the download threads (one per mirror), and the downloaded
+    parts, handed back to the reader in order. Faster threads come back for more ranges sooner, so they take more of
+    them."""
+
+    def __init__(self, ranges: list[tuple[int, int]], thread_count: int):
+        self.ranges = ranges
+        self.waiting_ranges = deque(range(len(ranges)))  # Numbers of the ranges no thread has taken yet, in order
+        self.parts = {}  # Range number to its downloaded bytes, until the reader takes it
+        self.next_part = 0  # Number of the next range the reader needs
+        self.downloading_count = 0  # Ranges taken by a thread and not yet handed back
+        self.active_threads = thread_count
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def take_range(self) -> tuple[int, int, int] | None:
+        """Waits until a range can be downloaded without getting more than <cons.MAX_PENDING_RANGES> ahead of the
+        reader, and returns its number, start, and end, or None once there are no ranges left. A thread doesn't stop
+        while other ranges are still downloading, in case one of them fails and is put back."""
+        with self.condition:
+            while not self.closed and (self.waiting_ranges[0] >= self.next_part + cons.MAX_PENDING_RANGES
+                                       if self.waiting_ranges else self.downloading_count):
+                self.condition.wait()
+
+            if self.closed or not self.waiting_ranges:
+                return None
+
+            range_number = self.waiting_ranges.popleft()
+            self.downloading_count += 1
+            return range_number, *self.ranges[range_number]
+
+    def put_part(self, range_number: int, part: bytes) -> None:
+        """Hands the downloaded <part> of range <range_number> to the reader."""
+        with self.condition:
+            self.parts[range_number] = part
+            self.downloading_count -= 1
+            self.condition.notify_all()
+
+        return
+
+    def return_range(self, range_number: int) -> None:
+        """Puts back range <range_number>, which failed, at the front of the queue for another thread to take."""
+        with self.condition:
+            self.waiting_ranges.appendleft(range_number)
+            self.downloading_count -= 1
+            self.condition.notify_all()
+
+        return
+
+    def finish_thread(self) -> None:
+        """Records that a download thread has stopped taking ranges."""
+        with self.condition:
+            self.active_threads -= 1
+            self.condition.notify_all()
+
+        return
+
+    def iter_parts(self) -> Iterator[bytes]:
+        """Yields every downloaded part in order, waiting for each one to arrive. Raises
+        requests.exceptions.RequestException if every thread stops before they have all arrived."""
+        while self.next_part < len(self.ranges):
+            with self.condition:
+                while self.next_part not in self.parts:
+                    if self.active_threads == 0:
+                        raise requests.exceptions.RequestException("Every mirror failed during a ranged download")
+                    self.condition.wait()
+
+                part = self.parts.pop(self.next_part)
+                self.next_part += 1
+                self.condition.notify_all()  # A thread may be waiting for the reader to catch up
+
+            yield part
+
+        return
+
+    def close(self) -> None:
+        """Stops handing out ranges."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        return
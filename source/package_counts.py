@@ -0,0 +1,21 @@
+"""Picks the top packages out of full package file counts, which are plain dictionaries of package name to file
+count."""
+# P: Interning the names into a table of IDs, with the counts in an array indexed by ID, held more memory than the plain
+#    dictionary it replaced, even when counted into directly: the table is a dictionary of the same size, with a boxed
+#    int for every ID. Only the cheaper top selection was kept.
+import heapq
+from typing import Mapping
+
+
+def get_top(package_counts: Mapping[bytes, int], size: int) -> list[tuple[bytes, int]]:
+    """Returns the <size> packages in <package_counts> with the most files, and their counts, in descending order of
+    count. Ties are broken by package name."""
+    # P: The counts are never copied into a list of (name, count) pairs. The size-th largest count is found from the
+    #    bare ints, and only the packages at or above it (usually not many more than <size>) are sorted by name.
+    if size < 1 or not package_counts:
+        return []
+
+    threshold = heapq.nlargest(size, package_counts.values())[-1]
+    candidates = [package for package, count in package_counts.items() if count >= threshold]
+    top_packages = sorted(candidates, key=lambda package: (-package_counts[package], package))
+    return [(package, package_counts[package]) for package in top_packages[:size]]
@@ -0,0 +1,159 @@
+"""Segmented copies of cached contents indices, so that re-analyzing a cached file can be spread over several cores.
+
+A gzip stream can only be decompressed from the start, so a cached contents index is stuck on one core however many
+there are. The first time a cached file is analyzed, a second copy of it is written alongside the blob as a series of
+independent gzip members, each holding about <cons.SEGMENT_SIZE_MB> of whole lines, along with an index of where each
+member starts. Any range of consecutive members is a complete gzip file on its own, so later passes can hand disjoint
+ranges to worker processes and merge their counts."""
+# P: A zran-style index of deflate restart points would avoid the second copy, but restarting mid-stream needs zlib's
+#    inflatePrime() to resume at a bit offset, which Python's zlib module doesn't expose. Re-encoding the file into
+#    independent members gives the same parallelism with only the standard library. The copy is written at compression
+#    level 1 from a background thread (zlib releases the GIL while compressing), so it mostly overlaps with parsing.
+import blob_cache as blob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import constants as cons
+import json
+import logging
+import os
+from typing import Iterable, Iterator
+import zlib
+
+
+# Tells zlib to write a gzip header and trailer around each member
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Segments waiting to be compressed are held in memory, so no more than this many are queued at once
+MAX_PENDING_SEGMENTS = 2
+
+
+def get_segments_path(arch: str, version: str) -> str:
+    """Returns the path of the segmented copy of <version> of the contents index for <arch>."""
+    return blob.get_blob_path(arch, version)[:-len(".gz")] + ".segments.gz"
+
+
+def get_index_path(arch: str, version: str) -> str:
+    """Returns the path of the index of the segmented copy of <version> of the contents index for <arch>."""
+    return blob.get_blob_path(arch, version)[:-len(".gz")] + ".segments.json"
+
+
+def load_index(arch: str, version: str) -> list[list[int]] | None:
+    """Returns the [offset, compressed size, uncompressed size] of every segment in the segmented copy of <version> of
+    the contents index for <arch>, or None if there isn't a usable one."""
+    if not blob.has_blob(arch, version):
+        return None
+
+    try:
+        with open(get_index_path(arch, version), "r") as file:
+            segments = json.load(file)["segments"]
+        os.utime(get_segments_path(arch, version))  # Keeps the copy from being evicted before its blob
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning(f"Discarding unreadable segment index for {arch}; error: {e!r}")
+        return None
+
+    return segments
+
+
+def store_segments(arch: str, version: str, blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each of <blocks> (decompressed, line-aligned blocks from decompression.iter_gzip_blocks()) unchanged,
+    while also writing them to a segmented copy of <version> of the contents index for <arch>. Like blob_cache's
+    store_blob(), the copy and its index only appear once every block has been written. Nothing is written with a
+    single <cons.DECOMPRESSION_WORKERS>, since only parallel passes read the copy."""
+    # P: The copy is compressed at a fast level, so it's often larger than the blob it was made from. That's worth it
+    #    when it lets the next pass run on every core, but would only double the disk space used with one worker.
+    if (not version or cons.BLOB_CACHE_MAX_MB <= 0 or cons.DECOMPRESSION_WORKERS <= 1
+            or os.path.exists(get_index_path(arch, version))):
+        yield from blocks
+        return
+
+    os.makedirs(cons.BLOB_CACHE_DIRECTORY, exist_ok=True)
+    segments_path = get_segments_path(arch, version)
+    index_path = get_index_path(arch, version)
+    temporary_segments_path = f"{segments_path}.{os.getpid()}.tmp"
+    temporary_index_path = f"{index_path}.{os.getpid()}.tmp"
+    segment_bytes = cons.SEGMENT_SIZE_MB * 1024 * 1024
+    try:
+        with open(temporary_segments_path, "wb") as file, ThreadPoolExecutor(max_workers=1) as compressor:
+            # A single thread compresses and writes the segments, so they're written in order
+            pending_segments = deque()
+            segments = []
+            segment_blocks = []
+            segment_size = 0
+            for block in blocks:
+                segment_blocks.append(block)
+                segment_size += len(block)
+                if segment_size >= segment_bytes:
+                    pending_segments.append(compressor.submit(_write_segment, file, b"".join(segment_blocks)))
+                    segment_blocks = []
+                    segment_size = 0
+                    if len(pending_segments) > MAX_PENDING_SEGMENTS:
+                        segments.append(pending_segments.popleft().result())
+
+                yield block
+
+            if segment_blocks:
+                pending_segments.append(compressor.submit(_write_segment, file, b"".join(segment_blocks)))
+            segments.extend(pending_segment.result() for pending_segment in pending_segments)
+
+        with open(temporary_index_path, "w") as file:
+            json.dump({"segments": segments}, file)
+
+        os.replace(temporary_segments_path, segments_path)
+        os.replace(temporary_index_path, index_path)  # Last, since the index is what marks the copy as usable
+    finally:
+        for temporary_path in (temporary_segments_path, temporary_index_path):
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+
+    blob.evict_blobs(cons.BLOB_CACHE_MAX_MB * 1024 * 1024)
+    return
+
+
+def _write_segment(file, segment: bytes) -> list[int]:
+    """Compresses <segment> as a gzip member of its own and appends it to <file>, returning its [offset, compressed
+    size, uncompressed size]."""
+    compressor = zlib.compressobj(cons.SEGMENT_COMPRESSION_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    member = compressor.compress(segment) + compressor.flush()
+    offset = file.tell()
+    file.write(member)
+    return [offset, len(member), len(segment)]
+
+
+def group_segments(segments: list[list[int]], task_count: int) -> list[tuple[int, int]]:
+    """Groups consecutive <segments> into about <task_count> ranges of roughly equal uncompressed size, returning the
+    (offset, compressed size) of each range."""
+    total_size = sum(uncompressed_size for _, _, uncompressed_size in segments)
+    target_size = total_size / max(1, task_count)
+    ranges = []
+    range_start = range_end = range_size = 0
+    for offset, compressed_size, uncompressed_size in segments:
+        if range_size and range_size + uncompressed_size / 2 > target_size:  # Closer to the target without it
+            ranges.append((range_start, range_end - range_start))
+            range_start = offset
+            range_size = 0
+
+        range_end = offset + compressed_size
+        range_size += uncompressed_size
+
+    if range_size:
+        ranges.append((range_start, range_end - range_start))
+
+    return ranges
+
+
+def read_segments(path: str, offset: int, size: int) -> Iterator[bytes]:
+    """Yields the gzip members in the <size> bytes of <path> that start at <offset>, in chunks of
+    <cons.DOWNLOAD_CHUNK_SIZE>."""
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while size > 0:
+            chunk = file.read(min(size, cons.DOWNLOAD_CHUNK_SIZE))
+            if not chunk:
+                raise EOFError(f"Segmented contents index {path} ended early")
+
+            size -= len(chunk)
+            yield chunk
+
+    return
@@ -0,0 +1,98 @@
+"""Integrity checks of contents indices against the suite's Release file, which lists the SHA256 and size of every index
+the archive publishes.
+
+The Release file is cached alongside the statistics, and only downloaded again when it has changed. Since a contents
+index's SHA256 changes whenever the index does, the Release file on its own also tells whether the cached statistics of
+every architecture are still current, in a single request."""
+# P: The hash is computed on the chunks as they stream past on their way to decompression and the blob cache, so
+#    verifying a download costs no second read of the file. SHA256 runs at well over the speed of decompression, so it
+#    adds little to a pass. The signature on the Release file itself (InRelease/Release.gpg) isn't checked, since that
+#    would need GnuPG and the archive keyring.
+#    Runs from shell prompts and scripts often follow each other within seconds, and the archive is only updated a few
+#    times a day, so a recent enough copy of the Release file is trusted as it is. That lets a warm-cache hit finish
+#    without any network I/O.
+import cache_store
+import constants as cons
+import hashlib
+from lazy_modules import lazy_import
+import logging
+import time
+from typing import Iterable, Iterator
+
+# Not needed while the cached copy of the Release file is fresh enough to use without asking the mirror
+deb = lazy_import("debian_mirror")
+requests = lazy_import("requests")
+
+
+def get_checksums() -> dict[str, dict]:
+    """Returns the "sha256" and "size" of the contents index of every architecture listed in the suite's Release file,
+    or an empty dictionary if it can't be read. The cached copy is used without asking the mirror if it was last
+    confirmed less than <cons.RELEASE_MAX_AGE> seconds ago."""
+    # P: Without the Release file, downloads just aren't verified, and each architecture is revalidated on its own, as
+    #    they were before. That's no reason to stop the program, so failures are only logged.
+    cached_release = cache_store.get_entry(cons.RELEASE_CACHE_KEY)
+    if cached_release and time.time() - cached_release.get("checked_at", 0) < cons.RELEASE_MAX_AGE:
+        return cached_release["checksums"]
+
+    try:
+        validators, release_text = deb.read_release_file(cached_release)
+    except requests.exceptions.RequestException as e:
+        logging.warning(f"Failed reading the Release file, so contents indices can't be verified; error: {e!r}")
+        return {}
+
+    if release_text is None:  # Not modified, which the mirror only says if there was a cached copy to compare with
+        checksums = cached_release["checksums"]
+    else:
+        checksums = parse_checksums(release_text)
+
+    # Also written when nothing changed, to record when it was last confirmed
+    cache_store.put_entries({cons.RELEASE_CACHE_KEY: {**validators, "checksums": checksums, "checked_at": time.time()}})
+    return checksums
+
+
+def parse_checksums(release_text: str) -> dict[str, dict]:
+    """Returns the "sha256" and "size" of the gzipped contents index of every architecture listed in the SHA256 section
+    of <release_text>, for the component the contents indices are downloaded from."""
+    # Files are listed relative to the suite's directory, e.g. "main/Contents-amd64.gz"
+    contents_prefix = f"{cons.CONTENT_INDICES_SLUG.rpartition('/')[2]}/Contents-"
+    checksums = {}
+    in_sha256_section = False
+    for line in release_text.splitlines():
+        if not line.startswith(" "):  # Each section's entries are indented under a "Name:" line
+            in_sha256_section = line.rstrip() == "SHA256:"
+            continue
+        elif not in_sha256_section:
+            continue
+
+        fields = line.split()
+        if (len(fields) == 3 and fields[1].isdigit() and fields[2].startswith(contents_prefix)
+                and fields[2].endswith(".gz")):
+            arch = fields[2][len(contents_prefix):-len(".gz")]
+            checksums[arch] = {"sha256": fields[0], "size": int(fields[1])}
+
+    return checksums
+
+
+def verify_chunks(chunks: Iterable[bytes], checksum: dict, arch: str) -> Iterator[bytes]:
+    """Yields each of <chunks> of the gzipped contents index for <arch> unchanged, while hashing them. Once they run
+    out, raises requests.exceptions.RequestException if their SHA256 or total size don't match <checksum> (a "sha256"
+    and "size" from get_checksums()). Whatever reads the chunks stops on the exception before storing anything, so a
+    bad download is never cached."""
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+        if size > checksum["size"]:  # Already wrong, so there's no point downloading the rest
+            break
+
+        yield chunk
+
+    if size != checksum["size"] or digest.hexdigest() != checksum["sha256"]:
+        message = (f"Integrity check failed for the {arch} contents index: received {size} bytes with SHA256 "
+                   f"{digest.hexdigest()}, but the Release file lists {checksum['size']} bytes with SHA256 "
+                   f"{checksum['sha256']}")
+        logging.critical(message)
+        raise requests.exceptions.RequestException(message)
+
+    return
@@ -0,0 +1,222 @@
+"""Persistent reverse index of a contents index, for looking up which files a package owns, and which packages ship a
+file, without downloading and scanning the whole contents index again.
+
+Each architecture's index is a single file: one line of JSON (the version of the contents index it was built from, the
+package names in ID order, and where each section starts) followed by these sections, each aligned to 8 bytes:
+    path_offsets          - array of where each file name starts in path_bytes, plus the end of the last one
+    path_bytes            - every file name back to back, sorted, so a file can be found with a binary search
+    file_package_offsets  - array of where each file's packages start in file_package_ids, plus the end of the last
+    file_package_ids      - package IDs of every file, in file order
+    package_file_offsets  - array of where each package's files start in package_file_ids, plus the end of the last
+    package_file_ids      - file IDs (positions in the sorted file table) of every package, in package ID order
+Queries memory-map the file and read the arrays in place, so only the header is parsed up front."""
+# P: Package names are interned as IDs, and both directions of the mapping are flat postings lists (an offsets array
+#    into one big array of IDs), so a contents index of a few million rows fits in a few tens of megabytes, and a
+#    lookup touches only the pages it needs.
+from array import array
+import bisect
+import bulk_parser as bulk
+from collections import Counter
+import constants as cons
+from itertools import accumulate, chain, repeat
+import json
+import logging
+import mmap
+import os
+import sys
+from typing import Iterable, Iterator
+
+
+# Array type codes of the sections. Offsets are 64-bit, since path_bytes can grow past 4 GB for the largest indices.
+OFFSET_TYPECODE = "Q"
+ID_TYPECODE = "I"
+SECTION_ALIGNMENT = 8
+SECTIONS = ("path_offsets", "path_bytes", "file_package_offsets", "file_package_ids", "package_file_offsets",
+            "package_file_ids")
+
+
+def get_index_path(arch: str) -> str:
+    """Returns the path of the reverse index file for <arch>."""
+    return os.path.join(cons.REVERSE_INDEX_DIRECTORY, f"{arch}.index")
+
+
+def is_current(arch: str, version: str) -> bool:
+    """Returns True if the reverse index for <arch> was built from <version> of its contents index."""
+    header = _read_header(arch)
+    return bool(version) and header is not None and header["version"] == version
+
+
+def store_index(arch: str, version: str, blocks: Iterable[bytes]) -> Iterator[bytes]:
+    """Yields each of <blocks> (decompressed, line-aligned blocks from decompression.iter_gzip_blocks()) unchanged,
+    while also building a reverse index of them. The index is stored for <arch> as built from <version> of the contents
+    index, replacing any previous one, once every block has been read."""
+    paths = []
+    field_ids = {}
+    line_fields = array(ID_TYPECODE)
+    for block in blocks:
+        entries = bulk.get_entries(block)
+        paths.extend([path for path, _ in entries])
+        # setdefault() only adds a field the first time it's seen, and len() is evaluated before it's added
+        line_fields.extend([field_ids.setdefault(field, len(field_ids)) for _, field in entries])
+        yield block
+
+    save_index(arch, version, paths, list(field_ids), line_fields)
+    return
+
+
+def save_index(arch: str, version: str, paths: list[bytes], fields: list[bytes], line_fields: array) -> None:
+    """Builds and stores the reverse index for <arch> from the file name of every table row in <paths> and the package
+    field of each row, given as an ID in <line_fields> into the distinct package <fields>."""
+    # Package IDs are assigned in name order, so the same contents index always gives the same file
+    field_packages = [[package for package in field.split(b",") if package] for field in fields]
+    package_names = sorted({package for packages in field_packages for package in packages})
+    package_ids = {package: package_id for package_id, package in enumerate(package_names)}
+    field_package_ids = [tuple(package_ids[package] for package in packages) for packages in field_packages]
+
+    # P: Everything below is built with C-level iteration (accumulate, chain, sorted) where it can be. A Python loop
+    #    over the rows took about twice as long.
+    sorted_lines = sorted(range(len(paths)), key=paths.__getitem__)
+    sorted_paths = [paths[line] for line in sorted_lines]
+    file_packages = [field_package_ids[line_fields[line]] for line in sorted_lines]
+    file_package_ids = array(ID_TYPECODE, chain.from_iterable(file_packages))
+    # Sorting the postings of every file by package ID groups them by package. The sort is stable, so each package's
+    # files stay in file order.
+    posting_file_ids = array(ID_TYPECODE, chain.from_iterable(repeat(file_id, len(packages))
+                                                              for file_id, packages in enumerate(file_packages)))
+    posting_order = sorted(range(len(file_package_ids)), key=file_package_ids.__getitem__)
+    package_file_counts = Counter(file_package_ids)
+
+    sections = {"path_offsets": array(OFFSET_TYPECODE, accumulate(map(len, sorted_paths), initial=0)),
+                "path_bytes": b"".join(sorted_paths),
+                "file_package_offsets": array(OFFSET_TYPECODE, accumulate(map(len, file_packages), initial=0)),
+                "file_package_ids": file_package_ids,
+                "package_file_offsets": array(OFFSET_TYPECODE, accumulate(map(package_file_counts.__getitem__,
+                                                                              range(len(package_names))), initial=0)),
+                "package_file_ids": array(ID_TYPECODE, [posting_file_ids[posting] for posting in posting_order])}
+    _write_index(arch, {"version": version, "byteorder": sys.byteorder, "file_count": len(paths),
+                        "packages": [package.decode(errors="surrogateescape") for package in package_names]}, sections)
+    return
+
+
+def _write_index(arch: str, header: dict, sections: dict) -> None:
+    """Writes <header>, with the position of each of <sections> added, followed by the sections, to the reverse index
+    file for <arch>, replacing any previous one atomically."""
+    section_bytes = [sections[name] if name == "path_bytes" else sections[name].tobytes() for name in SECTIONS]
+    # The header's length depends on the section positions it lists, so they're measured from the end of the header
+    position = 0
+    header["sections"] = {}
+    for name, data in zip(SECTIONS, section_bytes):
+        header["sections"][name] = [position, len(data)]
+        position += len(data) + _get_padding(len(data))
+
+    header_line = json.dumps(header).encode() + b"\n"
+    header_line += b" " * _get_padding(len(header_line))  # Trailing spaces are ignored by json.loads()
+
+    os.makedirs(cons.REVERSE_INDEX_DIRECTORY, exist_ok=True)
+    index_path = get_index_path(arch)
+    temporary_path = f"{index_path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            file.write(header_line)
+            for data in section_bytes:
+                file.write(data)
+                file.write(b"\0" * _get_padding(len(data)))
+
+        os.replace(temporary_path, index_path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    return
+
+
+def _get_padding(length: int) -> int:
+    """Returns the number of bytes that bring <length> up to a multiple of <SECTION_ALIGNMENT>."""
+    return -length % SECTION_ALIGNMENT
+
+
+def _read_header(arch: str) -> dict | None:
+    """Returns the header of the reverse index for <arch>, or None if there isn't a readable one."""
+    try:
+        with open(get_index_path(arch), "rb") as file:
+            return json.loads(file.readline())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed reading reverse index header for {arch}; error: {e!r}")
+        return None
+
+
+def open_index(arch: str) -> dict | None:
+    """Returns the reverse index for <arch>, with its header fields and a view of each section, or None if there isn't
+    a readable one."""
+    try:
+        with open(get_index_path(arch), "rb") as file:
+            header_line = file.readline()
+            header_line += file.read(_get_padding(len(header_line)))
+            mapped_index = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # The mapping outlives the file handle
+        index = json.loads(header_line)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Failed reading reverse index for {arch}; error: {e!r}")
+        return None
+
+    index_view = memoryview(mapped_index)
+    for name, (start, length) in index.pop("sections").items():
+        section = index_view[len(header_line) + start:len(header_line) + start + length]
+        if name == "path_bytes":
+            index[name] = section
+        elif index["byteorder"] == sys.byteorder:
+            index[name] = section.cast(OFFSET_TYPECODE if name.endswith("offsets") else ID_TYPECODE)
+        else:  # Copied and swapped in memory. Only happens if the file was written on a machine of the other byteorder.
+            index[name] = array(OFFSET_TYPECODE if name.endswith("offsets") else ID_TYPECODE, section)
+            index[name].byteswap()
+
+    index["package_ids"] = {package: package_id for package_id, package in enumerate(index["packages"])}
+    return index
+
+
+def get_path(index: dict, file_id: int) -> bytes:
+    """Returns the file name with <file_id> in <index>."""
+    path_offsets = index["path_offsets"]
+    return bytes(index["path_bytes"][path_offsets[file_id]:path_offsets[file_id + 1]])
+
+
+def find_package_files(index: dict, package: str) -> list[str]:
+    """Returns every file owned by <package> in <index>, sorted. <package> can be a qualified name (e.g. "shells/bash")
+    or just the package name (e.g. "bash"), in which case the files of every section's package of that name are
+    returned."""
+    package_offsets = index["package_file_offsets"]
+    file_ids = []
+    for package_id in _find_package_ids(index, package):
+        file_ids.extend(index["package_file_ids"][package_offsets[package_id]:package_offsets[package_id + 1]])
+
+    return [get_path(index, file_id).decode(errors="surrogateescape") for file_id in sorted(set(file_ids))]
+
+
+def _find_package_ids(index: dict, package: str) -> list[int]:
+    """Returns the IDs of the packages in <index> that <package> names (see find_package_files())."""
+    if package in index["package_ids"]:
+        return [index["package_ids"][package]]
+
+    return [package_id for package_id, qualified_name in enumerate(index["packages"])
+            if qualified_name.rpartition("/")[2] == package]
+
+
+def find_path_packages(index: dict, path: str) -> list[str]:
+    """Returns the qualified names of every package in <index> that ships the file <path>. Leading "/" and "./" are
+    ignored, since file names in contents indices are relative to the root directory."""
+    # The file table is sorted by the raw bytes of the names, so it's searched with them too
+    path = path.removeprefix("./").lstrip("/").encode(errors="surrogateescape")
+    file_count = len(index["path_offsets"]) - 1
+    file_id = bisect.bisect_left(range(file_count), path, key=lambda candidate: get_path(index, candidate))
+
+    package_offsets = index["file_package_offsets"]
+    packages = []
+    while file_id < file_count and get_path(index, file_id) == path:  # The same file can be listed on several rows
+        package_ids = index["file_package_ids"][package_offsets[file_id]:package_offsets[file_id + 1]]
+        packages.extend(index["packages"][package_id] for package_id in package_ids)
+        file_id += 1
+
+    return list(dict.fromkeys(packages))
@@ -0,0 +1,157 @@
+"""Append-only history of the full package file counts of each architecture, with one snapshot per version of its
+contents index on the mirror, keyed by the index's Last-Modified timestamp.
+
+Each snapshot is stored as the change in every package's count since the snapshot before it. The first snapshot of an
+architecture holds all of its counts, and every later one only holds the packages that changed in that update. The
+counts at any snapshot are the sum of every change up to it. Growth and movers queries are answered from the history
+alone, so old contents indices never have to be downloaded again."""
+# P: The statistics cache only keeps the top packages of the latest version of each file, and replaces them whenever
+#    the file changes. Only a small share of the tens of thousands of packages change between two updates of an index,
+#    so storing changes instead of full copies keeps every snapshot after the first one small. The changes are
+#    zlib-compressed JSON in the same SQLite database as the cache, so nothing outside the standard library is needed.
+import aggregate_stats as agg
+import constants as cons
+from email.utils import parsedate_to_datetime
+import json
+import logging
+import metrics
+import sqlite3
+from typing import Iterable, Mapping
+import zlib
+
+
+def connect() -> sqlite3.Connection:
+    """Opens the cache database with the snapshot table, creating it on first use. Transactions are started explicitly,
+    rather than by the sqlite3 module."""
+    connection = sqlite3.connect(cons.CACHE_DATABASE_PATH, timeout=cons.CACHE_LOCK_TIMEOUT, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS package_snapshots "
+                       "(id INTEGER PRIMARY KEY, arch TEXT NOT NULL, last_modified TEXT NOT NULL, "
+                       "changes BLOB NOT NULL, UNIQUE (arch, last_modified))")
+    return connection
+
+
+def record_snapshot(arch: str, last_modified: str, package_counts: Mapping[bytes, int]) -> bool:
+    """Appends <package_counts>, the full counts of the contents index for <arch> that was last modified at
+    <last_modified>, to the history of <arch>. Returns True if it was added. Returns False if it isn't newer than the
+    latest snapshot, if no package changed since then, or if the snapshot couldn't be stored."""
+    # P: Losing a snapshot only leaves a gap in the history, which is no reason to fail the run that counted it
+    if not last_modified:  # There's nothing to order the snapshot by
+        return False
+
+    try:
+        with metrics.phase("snapshot_write"):
+            return _append_snapshot(arch, last_modified, package_counts)
+    except (sqlite3.Error, ValueError) as e:  # parsedate_to_datetime() raises ValueError on malformed timestamps
+        logging.warning(f"Failed recording a snapshot of the {arch} package counts; error: {e!r}")
+        return False
+
+
+def _append_snapshot(arch: str, last_modified: str, package_counts: Mapping[bytes, int]) -> bool:
+    connection = connect()
+    try:
+        # Taking the write lock before reading means no other run can append in between
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            latest_row = connection.execute("SELECT last_modified FROM package_snapshots WHERE arch = ? "
+                                            "ORDER BY id DESC LIMIT 1", (arch,)).fetchone()
+            if latest_row and parsedate_to_datetime(last_modified) <= parsedate_to_datetime(latest_row[0]):
+                connection.execute("ROLLBACK")  # Most often the same version counted again, such as from the blob cache
+                return False
+
+            history = _read_history(connection, arch)
+            changes = get_changes(sum_changes(changes for _, changes in history), package_counts)
+            if history and not changes:
+                connection.execute("ROLLBACK")
+                return False
+
+            connection.execute("INSERT INTO package_snapshots (arch, last_modified, changes) VALUES (?, ?, ?)",
+                               (arch, last_modified, zlib.compress(json.dumps(changes).encode())))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        connection.close()
+
+    return True
+
+
+def get_history(arch: str) -> list[tuple[str, dict[str, int]]]:
+    """Returns the Last-Modified timestamp and the changes of every snapshot of <arch>, oldest first."""
+    with metrics.phase("snapshot_read"):
+        connection = connect()
+        try:
+            return _read_history(connection, arch)
+        finally:
+            connection.close()
+
+
+def _read_history(connection: sqlite3.Connection, arch: str) -> list[tuple[str, dict[str, int]]]:
+    rows = connection.execute("SELECT last_modified, changes FROM package_snapshots WHERE arch = ? ORDER BY id",
+                              (arch,)).fetchall()
+    return [(last_modified, json.loads(zlib.decompress(changes))) for last_modified, changes in rows]
+
+
+def get_changes(old_counts: Mapping[str, int], new_counts: Mapping[bytes, int]) -> dict[str, int]:
+    """Returns how much the count of every package changed from <old_counts> to <new_counts>, leaving out the packages
+    that didn't change. A package missing from either side counts as zero there. Names that aren't valid UTF-8 are
+    kept with surrogate escapes, the same as in delta_updates and reverse_index."""
+    changes = {}
+    for package, file_count in new_counts.items():
+        package = package.decode(errors="surrogateescape")
+        if file_count != old_counts.get(package, 0):
+            changes[package] = file_count - old_counts.get(package, 0)
+
+    new_packages = set(new_counts)
+    for package, file_count in old_counts.items():
+        if package.encode(errors="surrogateescape") not in new_packages:
+            changes[package] = -file_count
+
+    return changes
+
+
+def sum_changes(changes_list: Iterable[dict[str, int]]) -> dict[str, int]:
+    """Returns the package counts that <changes_list> add up to, starting from no packages. Packages that end up with no
+    files are left out."""
+    package_counts = {}
+    for changes in changes_list:
+        for package, change in changes.items():
+            file_count = package_counts.get(package, 0) + change
+            if file_count:
+                package_counts[package] = file_count
+            else:
+                del package_counts[package]
+
+    return package_counts
+
+
+def get_package_growth(history: list[tuple[str, dict[str, int]]], package: str,
+                       releases: int) -> list[tuple[str, int, int]]:
+    """Returns the Last-Modified timestamp of each of the last <releases> snapshots in <history> (from get_history()),
+    along with the file count of <package> in that snapshot, and how much it changed since the one before. Oldest
+    first."""
+    growth = []
+    file_count = 0
+    for last_modified, changes in history:
+        change = changes.get(package, 0)
+        file_count += change
+        growth.append((last_modified, file_count, change))
+
+    return growth[-releases:]
+
+
+def get_movers(history: list[tuple[str, dict[str, int]]], releases: int, size: int) -> dict[str, int]:
+    """Returns the <size> packages whose counts changed the most over the last <releases> snapshots in <history> (from
+    get_history()), along with how many files they gained (negative if they lost files). Ranked the same way as
+    aggregate_stats.get_differences(), by the size of the change."""
+    # Each of the last <releases> snapshots is compared with the one before it. The very first snapshot is left out,
+    # since it has nothing before it, and would make every package's whole count look like a change.
+    start_counts = sum_changes(changes for _, changes in history[:max(1, len(history) - releases)])
+    end_counts = sum_changes(changes for _, changes in history)
+    return agg.get_differences(encode_package_names(start_counts), encode_package_names(end_counts), size)
+
+
+def encode_package_names(package_counts: dict[str, int]) -> dict[bytes, int]:
+    """Returns <package_counts>, as stored in the history, with package names as bytes again."""
+    return {package.encode(errors="surrogateescape"): file_count for package, file_count in package_counts.items()}
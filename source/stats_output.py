@@ -0,0 +1,70 @@
+"""Machine-readable output of architecture statistics, for scripts that read the results instead of a person.
+
+With an <cons.OUTPUT_FORMAT> other than "table", the statistics of each architecture are added here as they're ready,
+instead of being printed, and written out all at once at the end of the run by write_results():
+
+    json - [{"arch": "amd64", "packages": [{"package": "...", "files": 123}, ...]}, ...]
+    csv  - an "arch,package,files" header, then one row per package
+    tsv  - the same as csv, separated by tabs
+
+Packages are in the same order as in the table, and there are as many of them as the table would show."""
+# P: The table is built for people, with a color code and padding around every value. Scripts that want thousands of
+#    rows pay for all of that and then have to strip it off again. Here, every row is built by json or csv, whose loops
+#    run in C, into a single string that's written with one call, instead of one print() per row.
+import constants as cons
+import csv
+import io
+import json
+from itertools import islice
+from typing import TextIO
+
+
+# Architecture (or other name the statistics are for) to its statistics, in the order they were added
+_results = {}
+
+
+def add_statistics(name: str, package_file_counts: dict[str, int]) -> None:
+    """Adds the first <cons.SHOW_COUNT> packages of <package_file_counts>, the statistics for <name>, to the results."""
+    _results[name] = dict(islice(package_file_counts.items(), cons.SHOW_COUNT))
+    return
+
+
+def reset() -> None:
+    """Clears every result added so far."""
+    _results.clear()
+    return
+
+
+def format_results(results: dict[str, dict[str, int]], output_format: str) -> str:
+    """Returns <results> (name to statistics) as text in <output_format>, one of <cons.OUTPUT_FORMATS> other than
+    "table"."""
+    if output_format == "json":
+        return json.dumps([{"arch": name, "packages": [{"package": package, "files": file_count}
+                                                       for package, file_count in package_file_counts.items()]}
+                           for name, package_file_counts in results.items()]) + "\n"
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter="\t" if output_format == "tsv" else ",", lineterminator="\n")
+    writer.writerow(("arch", "package", "files"))
+    for name, package_file_counts in results.items():
+        writer.writerows(zip([name] * len(package_file_counts), package_file_counts, package_file_counts.values()))
+
+    return buffer.getvalue()
+
+
+def write_results(output_format: str, output_path: str, stream: TextIO) -> None:
+    """Writes every result added so far in <output_format> to the file at <output_path>, or to <stream> if no path is
+    given. Writes nothing if none were added, as with the "table" format, whose statistics are printed as they're
+    ready."""
+    if not _results:
+        return
+
+    text = format_results(_results, output_format)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8", newline="") as file:
+            file.write(text)
+    else:
+        stream.write(text)
+        stream.flush()
+
+    return
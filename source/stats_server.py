@@ -0,0 +1,185 @@
+"""Local HTTP API serving architecture statistics from memory, for clients that ask for them many times a minute.
+
+    GET /arch/<architecture>?top=<n>
+
+returns the top <n> (default <cons.SHOW_COUNT>) packages of <architecture>, up to as many as are cached, as JSON:
+
+    {"arch": "amd64", "last_modified": "...", "etag": "...", "packages": [{"package": "...", "files": 123}, ...]}
+
+Statistics are loaded from the cache once at startup and kept in memory. A scheduler thread checks every
+<cons.SERVER_REFRESH_INTERVAL> seconds whether any of them are out of date on the mirror, and refreshes those in the
+background while the old ones keep being served. An architecture that isn't in memory yet is refreshed on its first
+request, and every other request for it that arrives in the meantime waits for that same refresh."""
+# P: Each run of main.py pays for starting Python, reading the cache, and asking the mirror for a timestamp before it
+#    can print anything. Here, those costs are paid once, and a request only reads a dictionary. The refresh itself is
+#    passed in by main.py, so this module doesn't need to know how statistics are counted or cached.
+from concurrent.futures import Future, ThreadPoolExecutor
+import constants as cons
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+
+# Requests for statistics start with this, followed by the architecture
+ARCH_ROUTE = "/arch/"
+
+
+class StatsStore:
+    """Architecture statistics held in memory. Each architecture is refreshed by at most one thread at a time, and
+    every caller that wants it refreshed in the meantime shares the result."""
+
+    def __init__(self, refresh: Callable[[str, dict], dict], stats: dict[str, dict]):
+        """<refresh> is called with an architecture and its statistics in memory (an empty dictionary if there aren't
+        any yet), and returns up-to-date statistics for it. <stats> are the statistics to start with."""
+        self.refresh = refresh
+        self.stats = dict(stats)
+        self.pending_refreshes = {}  # Architecture to the Future of its refresh, while one is running
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresh_executor = ThreadPoolExecutor(max_workers=cons.MAX_CONCURRENT_DOWNLOADS)
+
+    def get_stats(self, arch: str) -> dict:
+        """Returns the statistics for <arch>, waiting for them to be refreshed first if there aren't any in memory yet.
+        Raises the refresh's exception if it failed."""
+        with self.lock:
+            arch_stats = self.stats.get(arch)
+            if arch_stats is not None:
+                return arch_stats
+
+            pending_refresh = self._start_refresh(arch)
+
+        return pending_refresh.result()
+
+    def request_refresh(self, arch: str) -> Future:
+        """Starts refreshing the statistics for <arch> in the background, unless that's already happening, and returns
+        the Future of the refresh."""
+        with self.lock:
+            return self._start_refresh(arch)
+
+    def _start_refresh(self, arch: str) -> Future:
+        """Same as request_refresh(), for callers already holding <self.lock>."""
+        pending_refresh = self.pending_refreshes.get(arch)
+        if pending_refresh is None:
+            # The refresh can't remove itself from <self.pending_refreshes> until the lock is released, after this
+            pending_refresh = self.pending_refreshes[arch] = self.refresh_executor.submit(self._refresh, arch)
+
+        return pending_refresh
+
+    def _refresh(self, arch: str) -> dict:
+        """Refreshes the statistics for <arch> and stores them in memory, returning them."""
+        try:
+            with self.lock:
+                arch_stats = self.stats.get(arch, {})
+
+            arch_stats = self.refresh(arch, arch_stats)
+            with self.lock:
+                self.stats[arch] = arch_stats
+
+            return arch_stats
+        except Exception as e:
+            logging.warning(f"Failed refreshing statistics for {arch}; error: {e!r}")
+            raise
+        finally:
+            with self.lock:
+                del self.pending_refreshes[arch]
+
+    def start_scheduler(self, interval: float) -> None:
+        """Starts a background thread that requests a refresh of every architecture in memory right away, and then
+        again every <interval> seconds, until close() is called."""
+        threading.Thread(target=self._schedule_refreshes, args=(interval,), daemon=True).start()
+        return
+
+    def _schedule_refreshes(self, interval: float) -> None:
+        while not self.stopped.is_set():
+            with self.lock:
+                for arch in list(self.stats):
+                    self._start_refresh(arch)
+
+            self.stopped.wait(interval)
+
+        return
+
+    def close(self) -> None:
+        """Stops the scheduler, and cancels any refreshes that haven't started yet."""
+        self.stopped.set()
+        self.refresh_executor.shutdown(wait=False, cancel_futures=True)
+        return
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET /arch/<architecture>?top=<n> from the StatsStore of the server it belongs to."""
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        arch = url.path.removeprefix(ARCH_ROUTE) if url.path.startswith(ARCH_ROUTE) else ""
+        if arch not in cons.VALID_ARCHITECTURES:
+            self.send_json(404, {"error": f"Not found: {url.path}"})
+            return
+
+        top = parse_qs(url.query).get("top", [str(cons.SHOW_COUNT)])[-1]
+        try:
+            top_count = int(top)
+        except ValueError:  # Such as "zero", or a Unicode digit like "²" that str.isdigit() would have let through
+            top_count = 0
+        if top_count < 1:
+            self.send_json(400, {"error": f"top must be a positive integer: {top}"})
+            return
+
+        try:
+            arch_stats = self.server.stats_store.get_stats(arch)
+        except Exception as e:  # Already logged by the store
+            self.send_json(502, {"error": f"Failed refreshing statistics for {arch}: {e!r}"})
+            return
+
+        packages = list(arch_stats["packages"].items())[:top_count]
+        self.send_json(200, {"arch": arch,
+                             "last_modified": arch_stats.get("last_modified", ""),
+                             "etag": arch_stats.get("etag", ""),
+                             "packages": [{"package": package, "files": file_count}
+                                          for package, file_count in packages]})
+        return
+
+    def send_json(self, status: int, body: dict) -> None:
+        """Sends <body> as a JSON response with HTTP <status>."""
+        response_bytes = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response_bytes)))
+        self.end_headers()
+        self.wfile.write(response_bytes)
+        return
+
+    def log_message(self, format: str, *args) -> None:
+        # Every request would otherwise be written to stderr
+        logging.info(f"{self.address_string()} {format % args}")
+        return
+
+
+def create_server(stats_store: StatsStore, host: str, port: int) -> ThreadingHTTPServer:
+    """Returns an HTTP server bound to <host>:<port> (port 0 picks a free one) that answers from <stats_store>. Each
+    request is handled in its own thread, so one waiting on a refresh doesn't hold up the others."""
+    server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+    server.daemon_threads = True
+    server.stats_store = stats_store
+    return server
+
+
+def serve(refresh: Callable[[str, dict], dict], stats: dict[str, dict], host: str, port: int) -> None:
+    """Serves <stats> on <host>:<port>, refreshing them with <refresh> (see StatsStore), until interrupted."""
+    stats_store = StatsStore(refresh, stats)
+    server = create_server(stats_store, host, port)
+    stats_store.start_scheduler(cons.SERVER_REFRESH_INTERVAL)
+    print(f"{cons.GREEN}Serving statistics at {cons.RESET}http://{host}:{server.server_address[1]}{ARCH_ROUTE}"
+          f"<architecture>?top=<n>{cons.GREEN} (Ctrl+C to stop){cons.RESET}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n{cons.GREEN}Server stopped{cons.RESET}")
+    finally:
+        server.server_close()
+        stats_store.close()
+
+    return
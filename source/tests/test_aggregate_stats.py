@@ -0,0 +1,56 @@
+from source import aggregate_stats as agg
+
+
+def test_add_shared_architecture():
+    assert agg.add_shared_architecture(["amd64", "arm64"]) == ["amd64", "arm64", "all"]
+    assert agg.add_shared_architecture(["all", "amd64"]) == ["all", "amd64"]
+    # Each family has its own shared architecture, and source packages have none
+    assert agg.add_shared_architecture(["udeb-amd64", "udeb-arm64"]) == ["udeb-amd64", "udeb-arm64", "udeb-all"]
+    assert agg.add_shared_architecture(["amd64", "udeb-amd64"]) == ["amd64", "udeb-amd64", "all", "udeb-all"]
+    assert agg.add_shared_architecture(["source"]) == ["source"]
+    assert agg.add_shared_architecture(["source", "arm64"]) == ["source", "arm64", "all"]
+    assert agg.get_aggregate_key(["amd64", "arm64", "all"]) == "aggregate:amd64+arm64+all"
+
+    return
+
+
+def test_build_aggregate():
+    """Tests that the combined counts pick up packages that aren't at the top of any single architecture, and that the
+    differences are measured from the first architecture only."""
+    arch_counts = {"amd64": {b"libs/libc6": 10, b"devel/gcc": 6, b"shells/bash": 5},
+                   "arm64": {b"libs/libc6": 9, b"shells/bash": 5, b"devel/gdb": 7},
+                   "all": {b"doc/manual": 8, b"shells/bash": 1}}
+    aggregate = agg.build_aggregate(arch_counts, 3)
+
+    assert list(aggregate["packages"].items()) == [("libs/libc6", 19), ("shells/bash", 11), ("doc/manual", 8)]
+    assert aggregate["breakdown"] == {"libs/libc6": {"amd64": 10, "arm64": 9},
+                                      "shells/bash": {"amd64": 5, "arm64": 5, "all": 1},
+                                      "doc/manual": {"all": 8}}
+    # Packages with the same count in both are left out, and ties in size are broken by name
+    assert list(aggregate["differences"]["arm64"].items()) == [("devel/gdb", 7), ("devel/gcc", -6),
+                                                               ("libs/libc6", -1)]
+    assert list(aggregate["differences"]) == ["arm64"]
+
+    assert agg.get_differences(arch_counts["arm64"], arch_counts["arm64"], 3) == {}
+
+    return
+
+
+def test_is_valid_aggregate_entry():
+    server_validators = {"amd64": {"etag": "\"a\"", "last_modified": "Sat, 10 Feb 2024 09:30:27 GMT"},
+                         "all": {"etag": "", "last_modified": "Sat, 10 Feb 2024 09:30:27 GMT"}}
+    aggregate_stats = {"architectures": server_validators, "packages": {str(i): i for i in range(100)}}
+    assert agg.is_valid_aggregate_entry(aggregate_stats, server_validators)
+    assert not agg.is_valid_aggregate_entry({}, server_validators)
+
+    # Every architecture has to match, not just the first
+    changed_validators = {**server_validators, "all": {"etag": "", "last_modified": "Sun, 11 Feb 2024 09:30:27 GMT"}}
+    assert not agg.is_valid_aggregate_entry(aggregate_stats, changed_validators)
+
+    # A different set of architectures is a different aggregate
+    assert not agg.is_valid_aggregate_entry(aggregate_stats, {"amd64": server_validators["amd64"]})
+
+    # Too few packages to show
+    assert not agg.is_valid_aggregate_entry({**aggregate_stats, "packages": {"bash": 1}}, server_validators)
+
+    return
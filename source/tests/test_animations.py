@@ -8,7 +8,7 @@ import time
 
 @pytest.fixture
 def animation():
-    return Animation(dots)
+    return Animation(dots, enabled=True)  # Output is captured by pytest, so it wouldn't be a terminal
 
 
 def test_animation(animation, capsys):
@@ -35,3 +35,17 @@ def test_animation(animation, capsys):
     assert captured_animation.out.count(".") == dots_to_count
 
     return
+
+
+def test_animation_disabled(capsys):
+    """Tests that an animation does nothing when stdout isn't a terminal, as under pytest."""
+    animation = Animation(dots, time_delay=0.01)
+    assert animation.enabled is False
+
+    animation.start()
+    time.sleep(0.05)
+    animation.stop()
+    assert animation._thread.is_alive() is False
+    assert capsys.readouterr().out == ""
+
+    return
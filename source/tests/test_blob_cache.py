@@ -0,0 +1,94 @@
+import os
+import pytest
+from source import blob_cache
+
+
+@pytest.fixture
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_cache.cons, "BLOB_CACHE_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(blob_cache.cons, "BLOB_CACHE_MAX_MB", 1)
+    monkeypatch.setattr(blob_cache.cons, "DOWNLOAD_CHUNK_SIZE", 1000)
+    return tmp_path
+
+
+def test_store_and_read_blob(cache_directory):
+    """Tests that chunks pass through unchanged while being stored, and that the stored blob reads back the same."""
+    data = os.urandom(2500)
+    chunks = [data[:1200], data[1200:]]
+
+    assert blob_cache.read_blob("amd64", '"etag1"') is None  # Nothing stored yet
+    assert list(blob_cache.store_blob("amd64", '"etag1"', chunks)) == chunks
+    assert blob_cache.has_blob("amd64", '"etag1"') is True
+
+    cached_chunks = list(blob_cache.read_blob("amd64", '"etag1"'))
+    assert [len(chunk) for chunk in cached_chunks] == [1000, 1000, 500]  # Read back in chunks of DOWNLOAD_CHUNK_SIZE
+    assert b"".join(cached_chunks) == data
+
+    # A new version of the same architecture replaces the old one
+    list(blob_cache.store_blob("amd64", '"etag2"', chunks))
+    assert blob_cache.has_blob("amd64", '"etag2"') is True
+    assert blob_cache.has_blob("amd64", '"etag1"') is False
+
+    # Nothing is stored without a version to key it by
+    assert list(blob_cache.store_blob("arm64", "", chunks)) == chunks
+    assert len(os.listdir(cache_directory)) == 1
+
+    return
+
+
+def test_interrupted_store_blob(cache_directory):
+    """Tests that a download that fails part way through doesn't leave anything in the cache."""
+    def failing_chunks():
+        yield b"partial"
+        raise ConnectionError()
+
+    with pytest.raises(ConnectionError):
+        list(blob_cache.store_blob("amd64", '"etag1"', failing_chunks()))
+
+    assert blob_cache.has_blob("amd64", '"etag1"') is False
+    assert os.listdir(cache_directory) == []
+
+    return
+
+
+def test_evict_blobs(cache_directory, monkeypatch):
+    """Tests that the least recently used blobs are evicted first, and that reading a blob counts as using it."""
+    monkeypatch.setattr(blob_cache.cons, "BLOB_CACHE_MAX_MB", 10)  # So that storing the blobs doesn't evict any yet
+    blob_size = 400 * 1024  # Three of these go over a 1 MB budget
+    for access_time, arch in enumerate(("amd64", "arm64", "armel")):
+        list(blob_cache.store_blob(arch, "v1", [bytes(blob_size)]))
+        os.utime(blob_cache.get_blob_path(arch, "v1"), (access_time, access_time))
+
+    blob_cache.read_blob("amd64", "v1")  # amd64 is now the most recently used
+    blob_cache.evict_blobs(1024 * 1024)
+    assert blob_cache.has_blob("amd64", "v1") is True
+    assert blob_cache.has_blob("arm64", "v1") is False
+    assert blob_cache.has_blob("armel", "v1") is True
+
+    return
+
+
+def test_evict_blob_groups(cache_directory, monkeypatch):
+    """Tests that a blob is evicted together with the files stored alongside it, that using either keeps both, and that
+    files whose blob is gone are removed."""
+    monkeypatch.setattr(blob_cache.cons, "BLOB_CACHE_MAX_MB", 10)
+    blob_size = 300 * 1024
+    for access_time, arch in enumerate(("amd64", "arm64")):
+        list(blob_cache.store_blob(arch, "v1", [bytes(blob_size)]))
+        segments_path = blob_cache.get_blob_path(arch, "v1")[:-len(".gz")] + ".segments.gz"
+        with open(segments_path, "wb") as file:
+            file.write(bytes(blob_size))
+        os.utime(blob_cache.get_blob_path(arch, "v1"), (access_time, access_time))
+        os.utime(segments_path, (access_time, access_time))
+    orphan_path = blob_cache.get_blob_path("armel", "v1")[:-len(".gz")] + ".segments.json"
+    with open(orphan_path, "w") as file:
+        file.write("{}")
+
+    # amd64's segments were used last, so its whole group is kept over arm64's, and the orphan goes regardless
+    os.utime(blob_cache.get_blob_path("amd64", "v1")[:-len(".gz")] + ".segments.gz", (5, 5))
+    blob_cache.evict_blobs(1024 * 1024)
+    blob_path = blob_cache.get_blob_path("amd64", "v1")
+    assert sorted(os.listdir(cache_directory)) == sorted(os.path.basename(path) for path in
+                                                         (blob_path, blob_path[:-len(".gz")] + ".segments.gz"))
+
+    return
@@ -0,0 +1,58 @@
+import json
+from multiprocessing import Pool
+import pytest
+from source import cache_store
+
+
+@pytest.fixture
+def cache_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_store.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(cache_store.cons, "CACHE_PATH", str(tmp_path / "cache.json"))
+    return tmp_path
+
+
+def store_entry(arch: str) -> None:
+    cache_store.put_entries({arch: {"last_modified": arch, "packages": {f"{arch}_package": 1}}})
+    return
+
+
+def test_put_and_get_entries(cache_paths):
+    # No database or JSON cache exists yet. That's an empty cache, not an error
+    assert cache_store.get_cache() == {}
+    assert cache_store.get_entry("amd64") == {}
+
+    amd64_stats = {"etag": '"1"', "last_modified": "then", "packages": {"b": 3, "a": 2}}
+    arm64_stats = {"etag": '"2"', "last_modified": "then", "packages": {"c": 1}}
+    cache_store.put_entries({"amd64": amd64_stats, "arm64": arm64_stats})
+    assert cache_store.get_entry("amd64") == amd64_stats
+    assert list(cache_store.get_entry("amd64")["packages"]) == ["b", "a"]  # Package order is kept
+    assert cache_store.get_cache() == {"amd64": amd64_stats, "arm64": arm64_stats}
+
+    # Replacing one architecture's entry leaves the others alone
+    new_amd64_stats = {**amd64_stats, "last_modified": "now"}
+    cache_store.put_entries({"amd64": new_amd64_stats})
+    assert cache_store.get_cache() == {"amd64": new_amd64_stats, "arm64": arm64_stats}
+
+    return
+
+
+def test_concurrent_put_entries(cache_paths):
+    """Tests that separate processes writing different architectures at the same time keep every entry."""
+    architectures = [f"arch{i}" for i in range(20)]
+    with Pool(4) as pool:
+        pool.map(store_entry, architectures)
+
+    assert sorted(cache_store.get_cache()) == sorted(architectures)
+
+    return
+
+
+def test_import_json_cache(cache_paths):
+    """Tests that the old JSON cache is carried over the first time the database is created."""
+    old_cache = {"amd64": {"last_modified": "then", "packages": {"a": 1}}}
+    with open(cache_paths / "cache.json", "w") as file:
+        json.dump(old_cache, file)
+
+    assert cache_store.get_cache() == old_cache
+
+    return
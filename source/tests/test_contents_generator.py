@@ -0,0 +1,25 @@
+from source import bulk_parser
+from source import decompression
+from source import main
+from source.benchmarks import contents_generator
+
+
+def test_write_contents_index(tmp_path):
+    """Tests that the counts returned by the generator are exactly what bulk_parser finds in the file it writes and
+    give the same table as the reference engine, that the file has the requested number of table rows, and that the
+    same seed gives the same file."""
+    path = tmp_path / "Contents-synthetic.gz"
+    expected_counts = contents_generator.write_contents_index(str(path), 5000, seed=1)
+    compressed = path.read_bytes()
+
+    assert bulk_parser.tally_package_files(decompression.iter_gzip_blocks([compressed])) == expected_counts
+    lines = decompression.iter_gzip_lines([compressed])
+    assert (main.sort_package_file_counts(main.tally_package_file_associations(lines))
+            == main.sort_package_file_counts(expected_counts))
+
+    rows = [line for line in decompression.iter_gzip_lines([compressed]) if b"/" in line[:59]]
+    assert len(rows) == 5000
+    assert any(b" " in line[:59].strip() for line in rows)  # Some file names contain whitespace
+
+    repeat_path = tmp_path / "Contents-synthetic-repeat.gz"
+    assert contents_generator.write_contents_index(str(repeat_path), 5000, seed=1) == expected_counts
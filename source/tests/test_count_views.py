@@ -0,0 +1,93 @@
+import os.path
+import pytest
+from source import bulk_parser
+from source import count_views as views
+from source import decompression
+
+
+@pytest.fixture
+def cache_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(views.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+    return tmp_path
+
+
+def test_view_counter():
+    """Tests that blocks pass through unchanged, and that each view filters and groups the same pass its own way."""
+    blocks = [b"FILE LOCATION\n"
+              b"usr/bin/bash        shells/bash\n"
+              b"usr/share/doc/bash/README     shells/bash\n",
+              b"usr/share/man/man1/ls.1.gz    utils/coreutils,shells/bash\n"
+              b"usr/lib/libfoo.so   libs/foo,bash\n"]
+    view_counter = views.ViewCounter({"all": {},
+                                      "no-docs": {"exclude": ["/usr/share/doc/", "usr/share/man/"]},
+                                      "libraries": {"include": ["usr/lib/", "lib/"], "strip_sections": True},
+                                      "sections": {"group_by": "section"},
+                                      "directories": {"group_by": "path", "path_depth": 2}})
+    assert list(view_counter.count_blocks(blocks)) == blocks
+
+    view_counts = view_counter.get_counts()
+    assert view_counts["all"] == bulk_parser.tally_package_files(blocks)
+    assert view_counts["no-docs"] == {b"shells/bash": 1, b"libs/foo": 1, b"bash": 1}
+    assert view_counts["libraries"] == {b"foo": 1, b"bash": 1}
+    assert view_counts["sections"] == {b"shells": 3, b"utils": 1, b"libs": 1, views.NO_SECTION: 1}
+    assert view_counts["directories"] == {b"usr/bin": 1, b"usr/share": 3, b"usr/lib": 2}
+
+    return
+
+
+def test_view_counter_contents_index():
+    """Tests that a view with no rules counts the same as the package counts, and that the views of a filter and its
+    opposite add up to them."""
+    test_file_path = os.path.join(os.path.dirname(__file__), "test_contents_index.gz")
+    with open(test_file_path, "rb") as file:
+        blocks = list(decompression.iter_gzip_blocks([file.read()]))
+    view_counter = views.ViewCounter({"all": {}, "docs": {"include": ["usr/share/doc/"]},
+                                      "no-docs": {"exclude": ["usr/share/doc/"]}})
+    list(view_counter.count_blocks(blocks))
+
+    view_counts = view_counter.get_counts()
+    package_counts = bulk_parser.tally_package_files(blocks)
+    assert view_counts["all"] == package_counts
+    for package, file_count in package_counts.items():
+        assert view_counts["docs"].get(package, 0) + view_counts["no-docs"].get(package, 0) == file_count
+
+    return
+
+
+def test_check_rules():
+    views.check_rules("all", {})
+    for name, rules in views.cons.COUNT_VIEWS.items():
+        views.check_rules(name, rules)
+
+    for invalid_rules in ([], {"exclude": "usr/share/doc/"}, {"group_by": "directory"}, {"path_depth": 0},
+                          {"path_depth": True}, {"sort": "name"}):
+        with pytest.raises(ValueError):
+            views.check_rules("invalid", invalid_rules)
+
+    return
+
+
+def test_store_views(cache_paths):
+    """Tests that views are only current for the version and rules they were counted with, and that views counted later
+    for the same version are added to the ones already cached."""
+    view_counter = views.ViewCounter({"sections": {"group_by": "section"}})
+    list(view_counter.count_blocks([b"usr/bin/bash    shells/bash\nusr/bin/ls    utils/coreutils,shells/bash\n"]))
+    views.store_views("amd64", '"etag1"', view_counter.views, view_counter.get_counts())
+
+    assert views.get_stored_views("amd64", '"etag1"') == {"sections": {"rules": {"group_by": "section"},
+                                                                       "packages": {"shells": 2, "utils": 1}}}
+    assert views.has_views("amd64", '"etag1"', {"sections": {"group_by": "section"}})
+    assert not views.has_views("amd64", '"etag2"', {"sections": {"group_by": "section"}})
+    assert not views.has_views("amd64", '"etag1"', {"sections": {"group_by": "path"}})
+    assert not views.has_views("amd64", '"etag1"', {"sections": {"group_by": "section"}, "all": {}})
+
+    view_counter = views.ViewCounter({"all": {}})
+    list(view_counter.count_blocks([b"usr/bin/bash    shells/bash\n"]))
+    views.store_views("amd64", '"etag1"', view_counter.views, view_counter.get_counts())
+    assert views.has_views("amd64", '"etag1"', {"sections": {"group_by": "section"}, "all": {}})
+
+    # Without a version, there's nothing to check the views against, so they aren't cached
+    views.store_views("arm64", "", view_counter.views, view_counter.get_counts())
+    assert views.get_stored_views("arm64", "") == {}
+
+    return
@@ -37,3 +37,27 @@ def test_get_last_modified_timestamp():
     assert result == ""
 
     return
+
+
+def test_mdtm_to_http_date():
+    """Tests that FTP MDTM timestamps are converted to the same format as HTTP Last-Modified headers."""
+    assert debian_mirror.mdtm_to_http_date("213 20240210093027") == "Sat, 10 Feb 2024 09:30:27 GMT"
+    assert debian_mirror.mdtm_to_http_date("213 20240210093027.123") == "Sat, 10 Feb 2024 09:30:27 GMT"  # Fractions
+
+    # Failed or malformed timestamps give an empty string, which is never considered current
+    assert debian_mirror.mdtm_to_http_date("") == ""
+    assert debian_mirror.mdtm_to_http_date("550 Could not get file modification time.") == ""
+
+    return
+
+
+def test_get_session():
+    """Tests that every call shares one pooled session, configured with the retries from constants."""
+    session = debian_mirror.get_session()
+    assert debian_mirror.get_session() is session
+
+    adapter = session.get_adapter(debian_mirror.get_contents_index_url("amd64"))
+    assert adapter.max_retries.total == debian_mirror.cons.HTTP_RETRIES
+    assert adapter._pool_maxsize == debian_mirror.cons.HTTP_POOL_SIZE
+
+    return
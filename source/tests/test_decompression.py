@@ -0,0 +1,34 @@
+import gzip
+import os.path
+import pytest
+from source import decompression
+
+
+def read_in_chunks(data: bytes, chunk_size: int) -> list[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def test_iter_gzip_lines():
+    """Tests that streaming decompression yields exactly the same lines as gzip.GzipFile, regardless of where the chunk
+    boundaries fall."""
+    test_contents_index = os.path.join("tests", "test_contents_index.gz")
+    with open(test_contents_index, "rb") as file:
+        compressed = file.read()
+
+    with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
+        expected_lines = [line.rstrip(b"\n") for line in file]
+
+    # Chunk sizes are arbitrary, chosen so that boundaries land mid-header, mid-line, and past the end of the file
+    for chunk_size in (1, 7, 64, 1024, len(compressed) + 1):
+        lines = list(decompression.iter_gzip_lines(read_in_chunks(compressed, chunk_size)))
+        assert lines == expected_lines
+
+    # Multi-member gzip files are decompressed in full
+    two_members = gzip.compress(b"a/b package1\n") + gzip.compress(b"c/d package2\n")
+    assert list(decompression.iter_gzip_lines(read_in_chunks(two_members, 5))) == [b"a/b package1", b"c/d package2"]
+
+    # A truncated download is an error, rather than a silently short count
+    with pytest.raises(EOFError):
+        list(decompression.iter_gzip_lines(read_in_chunks(compressed[:-20], 64)))
+
+    return
@@ -0,0 +1,153 @@
+import gzip
+import hashlib
+import os.path
+import pytest
+from source import bulk_parser
+from source import delta_updates
+
+
+CONTENTS = (b"Free form text at the top\n"
+            b"FILE LOCATION\n"
+            b"bin/a pkg1\n"
+            b"bin/b pkg1,pkg2\n"
+            b"usr/share/doc/c section/pkg3\n"
+            b"usr/with space/d pkg2\n")
+
+
+def build_state_from_bytes(contents: bytes) -> dict:
+    compressed = gzip.compress(contents)
+    return delta_updates.build_state([compressed[i:i + 16] for i in range(0, len(compressed), 16)])
+
+
+def test_build_state():
+    """Tests that the stored state counts the same packages as the bulk engine, and fingerprints the uncompressed
+    file."""
+    test_contents_index = os.path.join("tests", "test_contents_index.gz")
+    with open(test_contents_index, "rb") as file:
+        state = delta_updates.build_state([file.read()])
+
+    with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
+        contents = file.read()
+
+    assert delta_updates.get_package_counts(state) == bulk_parser.tally_package_files([contents])
+    assert state["sha256"] == hashlib.sha256(contents).hexdigest()
+    assert len(state["lines"]) == len(contents.split(b"\n"))  # One entry per line, valid or not
+    assert sum(state["line_sizes"]) == len(contents)
+
+    return
+
+
+def test_apply_ed_script():
+    """Tests that patching a state gives the same counts as building one from the patched file."""
+    patched_contents = (b"Free form text at the top\n"
+                        b"FILE LOCATION\n"
+                        b"bin/a pkg1\n"
+                        b"bin/new pkg4\n"
+                        b"usr/share/doc/c section/pkg3,pkg1\n"
+                        b"usr/share/doc/e section/pkg3\n")
+    # Written bottom up, the way diff --ed does, so earlier line numbers stay valid
+    script = (b"6c\n"
+              b"usr/share/doc/e section/pkg3\n"
+              b".\n"
+              b"5c\n"
+              b"usr/share/doc/c section/pkg3,pkg1\n"
+              b".\n"
+              b"4d\n"
+              b"3a\n"
+              b"bin/new pkg4\n"
+              b".\n")
+
+    state = build_state_from_bytes(CONTENTS)
+    delta_updates.apply_ed_script(state, script)
+    expected_state = build_state_from_bytes(patched_contents)
+    assert delta_updates.get_package_counts(state) == delta_updates.get_package_counts(expected_state)
+    assert len(state["lines"]) == len(expected_state["lines"])  # Field IDs are numbered in a different order
+    assert state["line_sizes"] == expected_state["line_sizes"]
+
+    # Commands diff --ed doesn't write, and line numbers past the end of the file, can't be applied
+    for invalid_script in (b"1,$d\n", b"s/.//\n", b"7d\n", b"2a\nbin/f pkg5\n"):
+        with pytest.raises(ValueError):
+            delta_updates.apply_ed_script(build_state_from_bytes(CONTENTS), invalid_script)
+
+    return
+
+
+def test_patch_state(monkeypatch):
+    """Tests that a patched state is only trusted if it's the size the pdiff Index lists for the current version."""
+    patched_contents = CONTENTS + b"bin/new pkg4\n"
+    patch = b"6a\nbin/new pkg4\n.\n"
+    wrong_patch = b"6a\nbin/other pkg4\n.\n"  # Applies cleanly, but doesn't give the current version
+    old_hash = hashlib.sha256(CONTENTS).hexdigest()
+    new_hash = hashlib.sha256(patched_contents).hexdigest()
+    index_text = (f"SHA256-Current: {new_hash} {len(patched_contents)}\n"
+                  f"SHA256-History:\n"
+                  f" {old_hash} {len(CONTENTS)} T-2024-01-01-0000.00\n")
+    monkeypatch.setattr(delta_updates.deb, "read_pdiff_index", lambda arch: index_text)
+
+    for ed_script, patched in ((patch, True), (wrong_patch, False)):
+        monkeypatch.setattr(delta_updates.deb, "read_pdiff_patch", lambda arch, name: gzip.compress(ed_script))
+        state = build_state_from_bytes(CONTENTS)
+        assert delta_updates.patch_state("amd64", state) is patched
+        if patched:
+            assert state["sha256"] == new_hash
+            assert delta_updates.get_package_counts(state) == bulk_parser.tally_package_files([patched_contents])
+
+    # The uncompressed patch is checked against its own SHA256 too, where the index lists one
+    monkeypatch.setattr(delta_updates.deb, "read_pdiff_patch", lambda arch, name: gzip.compress(patch))
+    index_text += f"SHA256-Patches:\n {hashlib.sha256(wrong_patch).hexdigest()} 20 T-2024-01-01-0000.00\n"
+    assert delta_updates.patch_state("amd64", build_state_from_bytes(CONTENTS)) is False
+
+    return
+
+
+def test_get_patch_sequence():
+    index_text = ("SHA256-Current: hash3 300\n"
+                  "SHA256-History:\n"
+                  " hash0 100 T-2024-01-01-0000.00\n"
+                  " hash1 150 T-2024-02-01-0000.00\n"
+                  " hash2 200 T-2024-03-01-0000.00\n"
+                  "SHA256-Download:\n"
+                  " dl0 10 T-2024-01-01-0000.00.gz\n")
+    index = delta_updates.parse_pdiff_index(index_text)
+    assert index["current"] == "hash3"
+    assert index["downloads"] == {"T-2024-01-01-0000.00.gz": "dl0"}
+    assert index["sizes"] == {"hash0": 100, "hash1": 150, "hash2": 200, "hash3": 300}
+    assert index["merged"] is False
+
+    # Unmerged patches are applied one after another, from the stored version on
+    assert delta_updates.get_patch_sequence(index, "hash1") == ["T-2024-02-01-0000.00", "T-2024-03-01-0000.00"]
+    assert delta_updates.get_patch_sequence(index, "hash_unknown") == []
+
+    # A merged patch goes straight to the current version
+    merged_index = delta_updates.parse_pdiff_index(index_text + "X-Patch-Precedence: merged\n")
+    assert delta_updates.get_patch_sequence(merged_index, "hash1") == ["T-2024-02-01-0000.00"]
+
+    return
+
+
+def test_save_and_load_state(tmp_path, monkeypatch):
+    monkeypatch.setattr(delta_updates.cons, "DELTA_STATE_DIRECTORY", str(tmp_path))
+    state = build_state_from_bytes(CONTENTS + b"bin/\xff\xfe odd/\xc3\xa9\n")  # Package names that aren't valid UTF-8
+
+    assert delta_updates.load_state("amd64") is None  # Nothing stored yet
+    delta_updates.save_state("amd64", state)
+    loaded_state = delta_updates.load_state("amd64")
+    assert loaded_state == state
+
+    # A failed write leaves the stored state as it was, and no temporary file behind
+    def fail_replace(source: str, destination: str) -> None:
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(delta_updates.os, "replace", fail_replace)
+    with pytest.raises(OSError):
+        delta_updates.save_state("amd64", build_state_from_bytes(CONTENTS))
+    monkeypatch.undo()
+    monkeypatch.setattr(delta_updates.cons, "DELTA_STATE_DIRECTORY", str(tmp_path))
+    assert os.listdir(tmp_path) == [os.path.basename(delta_updates.get_state_path("amd64"))]
+    assert delta_updates.load_state("amd64") == state
+
+    with open(delta_updates.get_state_path("amd64"), "ab") as file:
+        file.write(b"\x00")
+    assert delta_updates.load_state("amd64") is None
+
+    return
@@ -1,12 +1,14 @@
 import gzip
 import os.path
+import pytest
+from source import bulk_parser
 from source import constants as cons
 from source import main
 
 
-# P: The main(), analyze_architecture_contents(), get_top_package_file_counts(), and get_cache() functions consist
-#    almost entirely of other function calls, so they don't have their own unit tests. main.sort_package_file_counts()
-#    is implicitly tested within test_count_package_file_associations, so it also doesn't have its own unit test.
+# P: The main(), analyze_architecture_contents(), and stream_top_package_file_counts() functions consist almost
+#    entirely of other function calls, so they don't have their own unit tests. main.sort_package_file_counts() is also
+#    implicitly tested within test_count_package_file_associations, but has its own test for tie-breaking.
 
 def test_is_user_input_valid(capsys):
     # No architecture passed. Function should return False and let the user know how to format the input
@@ -30,15 +32,194 @@ def test_is_user_input_valid(capsys):
         test_valid_input = main.is_user_input_valid(["./main.py", architecture])
         assert test_valid_input is True
 
-    # Too many arguments are passed. Function should let the user know how to format the input
-    test_too_many_args1 = main.is_user_input_valid(["./main.py", "foo", "bar", "baz"])  # Too many args, all invalid
-    test_too_many_args2 = main.is_user_input_valid(["./main.py", "arm64", "all", "armel"])  # All valid architectures
-    test_too_many_args3 = main.is_user_input_valid(["./main.py", "source", "foo", "armhf"])  # Mix of valid and invalid
-    captured_too_many_args = capsys.readouterr()
-    assert test_too_many_args1 is False
-    assert test_too_many_args2 is False
-    assert test_too_many_args3 is False
-    assert "Usage:" in captured_too_many_args.out
+    # Several architectures are passed. Valid only if every one of them is valid, and the invalid ones are listed
+    test_several_args1 = main.is_user_input_valid(["./main.py", "foo", "bar", "baz"])  # All invalid
+    test_several_args2 = main.is_user_input_valid(["./main.py", "arm64", "all", "armel"])  # All valid architectures
+    test_several_args3 = main.is_user_input_valid(["./main.py", "source", "foo", "armhf"])  # Mix of valid and invalid
+    captured_several_args = capsys.readouterr()
+    assert test_several_args1 is False
+    assert test_several_args2 is True
+    assert test_several_args3 is False
+    assert "Invalid architecture" in captured_several_args.out
+    assert "foo" in captured_several_args.out
+    assert "source, foo" not in captured_several_args.out
+
+    # The flag for all architectures is valid only on its own. Function should let the user know how to format the input
+    test_all_flag = main.is_user_input_valid(["./main.py", cons.ALL_ARCHITECTURES_FLAG])
+    test_all_flag_and_arch = main.is_user_input_valid(["./main.py", cons.ALL_ARCHITECTURES_FLAG, "amd64"])
+    captured_all_flag = capsys.readouterr()
+    assert test_all_flag is True
+    assert test_all_flag_and_arch is False
+    assert "Usage:" in captured_all_flag.out
+
+    return
+
+
+def test_parse_options(tmp_path):
+    # No options passed. Defaults come from constants, and the remaining arguments are left untouched
+    options, arguments = main.parse_options(["./main.py", "amd64"])
+    assert options.cache_size == cons.CACHE_SIZE
+    assert options.show_count == cons.SHOW_COUNT
+    assert options.engine == cons.PARSER_ENGINE
+    assert options.incremental == cons.INCREMENTAL_UPDATES
+    assert arguments == ["./main.py", "amd64"]
+
+    # Options are separated from the architectures wherever they appear
+    options, arguments = main.parse_options(["./main.py", "--show-count", "50", "amd64", "--cache-size=500", "--all",
+                                             "--incremental"])
+    assert options.cache_size == 500
+    assert options.show_count == 50
+    assert options.incremental is True
+    assert arguments == ["./main.py", "amd64", "--all"]
+
+    # Metrics and profiling options take a destination
+    options, arguments = main.parse_options(["./main.py", "--metrics", "log", "amd64", "--profile", "run.prof",
+                                             "--trace-memory"])
+    assert options.metrics == "log"
+    assert options.profile == "run.prof"
+    assert options.trace_memory is True
+    assert arguments == ["./main.py", "amd64"]
+
+    # Mirrors are a comma-separated list of hosts
+    options, arguments = main.parse_options(["./main.py", "--mirrors", "deb.debian.org, localhost:8080", "amd64"])
+    assert options.mirrors == ["deb.debian.org", "localhost:8080"]
+    assert arguments == ["./main.py", "amd64"]
+
+    # A maximum age of zero always asks the mirror for the Release file
+    options, arguments = main.parse_options(["./main.py", "--max-age", "0", "amd64"])
+    assert options.max_age == 0
+
+    # Machine-readable formats can be written to a file, but the table can't
+    options, arguments = main.parse_options(["./main.py", "--format", "csv", "--output", "top.csv", "amd64"])
+    assert (options.format, options.output) == ("csv", "top.csv")
+    for invalid_options in (["--format", "xml"], ["--output", "top.txt"]):
+        with pytest.raises(SystemExit):
+            main.parse_options(["./main.py", *invalid_options, "amd64"])
+
+    # Views are a comma-separated list of built-in views, or of views defined in a rules file
+    options, arguments = main.parse_options(["./main.py", "--views", "no-docs, sections", "amd64"])
+    assert options.views == ["no-docs", "sections"]
+    assert options.count_views == cons.COUNT_VIEWS
+    assert arguments == ["./main.py", "amd64"]
+    rules_path = tmp_path / "views.json"
+    rules_path.write_text('{"libraries": {"include": ["usr/lib/"], "strip_sections": true}}')
+    options, arguments = main.parse_options(["./main.py", "--view-rules", str(rules_path), "--views", "libraries",
+                                             "amd64"])
+    assert options.count_views == {**cons.COUNT_VIEWS, "libraries": {"include": ["usr/lib/"], "strip_sections": True}}
+    rules_path.write_text('{"libraries": {"group_by": "library"}}')
+    for invalid_options in (["--views", "everything"], ["--views", ","], ["--view-rules", str(rules_path)],
+                            ["--view-rules", str(tmp_path / "missing.json")]):
+        with pytest.raises(SystemExit):
+            main.parse_options(["./main.py", *invalid_options, "amd64"])
+
+    # Sizes have to be positive integers
+    for invalid_size in ("0", "-3", "ten"):
+        with pytest.raises(SystemExit):
+            main.parse_options(["./main.py", "--cache-size", invalid_size, "amd64"])
+
+    return
+
+
+def test_query_reverse_index(capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr(main.cons, "REVERSE_INDEX_DIRECTORY", str(tmp_path))
+
+    # Missing arguments or an invalid architecture show the usage instructions
+    main.query_reverse_index(["./main.py", "files", "amd64"])
+    assert "Usage:" in capsys.readouterr().out
+    main.query_reverse_index(["./main.py", "files", "amd65", "bash"])
+    assert "Usage:" in capsys.readouterr().out
+
+    # No index yet
+    main.query_reverse_index(["./main.py", "files", "amd64", "shells/bash"])
+    assert "--build-index" in capsys.readouterr().out
+
+    # One result per line
+    block = b"usr/bin/bash    shells/bash\nbin/sh    shells/bash,shells/dash\n"
+    list(main.rindex.store_index("amd64", '"etag1"', [block]))
+    main.query_reverse_index(["./main.py", "files", "amd64", "shells/bash"])
+    assert capsys.readouterr().out == "bin/sh\nusr/bin/bash\n"
+    main.query_reverse_index(["./main.py", "packages", "amd64", "/bin/sh"])
+    assert capsys.readouterr().out == "shells/bash\nshells/dash\n"
+
+    return
+
+
+def test_query_history(capsys, tmp_path, monkeypatch):
+    monkeypatch.setattr(main.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+
+    # Missing arguments, an invalid architecture, or a number of releases that isn't positive show the usage
+    for arguments in (["growth", "amd64"], ["movers", "amd65"], ["movers", "amd64", "0"],
+                      ["growth", "amd64", "a", "b"]):
+        main.query_history(["./main.py", *arguments])
+        assert "Usage:" in capsys.readouterr().out
+
+    main.query_history(["./main.py", "movers", "amd64"])
+    assert "No history" in capsys.readouterr().out
+
+    main.snapshots.record_snapshot("amd64", "Mon, 01 Jan 2024 00:00:00 GMT", {b"shells/bash": 10, b"net/curl": 5})
+    main.snapshots.record_snapshot("amd64", "Tue, 02 Jan 2024 00:00:00 GMT", {b"shells/bash": 12, b"net/curl": 5})
+    main.query_history(["./main.py", "growth", "amd64", "shells/bash", "5"])
+    growth_output = capsys.readouterr().out
+    assert "10 (+10)" in growth_output and "12 (+2)" in growth_output
+    assert growth_output.index("Mon, 01 Jan 2024") < growth_output.index("Tue, 02 Jan 2024")
+
+    main.query_history(["./main.py", "movers", "amd64"])
+    movers_output = capsys.readouterr().out
+    assert "shells/bash" in movers_output and "+2" in movers_output and "net/curl" not in movers_output
+
+    return
+
+
+def test_show_statistics(capsys, monkeypatch):
+    """Tests that statistics are printed as a table by default, and kept for the end of the run in other formats."""
+    main.show_statistics("amd64", {"shells/bash": 12}, show_name=False)
+    assert "shells/bash" in capsys.readouterr().out
+
+    monkeypatch.setattr(main.cons, "OUTPUT_FORMAT", "json")
+    try:
+        main.show_statistics("amd64", {"shells/bash": 12})
+        assert capsys.readouterr().out == ""
+        assert main.stats_output.format_results(main.stats_output._results, "csv") == ("arch,package,files\n"
+                                                                                       "amd64,shells/bash,12\n")
+    finally:
+        main.stats_output.reset()
+
+    return
+
+
+def test_views(capsys, tmp_path, monkeypatch):
+    """Tests that the chosen views are counted in the same pass as the package counts, and shown from the cache."""
+    monkeypatch.setattr(main.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(main.cons, "BLOB_CACHE_DIRECTORY", str(tmp_path / "blobs"))
+    monkeypatch.setattr(main.cons, "DECOMPRESSION_WORKERS", 1)
+    monkeypatch.setattr(main.cons, "RECORD_SNAPSHOTS", False)
+    monkeypatch.setattr(main.cons, "SELECTED_VIEWS", ["sections", "no-docs"])
+    with open(os.path.join("tests", "test_contents_index.gz"), "rb") as file:
+        list(main.blob.store_blob("amd64", '"etag1"', [file.read()]))
+    validators = {"etag": '"etag1"'}
+
+    assert main.needs_views("amd64", validators)
+    package_counts = main.tally_contents_index("amd64", None, validators)
+    assert not main.needs_views("amd64", validators)
+    assert main.needs_views("amd64", {"etag": '"etag2"'})
+
+    stored_views = main.views.get_stored_views("amd64", '"etag1"')
+    assert sum(stored_views["sections"]["packages"].values()) == sum(package_counts.values())
+    main.show_views("amd64", validators)
+    views_output = capsys.readouterr().out
+    assert "amd64:sections" in views_output and "SECTION" in views_output and "amd64:no-docs" in views_output
+
+    return
+
+
+def test_get_requested_architectures():
+    # Architectures are returned in the order given, without duplicates
+    assert main.get_requested_architectures(["./main.py", "arm64"]) == ["arm64"]
+    assert main.get_requested_architectures(["./main.py", "source", "all", "source"]) == ["source", "all"]
+
+    # The flag for all architectures expands to every valid architecture
+    all_architectures = main.get_requested_architectures(["./main.py", cons.ALL_ARCHITECTURES_FLAG])
+    assert sorted(all_architectures) == sorted(cons.VALID_ARCHITECTURES)
 
     return
 
@@ -69,6 +250,30 @@ def test_exists_valid_cache_entry():
     assert main.exists_valid_cache_entry(good_timestamp_excess_packages, valid_timestamp) is True
     assert main.exists_valid_cache_entry(good_timestamp_just_enough_packages, valid_timestamp) is True
 
+    # An unknown server timestamp can't validate anything
+    assert main.exists_valid_cache_entry({**good_timestamp_excess_packages, "last_modified": ""}, "") is False
+
+    # ETags take precedence over timestamps when both sides have one
+    valid_etag = '"up-to-date-etag"'
+    invalid_etag = '"Not up-to-date-etag"'
+    bad_timestamp_good_etag = {**bad_timestamp_excess_packages, "etag": valid_etag}
+    good_timestamp_bad_etag = {**good_timestamp_excess_packages, "etag": invalid_etag}
+    good_timestamp_no_etag = {**good_timestamp_excess_packages, "etag": ""}
+    assert main.exists_valid_cache_entry(bad_timestamp_good_etag, valid_timestamp, valid_etag) is True
+    assert main.exists_valid_cache_entry(good_timestamp_bad_etag, valid_timestamp, valid_etag) is False
+    assert main.exists_valid_cache_entry(good_timestamp_no_etag, valid_timestamp, valid_etag) is True
+    assert main.exists_valid_cache_entry(bad_timestamp_good_etag, valid_timestamp) is False  # No ETag from the server
+
+    # SHA256s from the Release file take precedence over both, and confirm an entry on their own
+    valid_sha256 = "0" * 64
+    invalid_sha256 = "1" * 64
+    bad_etag_good_sha256 = {**good_timestamp_bad_etag, "sha256": valid_sha256}
+    good_etag_bad_sha256 = {**bad_timestamp_good_etag, "sha256": invalid_sha256}
+    assert main.exists_valid_cache_entry(bad_etag_good_sha256, valid_timestamp, valid_etag, valid_sha256) is True
+    assert main.exists_valid_cache_entry(good_etag_bad_sha256, valid_timestamp, valid_etag, valid_sha256) is False
+    assert main.exists_valid_cache_entry(bad_etag_good_sha256, "", "", valid_sha256) is True
+    assert main.exists_valid_cache_entry(bad_timestamp_good_etag, "", "", valid_sha256) is False  # Not in the entry
+
     return
 
 
@@ -86,15 +291,15 @@ def test_count_package_file_associations():
     each odd numbered package should have a matching number of file associations, and the files associated with each
     even numbered package should be the same as the odd number before it.
 
-    This implicitly tests main.sort_package_file_counts() as well, since count_package_file_associations() calls that
-    function on the result before returning.
+    This implicitly tests main.sort_package_file_counts() as well, since the counts above are
+    passed through it.
     """
     test_contents_index = os.path.join("tests", "test_contents_index.gz")
     with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
-        file_counts = main.count_package_file_associations(file)
+        file_counts = main.sort_package_file_counts(main.tally_package_file_associations(file))
 
     # The correct amount of entries is returned
-    assert len(file_counts) == cons.CACHE_SIZE  # main.count_package_file_associations() returns CACHE_SIZE entries
+    assert len(file_counts) == cons.CACHE_SIZE  # main.sort_package_file_counts() returns CACHE_SIZE entries
 
     # Files are counted correctly, and only for valid packages
     for package, count in file_counts.items():
@@ -117,10 +322,55 @@ def test_count_package_file_associations():
     return
 
 
+def test_count_package_file_associations_bulk():
+    """The bulk-buffer engine must give exactly the same results as the reference engine tested above, no matter where
+    the decompressed blocks it's given are split."""
+    test_contents_index = os.path.join("tests", "test_contents_index.gz")
+    with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
+        reference_file_counts = main.sort_package_file_counts(main.tally_package_file_associations(file))
+
+    with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
+        lines = file.readlines()
+
+    # One block for the whole file, one block per line, and blocks of a few lines each
+    for lines_per_block in (len(lines), 1, 7):
+        blocks = [b"".join(lines[i:i + lines_per_block]) for i in range(0, len(lines), lines_per_block)]
+        file_counts = main.sort_package_file_counts(bulk_parser.tally_package_files(blocks))
+        assert list(file_counts.items()) == list(reference_file_counts.items())
+
+    # Edge cases the bulk engine's pattern has to agree with the reference engine on
+    tricky_lines = [b"path/with spaces/file   section/package1,package2\n",  # Whitespace in a file name
+                    b"no_slash_in_path package3\n",  # Path doesn't contain a "/"
+                    b"file section/package4\n",  # Only the package field contains a "/"
+                    b"\tpath/file\tpackage5  \r\n",  # Tabs and trailing whitespace
+                    b"path/lonely_file\n",  # Only one column
+                    b"\n"]
+    for line in tricky_lines:
+        reference_file_counts = main.sort_package_file_counts(main.tally_package_file_associations([line]))
+        assert main.sort_package_file_counts(bulk_parser.tally_package_files([line])) == reference_file_counts
+
+    return
+
+
+def test_sort_package_file_counts():
+    counts = {b"delta": 5, b"alpha": 7, b"charlie": 5, b"bravo": 5, b"echo": 1}
+
+    # Sorted by count in descending order, with ties broken by name regardless of insertion order
+    assert list(main.sort_package_file_counts(counts, 5).items()) == [("alpha", 7), ("bravo", 5), ("charlie", 5),
+                                                                      ("delta", 5), ("echo", 1)]
+    reversed_counts = dict(reversed(counts.items()))
+    assert main.sort_package_file_counts(reversed_counts, 3) == {"alpha": 7, "bravo": 5, "charlie": 5}
+
+    # Asking for more items than there are returns all of them
+    assert len(main.sort_package_file_counts(counts, 500)) == len(counts)
+
+    return
+
+
 def test_print_architecture_statistics(capsys):
     test_contents_index = os.path.join("tests", "test_contents_index.gz")
     with gzip.GzipFile(filename=test_contents_index, mode="rb") as file:
-        file_counts = main.count_package_file_associations(file)
+        file_counts = main.sort_package_file_counts(main.tally_package_file_associations(file))
 
     main.print_architecture_statistics(file_counts)
     captured = capsys.readouterr()
@@ -140,3 +390,20 @@ def test_print_architecture_statistics(capsys):
         assert str(count) in captured.out
 
     return
+
+
+def test_print_aggregate_statistics(capsys):
+    aggregate_stats = {"architectures": {"amd64": {}, "arm64": {}, "all": {}},
+                       "packages": {"libs/libc6": 19, "shells/bash": 11},
+                       "breakdown": {"libs/libc6": {"amd64": 10, "arm64": 9}, "shells/bash": {"amd64": 5, "all": 6}},
+                       "differences": {"arm64": {"devel/gdb": 7, "devel/gcc": -6}}}
+    main.print_aggregate_statistics(aggregate_stats)
+    captured = capsys.readouterr()
+
+    assert "amd64 + arm64 + all" in captured.out
+    assert "FILES BY ARCHITECTURE" in captured.out
+    assert "amd64 10, arm64 9" in captured.out
+    assert "compared to" in captured.out
+    assert "+7" in captured.out and "-6" in captured.out
+
+    return
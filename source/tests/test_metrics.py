@@ -0,0 +1,91 @@
+import json
+import logging
+import pytest
+import time
+from source import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_phase():
+    """Tests that nested phases are excluded from the time of the phase around them, and that counts are recorded."""
+    with metrics.phase("outer"):
+        time.sleep(0.02)
+        with metrics.phase("inner") as counts:
+            time.sleep(0.05)
+            counts["bytes"] += 100
+            counts["lines"] += 3
+
+    phases = metrics.get_phases()
+    assert phases["inner"]["calls"] == 1
+    assert phases["inner"]["bytes"] == 100
+    assert phases["inner"]["lines"] == 3
+    assert phases["inner"]["seconds"] >= 0.05
+    assert 0.02 <= phases["outer"]["seconds"] < 0.05  # Only its own time, not the inner phase's
+
+    return
+
+
+def test_measure_iter():
+    """Tests that measured items pass through unchanged, with their sizes and lines counted, and that time spent
+    producing them is nested inside the phases of the iterators they're pulled from."""
+    chunks = [b"a\nb\n", b"c\n", b"d"]
+    blocks = metrics.measure_iter("decompress", metrics.measure_iter("download", chunks), count_lines=True)
+    assert list(blocks) == chunks
+
+    phases = metrics.get_phases()
+    assert phases["download"]["bytes"] == 7
+    assert phases["download"]["lines"] == 0
+    assert phases["decompress"]["bytes"] == 7
+    assert phases["decompress"]["lines"] == 3
+
+    return
+
+
+def test_merge_phases():
+    """Tests that phase totals from another process are added to this one's."""
+    with metrics.phase("download") as counts:
+        counts["bytes"] += 10
+
+    metrics.merge_phases({"download": {"calls": 2, "seconds": 1.5, "bytes": 30, "lines": 0, "peak_rss_mb": None},
+                          "parse": {"calls": 1, "seconds": 2.0, "bytes": 0, "lines": 5, "peak_rss_mb": 12.5}})
+    phases = metrics.get_phases()
+    assert phases["download"]["calls"] == 3
+    assert phases["download"]["bytes"] == 40
+    assert phases["download"]["seconds"] >= 1.5
+    assert phases["parse"] == {"calls": 1, "seconds": 2.0, "bytes": 0, "lines": 5, "peak_rss_mb": 12.5}
+
+    return
+
+
+def test_write_report(tmp_path):
+    """Tests that the report is written as JSON, with throughput for phases that moved data."""
+    metrics.merge_phases({"parse": {"calls": 1, "seconds": 2.0, "bytes": 4_000_000, "lines": 1000,
+                                    "peak_rss_mb": None}})
+    metrics_path = tmp_path / "metrics.json"
+    metrics.write_report(str(metrics_path))
+
+    report = json.loads(metrics_path.read_text())
+    assert report["phases"]["parse"]["mb_per_second"] == 2.0
+    assert report["phases"]["parse"]["lines_per_second"] == 500
+    assert report["wall_seconds"] >= 0
+
+    return
+
+
+def test_write_report_to_log(caplog, monkeypatch):
+    """Tests that the report goes to the log at INFO on the metrics logger, which lets it through even though the log
+    only keeps warnings and up."""
+    monkeypatch.setattr(logging.root, "level", logging.WARNING)
+    metrics.write_report(metrics.LOG_DESTINATION)
+
+    [record] = [record for record in caplog.records if record.name == "metrics"]
+    assert record.levelno == logging.INFO
+    assert json.loads(record.getMessage().removeprefix("Run metrics: "))["wall_seconds"] >= 0
+
+    return
@@ -0,0 +1,99 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import pytest
+import requests
+from source import mirrors
+import threading
+
+
+CONTENTS = os.urandom(100_000)
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serves <CONTENTS> at every path, with byte ranges unless the server is set to ignore them."""
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENTS)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", "Sat, 10 Feb 2024 09:30:27 GMT")
+        self.end_headers()
+        return
+
+    def do_GET(self) -> None:
+        self.server.range_requests += 1
+        start, end = map(int, self.headers["Range"].removeprefix("bytes=").split("-"))
+        if self.server.ignore_ranges:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(CONTENTS)))
+            self.end_headers()
+            self.wfile.write(CONTENTS)
+            return
+
+        end = min(end, len(CONTENTS) - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(CONTENTS)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(CONTENTS[start:end + 1])
+        return
+
+    def log_message(self, format: str, *args) -> None:
+        return
+
+
+@pytest.fixture
+def mirror_hosts(monkeypatch):
+    """Starts two local mirrors of <CONTENTS>, and yields their servers, with small ranges so that there are many."""
+    servers = []
+    for _ in range(2):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RangeRequestHandler)
+        server.range_requests = 0
+        server.ignore_ranges = False
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+    hosts = [f"127.0.0.1:{server.server_address[1]}" for server in servers]
+    monkeypatch.setattr(mirrors.cons, "HOST", hosts[0])
+    monkeypatch.setattr(mirrors.cons, "MIRRORS", hosts)
+    monkeypatch.setattr(mirrors.cons, "RANGE_SIZE_MB", 8 / 1024)
+    monkeypatch.setattr(mirrors.cons, "RANGED_DOWNLOAD_MIN_MB", 16 / 1024)
+    monkeypatch.setattr(mirrors.cons, "MAX_PENDING_RANGES", 3)
+    yield servers
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+    return
+
+
+def test_stream_contents_index(mirror_hosts):
+    """Tests that a large file is downloaded in ranges from both mirrors and reassembled in order, and that ranges a
+    mirror gets wrong are taken over by the other one."""
+    assert mirrors.get_range_mirrors("amd64") == (len(CONTENTS), mirrors.get_mirror_hosts())
+    assert b"".join(mirrors.stream_contents_index("amd64")) == CONTENTS
+    assert all(server.range_requests > 0 for server in mirror_hosts)
+
+    mirror_hosts[1].ignore_ranges = True
+    assert b"".join(mirrors.stream_contents_index("amd64")) == CONTENTS
+
+    mirror_hosts[0].ignore_ranges = True
+    with pytest.raises(requests.exceptions.RequestException):
+        b"".join(mirrors.stream_contents_index("amd64"))
+
+    return
+
+
+def test_rank_mirrors(mirror_hosts, monkeypatch):
+    """Tests that mirrors that don't respond are dropped from the ranking."""
+    # A session without retries, so that the unreachable mirror fails right away
+    monkeypatch.setattr(mirrors.cons, "HTTP_RETRIES", 0)
+    monkeypatch.setattr(mirrors.deb, "_session", None)
+    hosts = mirrors.get_mirror_hosts()
+    unreachable_host = "127.0.0.1:1"
+    ranked_hosts = mirrors.rank_mirrors([unreachable_host, *hosts])
+    assert sorted(ranked_hosts) == sorted(hosts)
+    assert mirrors.rank_mirrors([unreachable_host]) == [unreachable_host]
+
+    return
@@ -0,0 +1,13 @@
+from source.package_counts import get_top
+
+
+def test_get_top():
+    """Tests that the top packages come back in descending order of count, with ties broken by name, even when the
+    tie straddles the cut-off."""
+    package_counts = {b"d": 2, b"c": 5, b"b": 2, b"a": 2, b"e": 1}
+    assert get_top(package_counts, 3) == [(b"c", 5), (b"a", 2), (b"b", 2)]
+    assert get_top(package_counts, 10) == [(b"c", 5), (b"a", 2), (b"b", 2), (b"d", 2), (b"e", 1)]
+    assert get_top(package_counts, 0) == []
+    assert get_top({}, 3) == []
+
+    return
@@ -0,0 +1,94 @@
+import gzip
+import os.path
+import pytest
+from source import decompression
+from source import main
+from source import parallel_gzip
+
+
+@pytest.fixture
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_gzip.cons, "BLOB_CACHE_DIRECTORY", str(tmp_path))
+    monkeypatch.setattr(parallel_gzip.cons, "BLOB_CACHE_MAX_MB", 10)
+    monkeypatch.setattr(parallel_gzip.cons, "SEGMENT_SIZE_MB", 0.01)  # About 10 KB, so the test file has several
+    monkeypatch.setattr(parallel_gzip.cons, "DECOMPRESSION_WORKERS", 3)
+    return tmp_path
+
+
+def read_in_chunks(data: bytes, chunk_size: int) -> list[bytes]:
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+@pytest.fixture
+def contents() -> bytes:
+    test_file_path = os.path.join(os.path.dirname(__file__), "test_contents_index.gz")
+    with open(test_file_path, "rb") as file:
+        return file.read()
+
+
+def test_store_segments(cache_directory, contents, monkeypatch):
+    """Tests that blocks pass through unchanged while being stored, that every segment is a whole number of lines, and
+    that the segmented copy decompresses to the same bytes as the original."""
+    blob_path = parallel_gzip.blob.get_blob_path("amd64", '"etag1"')
+    with open(blob_path, "wb") as file:  # Segments are only used alongside a cached blob
+        file.write(contents)
+
+    blocks = list(decompression.iter_gzip_blocks(read_in_chunks(contents, 100)))
+    assert list(parallel_gzip.store_segments("amd64", '"etag1"', blocks)) == blocks
+
+    segments = parallel_gzip.load_index("amd64", '"etag1"')
+    assert len(segments) > 1
+    with open(parallel_gzip.get_segments_path("amd64", '"etag1"'), "rb") as file:
+        segmented_contents = file.read()
+    assert gzip.decompress(segmented_contents) == gzip.decompress(contents)
+
+    for offset, compressed_size, uncompressed_size in segments[:-1]:
+        segment = gzip.decompress(segmented_contents[offset:offset + compressed_size])
+        assert len(segment) == uncompressed_size
+        assert segment.endswith(b"\n")
+
+    # An unfinished pass leaves nothing behind
+    assert parallel_gzip.load_index("amd64", '"etag2"') is None
+    partial_pass = parallel_gzip.store_segments("amd64", '"etag2"', blocks)
+    next(partial_pass)
+    partial_pass.close()
+    expected_paths = [blob_path, parallel_gzip.get_segments_path("amd64", '"etag1"'),
+                      parallel_gzip.get_index_path("amd64", '"etag1"')]
+    assert sorted(os.listdir(cache_directory)) == sorted(os.path.basename(path) for path in expected_paths)
+
+    # With a single worker, nothing would read the copy, so none is written
+    monkeypatch.setattr(parallel_gzip.cons, "DECOMPRESSION_WORKERS", 1)
+    assert list(parallel_gzip.store_segments("amd64", '"etag3"', blocks)) == blocks
+    assert parallel_gzip.load_index("amd64", '"etag3"') is None
+    assert not os.path.exists(parallel_gzip.get_segments_path("amd64", '"etag3"'))
+
+    return
+
+
+def test_group_segments():
+    """Tests that consecutive segments are grouped into contiguous ranges of about equal size."""
+    segments = [[0, 10, 100], [10, 20, 100], [30, 10, 100], [40, 5, 100]]
+    assert parallel_gzip.group_segments(segments, 2) == [(0, 30), (30, 15)]
+    assert parallel_gzip.group_segments(segments, 1) == [(0, 45)]
+    assert parallel_gzip.group_segments(segments, 10) == [(0, 10), (10, 20), (30, 10), (40, 5)]
+
+    return
+
+
+def test_count_segments(cache_directory, contents, monkeypatch):
+    """Tests that counting the segments in parallel gives the same result as counting the original file, with either
+    parsing engine."""
+    with open(parallel_gzip.blob.get_blob_path("amd64", '"etag1"'), "wb") as file:
+        file.write(contents)
+
+    blocks = main.decompress_contents_index(read_in_chunks(contents, 100), "amd64", '"etag1"')
+    expected_counts = main.sort_package_file_counts(main.tally_gzipped_contents(blocks))
+    segments = parallel_gzip.load_index("amd64", '"etag1"')
+    segments_path = parallel_gzip.get_segments_path("amd64", '"etag1"')
+    assert len(segments) > 1
+    assert main.sort_package_file_counts(main.tally_segments(segments_path, segments)) == expected_counts
+
+    monkeypatch.setattr(parallel_gzip.cons, "PARSER_ENGINE", "reference")
+    assert main.sort_package_file_counts(main.tally_segments(segments_path, segments)) == expected_counts
+
+    return
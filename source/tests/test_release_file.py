@@ -0,0 +1,72 @@
+import hashlib
+import pytest
+import requests
+from source import release_file as release
+
+
+RELEASE_TEXT = """Origin: Debian
+Suite: stable
+Components: main contrib non-free-firmware non-free
+MD5Sum:
+ 0123456789abcdef0123456789abcdef  1000 main/Contents-amd64.gz
+SHA256:
+ aaaa000000000000000000000000000000000000000000000000000000000000  1000 main/Contents-amd64.gz
+ bbbb000000000000000000000000000000000000000000000000000000000000  9000 main/Contents-amd64
+ cccc000000000000000000000000000000000000000000000000000000000000  2000 main/Contents-udeb-arm64.gz
+ dddd000000000000000000000000000000000000000000000000000000000000  3000 contrib/Contents-amd64.gz
+ eeee000000000000000000000000000000000000000000000000000000000000  4000 main/binary-amd64/Packages.gz
+"""
+
+
+def test_parse_checksums(monkeypatch):
+    """Tests that only the gzipped contents indices of the component being analyzed are read, from the SHA256
+    section."""
+    monkeypatch.setattr(release.cons, "CONTENT_INDICES_SLUG", "debian/dists/stable/main")
+    assert release.parse_checksums(RELEASE_TEXT) == {"amd64": {"sha256": "aaaa" + "0" * 60, "size": 1000},
+                                                     "udeb-arm64": {"sha256": "cccc" + "0" * 60, "size": 2000}}
+
+    return
+
+
+def test_get_checksums(tmp_path, monkeypatch):
+    """Tests that the cached Release file is used without asking the mirror until it's older than the maximum age, and
+    then revalidated."""
+    monkeypatch.setattr(release.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr(release.cons, "CACHE_PATH", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(release.cons, "CONTENT_INDICES_SLUG", "debian/dists/stable/main")
+    monkeypatch.setattr(release.cons, "RELEASE_MAX_AGE", 300)
+    requested_validators = []
+
+    def read_release_file(cached_validators: dict) -> tuple[dict, str | None]:
+        requested_validators.append(cached_validators.get("etag"))
+        return {"etag": "\"r1\"", "last_modified": ""}, None if cached_validators else RELEASE_TEXT
+
+    monkeypatch.setattr(release.deb, "read_release_file", read_release_file)
+    checksums = release.get_checksums()
+    assert checksums["amd64"] == {"sha256": "aaaa" + "0" * 60, "size": 1000}
+    assert release.get_checksums() == checksums
+    assert requested_validators == [None]
+
+    monkeypatch.setattr(release.cons, "RELEASE_MAX_AGE", 0)
+    assert release.get_checksums() == checksums
+    assert requested_validators == [None, "\"r1\""]
+
+    return
+
+
+def test_verify_chunks():
+    contents = b"contents index " * 1000
+    chunks = [contents[i:i + 1000] for i in range(0, len(contents), 1000)]
+    checksum = {"sha256": hashlib.sha256(contents).hexdigest(), "size": len(contents)}
+
+    # Matching chunks pass through unchanged
+    assert b"".join(release.verify_chunks(chunks, checksum, "amd64")) == contents
+
+    # A truncated, corrupted, or oversized download raises once it's been read
+    bad_downloads = (chunks[:-1], [chunks[0].upper(), *chunks[1:]], [*chunks, b"extra"])
+    for bad_chunks in bad_downloads:
+        with pytest.raises(requests.exceptions.RequestException):
+            for _ in release.verify_chunks(bad_chunks, checksum, "amd64"):
+                pass
+
+    return
@@ -0,0 +1,63 @@
+import os.path
+import pytest
+from source import bulk_parser
+from source import decompression
+from source import reverse_index
+
+
+@pytest.fixture
+def index_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(reverse_index.cons, "REVERSE_INDEX_DIRECTORY", str(tmp_path))
+    return tmp_path
+
+
+@pytest.fixture
+def contents() -> bytes:
+    test_file_path = os.path.join(os.path.dirname(__file__), "test_contents_index.gz")
+    with open(test_file_path, "rb") as file:
+        return file.read()
+
+
+def test_store_index(index_directory, contents):
+    """Tests that blocks pass through unchanged while the index is built, that the stored index is marked with the
+    version it was built from, and that every package owns as many files in it as it has in the counts."""
+    blocks = list(decompression.iter_gzip_blocks([contents[:700], contents[700:]]))
+    assert reverse_index.open_index("amd64") is None
+    assert list(reverse_index.store_index("amd64", '"etag1"', blocks)) == blocks
+
+    assert reverse_index.is_current("amd64", '"etag1"')
+    assert not reverse_index.is_current("amd64", '"etag2"')
+    assert not reverse_index.is_current("arm64", '"etag1"')
+
+    index = reverse_index.open_index("amd64")
+    package_counts = dict(bulk_parser.tally_package_files(blocks))
+    package_counts.pop(b"", None)  # Empty names from stray commas aren't packages
+    assert len(index["packages"]) == len(package_counts)
+    for package, count in package_counts.items():
+        assert len(reverse_index.find_package_files(index, package.decode())) == count
+
+    return
+
+
+def test_find_path_packages(index_directory):
+    """Tests file lookups, including files shared by several packages, names with whitespace, and leading slashes."""
+    block = (b"FILE                                                        LOCATION\n"
+             b"usr/bin/zsh                                                 shells/zsh\n"
+             b"usr/share/doc/a file                                        doc/alpha,doc/beta\n"
+             b"etc/alpha.conf                                              doc/alpha\n"
+             b"usr/bin/bash                                                shells/bash\n")
+    list(reverse_index.store_index("amd64", '"etag1"', [block]))
+    index = reverse_index.open_index("amd64")
+
+    assert reverse_index.find_path_packages(index, "usr/bin/bash") == ["shells/bash"]
+    assert reverse_index.find_path_packages(index, "/usr/bin/zsh") == ["shells/zsh"]
+    assert reverse_index.find_path_packages(index, "./usr/share/doc/a file") == ["doc/alpha", "doc/beta"]
+    assert reverse_index.find_path_packages(index, "usr/bin") == []
+    assert reverse_index.find_path_packages(index, "zzz") == []
+
+    # Packages can be named with or without their section, and files come back sorted
+    assert reverse_index.find_package_files(index, "doc/alpha") == ["etc/alpha.conf", "usr/share/doc/a file"]
+    assert reverse_index.find_package_files(index, "alpha") == ["etc/alpha.conf", "usr/share/doc/a file"]
+    assert reverse_index.find_package_files(index, "gamma") == []
+
+    return
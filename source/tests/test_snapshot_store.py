@@ -0,0 +1,61 @@
+import pytest
+from source import snapshot_store as snapshots
+
+
+@pytest.fixture
+def cache_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshots.cons, "CACHE_DATABASE_PATH", str(tmp_path / "cache.sqlite3"))
+    return tmp_path
+
+
+def test_record_snapshot(cache_paths):
+    """Tests that only newer versions with changed counts are appended, and that each one stores only its changes."""
+    first_counts = {b"shells/bash": 10, b"net/curl": 5, b"x11/old": 2}
+    second_counts = {b"shells/bash": 12, b"net/curl": 5, b"libs/new": 7}
+    assert snapshots.record_snapshot("amd64", "Mon, 01 Jan 2024 00:00:00 GMT", first_counts) is True
+    assert snapshots.record_snapshot("amd64", "Tue, 02 Jan 2024 00:00:00 GMT", second_counts) is True
+
+    # The same version again, an older one, an unchanged newer one, or one with no timestamp aren't appended
+    assert snapshots.record_snapshot("amd64", "Tue, 02 Jan 2024 00:00:00 GMT", second_counts) is False
+    assert snapshots.record_snapshot("amd64", "Sun, 31 Dec 2023 00:00:00 GMT", first_counts) is False
+    assert snapshots.record_snapshot("amd64", "Wed, 03 Jan 2024 00:00:00 GMT", second_counts) is False
+    assert snapshots.record_snapshot("amd64", "", first_counts) is False
+
+    history = snapshots.get_history("amd64")
+    assert history == [("Mon, 01 Jan 2024 00:00:00 GMT", {"shells/bash": 10, "net/curl": 5, "x11/old": 2}),
+                       ("Tue, 02 Jan 2024 00:00:00 GMT", {"shells/bash": 2, "libs/new": 7, "x11/old": -2})]
+    full_counts = {package.decode(): file_count for package, file_count in second_counts.items()}
+    assert snapshots.sum_changes(changes for _, changes in history) == full_counts
+    assert snapshots.get_history("arm64") == []
+
+    # Package names that aren't valid UTF-8 are stored, rather than the whole snapshot being dropped
+    odd_counts = {**second_counts, b"misc/\xff\xfe": 3}
+    assert snapshots.record_snapshot("amd64", "Thu, 04 Jan 2024 00:00:00 GMT", odd_counts) is True
+    assert snapshots.get_history("amd64")[-1][1] == {"misc/\udcff\udcfe": 3}
+    assert snapshots.get_movers(snapshots.get_history("amd64"), 1, 10) == {"misc/\udcff\udcfe": 3}
+
+    return
+
+
+def test_history_queries(cache_paths):
+    """Tests the growth of a single package, and the biggest movers over the last few versions."""
+    versions = [{b"shells/bash": 10, b"net/curl": 5, b"admin/sudo": 1},
+                {b"shells/bash": 12, b"net/curl": 5, b"admin/sudo": 1},
+                {b"shells/bash": 12, b"net/curl": 1, b"admin/sudo": 1},
+                {b"shells/bash": 15, b"net/curl": 1, b"admin/sudo": 2}]
+    for day, package_counts in enumerate(versions, start=1):
+        snapshots.record_snapshot("amd64", f"Mon, {day:02} Jan 2024 00:00:00 GMT", package_counts)
+    history = snapshots.get_history("amd64")
+
+    assert snapshots.get_package_growth(history, "shells/bash", 3) == [("Mon, 02 Jan 2024 00:00:00 GMT", 12, 2),
+                                                                        ("Mon, 03 Jan 2024 00:00:00 GMT", 12, 0),
+                                                                        ("Mon, 04 Jan 2024 00:00:00 GMT", 15, 3)]
+    assert [file_count for _, file_count, _ in snapshots.get_package_growth(history, "libs/missing", 10)] == [0] * 4
+
+    # Ranked by the size of the change, with ties broken by name. The first version isn't a change.
+    assert snapshots.get_movers(history, 2, 10) == {"net/curl": -4, "shells/bash": 3, "admin/sudo": 1}
+    assert snapshots.get_movers(history, 1, 1) == {"shells/bash": 3}
+    assert snapshots.get_movers(history, 100, 10) == {"shells/bash": 5, "net/curl": -4, "admin/sudo": 1}
+    assert snapshots.get_movers(history[:1], 10, 10) == {}
+
+    return
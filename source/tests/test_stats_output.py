@@ -0,0 +1,42 @@
+import csv
+import io
+import json
+from source import stats_output
+
+
+def test_format_results():
+    results = {"amd64": {"shells/bash": 12, "net/curl": 5}, "arm64": {"libs/libc6, x": 9}}
+
+    assert json.loads(stats_output.format_results(results, "json")) == [
+        {"arch": "amd64", "packages": [{"package": "shells/bash", "files": 12}, {"package": "net/curl", "files": 5}]},
+        {"arch": "arm64", "packages": [{"package": "libs/libc6, x", "files": 9}]}]
+
+    # Values that contain the delimiter are quoted, and read back unchanged
+    assert list(csv.reader(io.StringIO(stats_output.format_results(results, "csv")))) == [
+        ["arch", "package", "files"], ["amd64", "shells/bash", "12"], ["amd64", "net/curl", "5"],
+        ["arm64", "libs/libc6, x", "9"]]
+    assert stats_output.format_results(results, "tsv") == ("arch\tpackage\tfiles\namd64\tshells/bash\t12\n"
+                                                           "amd64\tnet/curl\t5\narm64\tlibs/libc6, x\t9\n")
+
+    return
+
+
+def test_write_results(tmp_path, monkeypatch):
+    """Tests that only the shown packages are added, and that the results go to the file if one is given."""
+    monkeypatch.setattr(stats_output.cons, "SHOW_COUNT", 2)
+    stream = io.StringIO()
+    try:
+        stats_output.write_results("csv", "", stream)  # Nothing added yet
+        assert stream.getvalue() == ""
+
+        stats_output.add_statistics("amd64", {"a": 3, "b": 2, "c": 1})
+        stats_output.write_results("tsv", "", stream)
+        assert stream.getvalue() == "arch\tpackage\tfiles\namd64\ta\t3\namd64\tb\t2\n"
+
+        output_path = tmp_path / "top.json"
+        stats_output.write_results("json", str(output_path), stream)
+        assert json.loads(output_path.read_text())[0]["packages"][-1] == {"package": "b", "files": 2}
+    finally:
+        stats_output.reset()
+
+    return
@@ -0,0 +1,74 @@
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from source import stats_server
+import threading
+import time
+
+
+def test_stats_server():
+    """Tests that requests are answered from memory, and that concurrent requests for an architecture that isn't in
+    memory yet share a single refresh."""
+    refreshed_architectures = []
+    refresh_started = threading.Event()
+
+    def refresh(arch: str, arch_stats: dict) -> dict:
+        refreshed_architectures.append(arch)
+        refresh_started.set()
+        time.sleep(0.2)  # Long enough for the other requests to arrive while the refresh is running
+        return {"etag": "\"b\"", "last_modified": "", "packages": {"libs/libc6": 9, "shells/bash": 4}}
+
+    stats = {"amd64": {"etag": "\"a\"", "last_modified": "", "packages": {"net/curl": 7, "admin/sudo": 5, "x/y": 1}}}
+    stats_store = stats_server.StatsStore(refresh, stats)
+    server = stats_server.create_server(stats_store, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        response = requests.get(f"{url}/arch/amd64?top=2")
+        assert response.status_code == 200
+        assert response.json() == {"arch": "amd64", "last_modified": "", "etag": "\"a\"",
+                                   "packages": [{"package": "net/curl", "files": 7},
+                                                {"package": "admin/sudo", "files": 5}]}
+        assert refreshed_architectures == []
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(requests.get, [f"{url}/arch/arm64"] * 4))
+        assert [response.status_code for response in responses] == [200] * 4
+        assert responses[0].json()["packages"][0] == {"package": "libs/libc6", "files": 9}
+        assert refreshed_architectures == ["arm64"]
+
+        assert requests.get(f"{url}/arch/notanarch").status_code == 404
+        for invalid_top in ("zero", "0", "%C2%B2"):  # The last is "²", a digit to str.isdigit() but not to int()
+            assert requests.get(f"{url}/arch/amd64?top={invalid_top}").status_code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+        stats_store.close()
+
+    return
+
+
+def test_stats_store_scheduler():
+    """Tests that the scheduler refreshes every architecture in memory, and that a failed refresh can be retried."""
+    calls = []
+
+    def refresh(arch: str, arch_stats: dict) -> dict:
+        calls.append(arch)
+        if len(calls) == 1:
+            raise OSError("mirror unreachable")
+        return {**arch_stats, "etag": "\"new\""}
+
+    stats_store = stats_server.StatsStore(refresh, {"amd64": {"etag": "\"old\"", "packages": {}}})
+    try:
+        stats_store.start_scheduler(60)
+        for _ in range(100):  # The first refresh fails, and leaves the old statistics in place
+            if calls and not stats_store.pending_refreshes:
+                break
+            time.sleep(0.01)
+        assert stats_store.get_stats("amd64")["etag"] == "\"old\""
+
+        assert stats_store.request_refresh("amd64").result()["etag"] == "\"new\""
+        assert stats_store.get_stats("amd64")["etag"] == "\"new\""
+    finally:
+        stats_store.close()
+
+    return